@@ -3,8 +3,9 @@ import os
 import random
 from datetime import datetime, timedelta
 from flask import current_app
-from models import User, AIChatHistory, UserQuality, Task, DailyStats, db
-from app import db as app_db
+from models import User, AIChatHistory, ChatClearRequest, UserQuality, Task, DailyStats, db
+from extensions import db as app_db
+from cache import app_cache
 import re
 
 class PersonalAIModel:
@@ -69,6 +70,11 @@ class AIFriendService:
         self.personal_ai = PersonalAIModel()
         self.ai_enabled = True  # Our custom AI is always available
     
+    # The date is part of the key since recent_study covers the last 7 days.
+    # Without Redis, other workers' writes don't reach this process's copy, so keep it briefly.
+    @app_cache.memoize(ttl=300, local_ttl=10,
+                       key=lambda self, user: f"{user.id}:{datetime.now().date().isoformat()}",
+                       tags=lambda self, user: [f"user:{user.id}"])
     def get_user_context(self, user):
         """Get comprehensive user context for personalized responses"""
         context = {
@@ -104,7 +110,7 @@ class AIFriendService:
         # Get recent incomplete tasks
         active_tasks = Task.query.filter_by(user_id=user.id, is_completed=False).all()
         context['active_tasks'] = [
-            {'name': task.name, 'duration_minutes': task.duration_minutes}
+            {'name': task.title, 'duration_minutes': task.duration_minutes}
             for task in active_tasks[:5]  # Limit to 5 recent tasks
         ]
         
@@ -302,7 +308,12 @@ class AIFriendService:
     
     def get_chat_history(self, user, limit=20):
         """Get recent chat history for a user"""
+        # Hide messages covered by a clear that the retention service hasn't finished deleting yet
+        cleared_up_to = db.session.query(ChatClearRequest.up_to_id)\
+            .filter_by(user_id=user.id).scalar() or 0
+        
         return AIChatHistory.query.filter_by(user_id=user.id)\
+            .filter(AIChatHistory.id > cleared_up_to)\
             .order_by(AIChatHistory.timestamp.desc())\
             .limit(limit).all()
     
@@ -315,7 +326,9 @@ class AIFriendService:
         self.extract_and_save_qualities(message, user)
         
         # Generate AI response
-        ai_response = self.generate_ai_response(message, user)
+        from metrics import AI_RESPONSE_LATENCY, timed
+        with timed(AI_RESPONSE_LATENCY):
+            ai_response = self.generate_ai_response(message, user)
         
         # Save AI response
         self.save_chat_message(user, 'ai', ai_response)
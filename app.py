@@ -1,104 +1,308 @@
 import os
 import logging
+from datetime import datetime
+import click
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
-from flask_mail import Mail
-from flask_wtf.csrf import CSRFProtect
-from sqlalchemy.orm import DeclarativeBase
+from flask_login import current_user
 from werkzeug.middleware.proxy_fix import ProxyFix
+from extensions import db, login_manager, mail, csrf, migrate
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
-class Base(DeclarativeBase):
-    pass
 
-db = SQLAlchemy(model_class=Base)
-login_manager = LoginManager()
-mail = Mail()
-csrf = CSRFProtect()
+def create_app(config=None):
+    """Create and configure the app
 
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
+    Nothing here starts threads or touches the schema: tables are created by
+    init_db() and the schedulers run in the separate worker process (worker.py).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
 
-# Track user activity on every request
-from flask_login import current_user
-from datetime import datetime
+    # configure the database, relative to the app instance folder
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Mail configuration
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', '587'))
+    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', 'on', '1']
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@darksulfocus.com')
+
+    # Upload configuration
+    app.config['UPLOAD_FOLDER'] = 'static/uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max file size
+    app.config['AVATAR_WORKERS'] = int(os.environ.get('AVATAR_WORKERS', '2'))
+
+    # AI chat retention configuration
+    app.config['CHAT_RETENTION_DAYS'] = int(os.environ.get('CHAT_RETENTION_DAYS', '30'))
+    app.config['CHAT_ARCHIVE_BATCH_SIZE'] = int(os.environ.get('CHAT_ARCHIVE_BATCH_SIZE', '500'))
+
+    # Completed tasks older than this move from the task table to archived_task
+    app.config['TASK_ARCHIVE_DAYS'] = int(os.environ.get('TASK_ARCHIVE_DAYS', '90'))
+    app.config['TASK_ARCHIVE_BATCH_SIZE'] = int(os.environ.get('TASK_ARCHIVE_BATCH_SIZE', '500'))
+
+    # Server-sent events: off unless the web server runs threaded workers (see gunicorn.conf.py)
+    # and the database can fan events out across processes (PostgreSQL)
+    app.config['SSE_ENABLED'] = os.environ.get('SSE_ENABLED', 'false').lower() in ['true', 'on', '1']
+    app.config['SSE_HEARTBEAT_SECONDS'] = int(os.environ.get('SSE_HEARTBEAT_SECONDS', '20'))
+    app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', '300'))
+
+    # Offline sync batches and how long their idempotency records are kept
+    app.config['SYNC_MAX_OPERATIONS'] = int(os.environ.get('SYNC_MAX_OPERATIONS', '200'))
+    app.config['SYNC_RETENTION_DAYS'] = int(os.environ.get('SYNC_RETENTION_DAYS', '30'))
+
+    # Application cache: in-process LRU by default, or Redis shared between workers
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+    app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', '60'))
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+
+    # Rendered page fragments are keyed by data version, so they can live longer
+    app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', '3600'))
+
+    # Query counting: requests over budget and statements repeated this often are logged;
+    # strict mode raises instead, for tests and benchmarks
+    app.config['QUERY_BUDGET'] = int(os.environ.get('QUERY_BUDGET', '50'))
+    app.config['QUERY_REPEAT_THRESHOLD'] = int(os.environ.get('QUERY_REPEAT_THRESHOLD', '5'))
+    app.config['QUERY_BUDGET_STRICT'] = os.environ.get('QUERY_BUDGET_STRICT', 'false').lower() in ['true', 'on', '1']
+
+    # Bearer token required to scrape /metrics; without one it is only served in debug mode
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+    # Set to enable request profiling (X-Profile header) and /_profiler/sampling
+    app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN')
+    app.config['PROFILER_SAMPLE_INTERVAL'] = float(os.environ.get('PROFILER_SAMPLE_INTERVAL', '0.01'))
+
+    # Seconds between batched writes of users' last_active times
+    app.config['PRESENCE_FLUSH_SECONDS'] = int(os.environ.get('PRESENCE_FLUSH_SECONDS', '5'))
+
+    # Per-process cache of logged-in users' identities
+    app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', '30'))
+    app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', '10000'))
+
+    # At most PASSWORD_HASH_WORKERS hashes run at once on the host; hashes made with other parameters are upgraded on login
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+    app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', '32'))
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', '2'))
+    # Lock files that share PASSWORD_HASH_WORKERS between every process on the host (local disk only)
+    app.config['PASSWORD_HASH_SLOT_FOLDER'] = os.environ.get('PASSWORD_HASH_SLOT_FOLDER')
+
+    # Set INIT_DB_ON_STARTUP=true to create or migrate the schema when a web worker boots
+    app.config['INIT_DB_ON_STARTUP'] = os.environ.get('INIT_DB_ON_STARTUP', 'false').lower() in ['true', 'on', '1']
+
+    if config:
+        app.config.update(config)
+
+    # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
+    db.init_app(app)
+    migrate.init_app(app, db, directory=os.path.join(app.root_path, 'migrations'))
+    login_manager.init_app(app)
+    mail.init_app(app)
+    csrf.init_app(app)
+
+    # Login manager configuration
+    login_manager.login_view = 'main.login'  # type: ignore
+    login_manager.login_message = 'Please log in to access this page.'
+    login_manager.login_message_category = 'info'
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        from identity_cache import identity_cache
+        return identity_cache.load_user(int(user_id))
+
+    # Track user activity on every request
+    @app.before_request
+    def update_last_active():
+        if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
+            now = datetime.utcnow()
+            if not current_user.last_active or (now - current_user.last_active).total_seconds() > 60:
+                # Buffered and written in batches by the presence flusher, never inside the request
+                from presence import presence_buffer
+                presence_buffer.touch(current_user.id, now)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create or migrate the schema and the chat search index."""
+        init_db(app)
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Fail if a hot query doesn't use its index."""
+        from query_plans import check_query_plans
+        failures = check_query_plans()
+        if failures is None:
+            click.echo(f"Query plans can't be checked on {db.engine.dialect.name}, skipped")
+            return
+        for name, plan in failures:
+            click.echo(f"{name}: no index used", err=True)
+            for line in plan:
+                click.echo(f"    {line}", err=True)
+        if failures:
+            raise SystemExit(1)
+        click.echo("All hot queries use their indexes")
+
+    @app.cli.command('seed-data')
+    @click.option('--users', 'user_count', type=int, required=True, help='Number of users to generate.')
+    @click.option('--seed', type=int, default=0, show_default=True, help='Same seed, same dataset.')
+    @click.option('--anchor', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Last day of generated activity (default: today).')
+    @click.option('--prefix', default='seed', show_default=True, help='Username prefix.')
+    @click.option('--batch-size', type=int, default=5000, show_default=True, help='Users inserted per transaction.')
+    def seed_data_command(user_count, seed, anchor, prefix, batch_size):
+        """Fill the database with a synthetic dataset for load testing."""
+        from seed_data import seed_database
+        try:
+            totals = seed_database(user_count, seed=seed, anchor=anchor.date() if anchor else None,
+                                   prefix=prefix, batch_size=batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for table_name, count in totals.items():
+            click.echo(f"{table_name}: {count} rows")
+
+    with app.app_context():
+        # Make sure to import the models here or their tables won't be created
+        import models  # noqa: F401
+
+        # Register blueprints
+        from routes import main
+        from email_preferences import email_prefs
+        app.register_blueprint(main)
+        app.register_blueprint(email_prefs)
+
+        if app.config['INIT_DB_ON_STARTUP']:
+            init_db(app)
 
-@app.before_request
-def update_last_active():
-    if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
-        now = datetime.utcnow()
-        if not current_user.last_active or (now - current_user.last_active).total_seconds() > 60:
-            current_user.last_active = now
-            db.session.commit()
-
-# configure the database, relative to the app instance folder
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Mail configuration
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', '587'))
-app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', 'on', '1']
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@darksulfocus.com')
-
-# Upload configuration
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max file size
-
-# initialize the app with the extension, flask-sqlalchemy >= 3.0.x
-db.init_app(app)
-login_manager.init_app(app)
-mail.init_app(app)
-csrf.init_app(app)
-
-# Login manager configuration
-login_manager.login_view = 'main.login'  # type: ignore
-login_manager.login_message = 'Please log in to access this page.'
-login_manager.login_message_category = 'info'
-
-@login_manager.user_loader
-def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
-
-with app.app_context():
-    # Make sure to import the models here or their tables won't be created
-    import models  # noqa: F401
-    
-    # Register blueprints
-    from routes import main
-    from email_preferences import email_prefs
-    app.register_blueprint(main)
-    app.register_blueprint(email_prefs)
-
-    db.create_all()
-    
-    # Create upload directory
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    
+        # Prometheus metrics, served at /metrics
+        from metrics import metrics
+        metrics.init_app(app)
+
+        # Opt-in request and sampling profilers
+        from profiler import profiler
+        profiler.init_app(app)
+
+        # Per-request query counts and N+1 warnings
+        from query_stats import query_stats
+        query_stats.init_app(app)
+
+        # Live events fan out across workers through the database
+        from events import event_broker
+        event_broker.init_app(app, db)
+
+        # Write-behind buffer for last_active tracking
+        from presence import presence_buffer
+        presence_buffer.init_app(app, db)
+
+        # Identity cache for the login manager, invalidated when users are written
+        from identity_cache import identity_cache
+        identity_cache.init_app(app)
+
+        # Application cache for hot reads
+        from cache import app_cache
+        app_cache.init_app(app)
+
+        # Version stamps behind conditional GETs and fragment caching
+        from data_versions import data_versions
+        data_versions.init_app(app)
+
+        # Bounded pool for password hashing
+        from password_hashing import password_hasher
+        password_hasher.init_app(app)
+
+        # Create upload directory
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        # Worker pool that resizes uploaded profile images
+        from avatar_processing import avatar_processor
+        avatar_processor.init_app(app)
+
+        # Fingerprinted, precompressed copies of static CSS and JS
+        from assets import asset_pipeline
+        asset_pipeline.init_app(app)
+
+    return app
+
+
+def init_db(app):
+    """Bring the schema up to date and create the full-text index for AI chat history search
+
+    A new database is created from the models and stamped with the latest
+    migration. One created by db.create_all() before migrations existed is
+    stamped with the baseline revision, then upgraded like any other.
+    """
+    from flask_migrate import stamp, upgrade
+    from sqlalchemy import inspect
+
+    with app.app_context():
+        import models  # noqa: F401
+        inspector = inspect(db.engine)
+        if not inspector.has_table('alembic_version'):
+            new_database = not inspector.has_table('user')
+            db.create_all()
+            stamp(revision='head' if new_database else '0001_baseline')
+        upgrade()
+
+        from chat_search import setup_chat_search
+        setup_chat_search()
+
+
+def init_worker_process(app):
+    """Drop state inherited through fork and start this web worker's own resources
+
+    Called from gunicorn's post_fork hook when the app is preloaded in the master.
+    """
+    with app.app_context():
+        # Pooled connections opened before the fork belong to the master;
+        # close=False leaves them open for it instead of closing them from here
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    # Each worker LISTENs for live events on its own connection
+    from events import event_broker
+    event_broker.start()
+
+
+def start_background_services(app):
+    """Start the schedulers and maintenance threads; only the worker process calls this"""
     # Start email scheduler for automated emails
     try:
         from email_scheduler import email_scheduler
-        email_scheduler.start()
+        email_scheduler.start(app)
         app.logger.info("Email scheduler started successfully")
     except Exception as e:
         app.logger.error(f"Failed to start email scheduler: {e}")
-    
+
     # Start background timer service for auto-completion
     try:
         from background_timer import background_timer_service
-        background_timer_service.start()
+        background_timer_service.start(app)
         app.logger.info("Background timer service started successfully")
     except Exception as e:
         app.logger.error(f"Failed to start background timer service: {e}")
+
+    # Start retention service for chat archival and batched history clears
+    try:
+        from retention_service import retention_service
+        retention_service.start(app)
+        app.logger.info("Retention service started successfully")
+    except Exception as e:
+        app.logger.error(f"Failed to start retention service: {e}")
+
+
+def stop_background_services():
+    """Stop the threads started by start_background_services()"""
+    from email_scheduler import email_scheduler
+    from background_timer import background_timer_service
+    from retention_service import retention_service
+    email_scheduler.stop()
+    background_timer_service.stop()
+    retention_service.stop()
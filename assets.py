@@ -0,0 +1,151 @@
+"""
+Static Asset Pipeline
+Fingerprints the stylesheets and scripts under static/ by content hash when the
+app starts and writes gzip and brotli copies next to them in a cache folder
+(brotli is a dependency; if it is missing only gzip copies are written). url_for('static', ...) resolves to the
+fingerprinted names, which are served with immutable cache headers in the
+best encoding the client accepts. No build step is needed.
+
+The service worker is served from /sw.js with a precache manifest of the
+current fingerprinted URLs prepended, so each deploy changes the worker's bytes
+and it re-caches only the assets whose fingerprints changed.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import secrets
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Must keep a stable URL, so it is never fingerprinted
+SERVICE_WORKER = 'js/service-worker.js'
+UNVERSIONED_ASSETS = {SERVICE_WORKER}
+
+# Unversioned files the service worker refetches for every new manifest
+PRECACHE_SHELL = ('/offline.html', '/static/img/favicon.png')
+
+# Pages cached on install, best effort, so they open offline
+PRECACHE_PAGES = ('/', '/home', '/profile', '/progress', '/help', '/login', '/register')
+
+
+class AssetPipeline:
+    def __init__(self):
+        self.asset_dirs = ('css', 'js')
+        self.cache_folder = None
+        self.manifest = {}
+        self._sources = {}
+        self._static_view = None
+        self.precache_manifest = None
+        self.service_worker_script = None
+
+    def init_app(self, app):
+        self.asset_dirs = app.config.get('ASSET_DIRS', self.asset_dirs)
+        self.cache_folder = app.config.get('ASSET_CACHE_FOLDER') or os.path.join(app.instance_path, 'assets')
+        self.build(app.static_folder)
+        self.build_service_worker(app.static_folder, app.static_url_path)
+
+        app.url_defaults(self._fingerprint_static_url)
+        self._static_view = app.view_functions['static']
+        app.view_functions['static'] = self.serve
+
+    def build(self, static_folder):
+        """Fingerprint every asset and write its compressed copies; returns the manifest"""
+        manifest = {}
+        for asset_dir in self.asset_dirs:
+            for root, _, files in os.walk(os.path.join(static_folder, asset_dir)):
+                for filename in sorted(files):
+                    path = os.path.join(root, filename)
+                    logical = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                    if logical in UNVERSIONED_ASSETS:
+                        continue
+                    manifest[logical] = self._build_asset(path, logical)
+
+        self.manifest = manifest
+        self._sources = {fingerprinted: logical for logical, fingerprinted in manifest.items()}
+        self._write_file('manifest.json', json.dumps(manifest, indent=2, sort_keys=True).encode())
+        logging.info(f"Asset pipeline fingerprinted {len(manifest)} files")
+        return manifest
+
+    def build_service_worker(self, static_folder, static_url_path):
+        """Prepend the precache manifest for the current assets to the service worker"""
+        with open(os.path.join(static_folder, SERVICE_WORKER), encoding='utf-8') as f:
+            source = f.read()
+
+        assets = sorted(f"{static_url_path}/{fingerprinted}" for fingerprinted in self.manifest.values())
+        version = hashlib.sha256(json.dumps([assets, source]).encode()).hexdigest()[:12]
+        self.precache_manifest = {
+            'version': version,
+            'assets': assets,
+            'shell': list(PRECACHE_SHELL),
+            'pages': list(PRECACHE_PAGES),
+        }
+        self.service_worker_script = (
+            f"self.__PRECACHE_MANIFEST = {json.dumps(self.precache_manifest)};\n{source}"
+        )
+        return self.precache_manifest
+
+    def _build_asset(self, path, logical):
+        with open(path, 'rb') as f:
+            content = f.read()
+        stem, ext = os.path.splitext(logical)
+        fingerprinted = f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+        self._write_file(fingerprinted, content)
+        self._write_file(fingerprinted + '.gz', lambda: gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            self._write_file(fingerprinted + '.br', lambda: brotli.compress(content, quality=11))
+        return fingerprinted
+
+    def _write_file(self, name, content):
+        """Write a file into the cache folder unless it already exists
+
+        Fingerprinted names are content-addressed, so an existing file is
+        already correct; the manifest is the only file that gets rewritten.
+        """
+        destination = os.path.join(self.cache_folder, name)
+        if name != 'manifest.json' and os.path.exists(destination):
+            return
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if callable(content):
+            content = content()
+        # Write then rename so concurrent workers never serve a partial file
+        temp_path = f"{destination}.{secrets.token_hex(4)}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, destination)
+
+    def _fingerprint_static_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def serve(self, filename):
+        """Serve a fingerprinted asset in the best available encoding, or fall back to static/"""
+        logical = self._sources.get(filename)
+        if logical is None:
+            return self._static_view(filename=filename)
+
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.exists(os.path.join(self.cache_folder, filename + suffix)):
+                encoding = candidate
+                filename += suffix
+                break
+
+        response = send_from_directory(self.cache_folder, filename,
+                                       mimetype=mimetypes.guess_type(logical)[0],
+                                       max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
+# Global instance
+asset_pipeline = AssetPipeline()
@@ -0,0 +1,287 @@
+"""
+Avatar Processing
+Profile image uploads are written to a staging folder by the request and
+resized on a small worker pool. JPEGs are decoded at reduced scale with
+Image.draft, so full-resolution bitmaps are never built.
+
+Each upload becomes a set of content-addressed variants, named
+{digest}_{size}.jpg and {digest}_{size}.webp, which never change once written
+and are served with immutable cache headers. User.profile_image holds the
+digest; older uploads stored as plain file names in uploads/profiles still work.
+Files no user references are removed by collect_orphans().
+
+A staged upload is only queued in the process that received it, so one whose
+worker restarted before processing it is picked up again by requeue_staged(),
+which the retention service runs with its hourly pass.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from PIL import Image, features
+from werkzeug.utils import secure_filename
+
+AVATAR_SIZES = (64, 128, 300)
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{20}$')
+LEGACY_UPLOAD_PATTERN = re.compile(r'^\d+_[0-9a-f]{16}_')
+STAGED_PATTERN = re.compile(r'^(\d+)_[0-9a-f]{16}_')
+RETRY_PREFIX = 'retry-'
+
+
+def is_processed_avatar(profile_image):
+    """True if profile_image is a content digest rather than a legacy file name"""
+    return bool(profile_image and DIGEST_PATTERN.match(profile_image))
+
+
+def pick_variant(display_size):
+    """Smallest variant at least display_size pixels wide, or the largest one"""
+    for size in AVATAR_SIZES:
+        if size >= display_size:
+            return size
+    return AVATAR_SIZES[-1]
+
+
+class AvatarProcessor:
+    def __init__(self):
+        self.app = None
+        self.max_workers = 2
+        self.staging_folder = None
+        self.output_folder = None
+        self.legacy_folder = None
+        self.webp_enabled = features.check('webp')
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('AVATAR_WORKERS', self.max_workers)
+        self.staging_folder = app.config.get('AVATAR_STAGING_FOLDER') or os.path.join(app.instance_path, 'avatar_staging')
+        self.output_folder = os.path.join(app.root_path, 'static', 'uploads', 'avatars')
+        self.legacy_folder = os.path.join(app.root_path, 'static', 'uploads', 'profiles')
+        os.makedirs(self.staging_folder, exist_ok=True)
+        os.makedirs(self.output_folder, exist_ok=True)
+
+        app.add_template_global(avatar_url)
+        app.add_template_global(avatar_srcset)
+        app.add_template_global(is_processed_avatar)
+
+    def submit(self, user_id, file_storage):
+        """Stage an uploaded image and queue it for processing
+
+        Only the image header is read here, to reject files Pillow can't open.
+        Raises an exception if the upload isn't a readable image.
+        """
+        with Image.open(file_storage.stream) as image:
+            image_format = image.format
+        if image_format not in ('JPEG', 'PNG', 'GIF'):
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        file_storage.stream.seek(0)
+        filename = secure_filename(file_storage.filename) or 'avatar'
+        staged_path = os.path.join(self.staging_folder, f"{user_id}_{secrets.token_hex(8)}_{filename}")
+        file_storage.save(staged_path)
+
+        return self._get_executor().submit(self._process, user_id, staged_path)
+
+    def _get_executor(self):
+        """Create the pool in this process on first use, so forked workers get their own"""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='avatar')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    @staticmethod
+    def file_digest(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:20]
+
+    def write_variants(self, source, digest):
+        """Write every size and format of an avatar; existing files are left alone"""
+        largest = AVATAR_SIZES[-1]
+        with Image.open(source) as image:
+            # Let the JPEG decoder scale down by up to 8x while decoding
+            image.draft('RGB', (largest, largest))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((largest, largest), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+            # Smaller sizes are derived from the largest one, not from the upload
+            for size in reversed(AVATAR_SIZES):
+                variant = image.copy()
+                variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+                self._save(variant, f"{digest}_{size}.jpg", 'JPEG', quality=85, optimize=True)
+                if self.webp_enabled:
+                    self._save(variant, f"{digest}_{size}.webp", 'WEBP', quality=80, method=4)
+
+    def _save(self, image, filename, image_format, **options):
+        destination = os.path.join(self.output_folder, filename)
+        if os.path.exists(destination):
+            return
+        # Write then rename so a half-written file is never served as immutable
+        temp_path = f"{destination}.{secrets.token_hex(4)}.tmp"
+        image.save(temp_path, image_format, **options)
+        os.replace(temp_path, destination)
+
+    def _process(self, user_id, staged_path):
+        from extensions import db
+        from models import User
+
+        with self.app.app_context():
+            try:
+                digest = self.file_digest(staged_path)
+                self.write_variants(staged_path, digest)
+
+                user = db.session.get(User, user_id)
+                if not user:
+                    return None
+
+                # The previous image's files are left for collect_orphans()
+                user.profile_image = digest
+                user.queue_avatar_event()
+                db.session.commit()
+
+                logging.info(f"Processed profile image for user {user_id}")
+                return digest
+            except Exception as e:
+                logging.error(f"Error processing profile image for user {user_id}: {e}")
+                db.session.rollback()
+                return None
+            finally:
+                if os.path.exists(staged_path):
+                    os.remove(staged_path)
+
+    def requeue_staged(self, min_age=600):
+        """Queue staged uploads left behind by a worker that stopped before processing them
+
+        Only the newest upload per user is processed, and only if it is newer
+        than the user's current avatar. Each file gets one retry; the retry
+        prefix keeps an upload that crashes its worker from being queued again.
+        """
+        from extensions import db
+        from models import User
+
+        cutoff = time.time() - min_age
+        newest = {}
+        for filename in os.listdir(self.staging_folder):
+            match = STAGED_PATTERN.match(filename)
+            path = os.path.join(self.staging_folder, filename)
+            try:
+                staged_at = os.path.getmtime(path)
+            except OSError:
+                continue  # Processed since the listing
+            if not match or staged_at >= cutoff:
+                continue
+            user_id = int(match.group(1))
+            if user_id in newest and newest[user_id][0] > staged_at:
+                self._remove_staged(path)
+                continue
+            if user_id in newest:
+                self._remove_staged(newest[user_id][1])
+            newest[user_id] = (staged_at, path)
+
+        requeued = 0
+        for user_id, (staged_at, path) in newest.items():
+            user = db.session.get(User, user_id)
+            if not user or self._avatar_mtime(user.profile_image) > staged_at:
+                self._remove_staged(path)
+                continue
+            retry_path = os.path.join(self.staging_folder, RETRY_PREFIX + os.path.basename(path))
+            try:
+                os.replace(path, retry_path)
+                # collect_orphans() measures a retry's age from when it was queued
+                os.utime(retry_path)
+            except OSError as e:
+                logging.error(f"Error requeueing staged avatar {path}: {e}")
+                continue
+            self._get_executor().submit(self._process, user_id, retry_path)
+            requeued += 1
+
+        if requeued:
+            logging.info(f"Requeued {requeued} staged avatar uploads")
+        return requeued
+
+    def _avatar_mtime(self, profile_image):
+        """When the user's current avatar was written, or 0 if unknown"""
+        if not is_processed_avatar(profile_image):
+            return 0
+        try:
+            return os.path.getmtime(os.path.join(self.output_folder, f"{profile_image}_{AVATAR_SIZES[-1]}.jpg"))
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _remove_staged(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error(f"Error removing staged avatar {path}: {e}")
+
+    def collect_orphans(self, grace_seconds=3600):
+        """Delete avatar files no user references any more
+
+        Files younger than grace_seconds are kept, since an upload being
+        processed writes its files before the user row points at them.
+        Retried uploads still staged after grace_seconds are removed too.
+        """
+        from extensions import db
+        from models import User
+
+        referenced = {row[0] for row in db.session.query(User.profile_image).distinct() if row[0]}
+        cutoff = time.time() - grace_seconds
+        removed = 0
+
+        candidates = []
+        for filename in os.listdir(self.output_folder):
+            candidates.append((self.output_folder, filename, filename.split('_', 1)[0]))
+        if os.path.isdir(self.legacy_folder):
+            for filename in os.listdir(self.legacy_folder):
+                # Only touch files that the old upload code generated
+                if LEGACY_UPLOAD_PATTERN.match(filename):
+                    candidates.append((self.legacy_folder, filename, filename))
+        for filename in os.listdir(self.staging_folder):
+            # Uploads not yet retried are left for requeue_staged()
+            if filename.startswith(RETRY_PREFIX):
+                candidates.append((self.staging_folder, filename, None))
+
+        for folder, filename, key in candidates:
+            if key in referenced:
+                continue
+            path = os.path.join(folder, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError as e:
+                logging.error(f"Error removing orphaned avatar {path}: {e}")
+
+        if removed:
+            logging.info(f"Removed {removed} orphaned avatar files")
+        return removed
+
+
+def avatar_url(profile_image, display_size=AVATAR_SIZES[-1], image_format='jpg'):
+    """URL of the avatar variant best suited to display_size CSS pixels"""
+    from flask import url_for
+    if is_processed_avatar(profile_image):
+        return url_for('main.avatar_file', filename=f"{profile_image}_{pick_variant(display_size)}.{image_format}")
+    return url_for('static', filename='uploads/profiles/' + profile_image)
+
+
+def avatar_srcset(profile_image, display_size, image_format='jpg'):
+    """srcset with 1x and 2x variants for display_size CSS pixels, or '' if the format isn't produced"""
+    if image_format == 'webp' and not avatar_processor.webp_enabled:
+        return ''
+    return ', '.join([
+        f"{avatar_url(profile_image, display_size, image_format)} 1x",
+        f"{avatar_url(profile_image, display_size * 2, image_format)} 2x",
+    ])
+
+# Global instance
+avatar_processor = AvatarProcessor()
@@ -7,15 +7,19 @@ import time
 import threading
 import logging
 import pytz
+from metrics import TIMER_COMPLETION_LAG, time_job
+from query_stats import query_stats
 
 class BackgroundTimerService:
     def __init__(self):
+        self.app = None
         self.running = False
         self.thread = None
         self.check_interval = 60  # Check every 30 seconds
         
-    def start(self):
+    def start(self, app):
         """Start the background timer service"""
+        self.app = app
         if not self.running:
             self.running = True
             self.thread = threading.Thread(target=self._run_checker, daemon=True)
@@ -35,9 +39,7 @@ class BackgroundTimerService:
             try:
                 # Check if we should run based on IST timezone
                 if self._should_run_now():
-                    # Import here to avoid circular imports
-                    from app import app, db
-                    with app.app_context():
+                    with self.app.app_context():
                         self._check_completed_timers()
                         self._check_completed_challenges()
                         self._check_daily_streaks()
@@ -60,16 +62,16 @@ class BackgroundTimerService:
             return False
         return True
     
+    @time_job('background_timer.check_completed_timers')
+    @query_stats.track('background_timer.check_completed_timers')
     def _check_completed_timers(self):
         """Check for timers that should be completed and process them"""
-        from app import db
-        from models import Task, Challenge
+        from extensions import db
+        from models import Task, RunningTimer
         
-        # Find all active tasks that should be completed
-        completed_tasks = Task.query.filter(
-            Task.is_active.is_(True),
-            Task.is_completed.is_(False),
-            Task.expected_completion <= datetime.utcnow()
+        # Find all running timers that are due; finished tasks are never scanned
+        completed_tasks = Task.query.join(Task.running_timer).filter(
+            RunningTimer.expected_completion <= datetime.utcnow()
         ).all()
         
         if completed_tasks:
@@ -77,14 +79,10 @@ class BackgroundTimerService:
             
         for task in completed_tasks:
             try:
-                # Complete the task
-                points_earned = task.complete_task()
-                
-                # Stop the server-side timer
-                task.is_active = False
-                task.started_at = None
-                task.expected_completion = None
+                TIMER_COMPLETION_LAG.observe((datetime.utcnow() - task.expected_completion).total_seconds())
                 
+                # Complete the task, which also stops its server-side timer
+                points_earned = task.complete_task()
                 db.session.commit()
                 
                 # Send achievement email if user has notifications enabled
@@ -109,9 +107,11 @@ class BackgroundTimerService:
         
 
     
+    @time_job('background_timer.check_completed_challenges')
+    @query_stats.track('background_timer.check_completed_challenges')
     def _check_completed_challenges(self):
         """Check for challenges that should be completed and process them"""
-        from app import db
+        from extensions import db
         from models import Challenge
         
         # Find all active challenges that should be completed
@@ -133,6 +133,8 @@ class BackgroundTimerService:
                 logging.error(f"Error completing challenge {challenge.id}: {e}")
                 db.session.rollback()
     
+    @time_job('background_timer.check_daily_streaks')
+    @query_stats.track('background_timer.check_daily_streaks')
     def _check_daily_streaks(self):
         """Check and update streaks for all users daily"""
         try:
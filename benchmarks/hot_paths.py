@@ -0,0 +1,274 @@
+"""
+Hot path benchmarks
+
+Times the app's hot paths against synthetic datasets of several sizes and
+writes the results as JSON, so runs can be compared:
+
+    python benchmarks/hot_paths.py --sizes 1000,10000
+    python benchmarks/hot_paths.py --database-url postgresql://localhost/darkfocus_bench
+    python benchmarks/hot_paths.py --compare benchmarks/results/before.json benchmarks/results/after.json
+
+Each size is seeded with seed_data into a new SQLite file, or, with
+--database-url, into the given PostgreSQL database after dropping its public
+schema, so only point it at a scratch database. Every benchmark reports its
+median and p95 time and the SQL statements it ran per call. Avatar processing
+doesn't touch the database and is timed at several upload resolutions instead.
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+AVATAR_RESOLUTIONS = ((640, 480), (1920, 1080), (4032, 3024))
+CHAT_MESSAGES = ('I feel tired today', 'My favorite subject is physics', 'How can I focus better?',
+                 'I finished my tasks!', 'Give me some motivation')
+
+
+def measure(name, func, setup=None, rounds=20, time_limit=10.0):
+    """Time func over up to rounds calls, stopping early once time_limit seconds are spent
+
+    setup runs before each call, untimed, and its return value is passed to func.
+    """
+    from query_stats import query_stats
+
+    timings = []
+    queries = []
+    started = time.perf_counter()
+    while len(timings) < rounds and (len(timings) < 3 or time.perf_counter() - started < time_limit):
+        args = setup() if setup else ()
+        with query_stats.track(name) as log:
+            call_started = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - call_started)
+        queries.append(log.count)
+
+    timings.sort()
+    return {
+        'rounds': len(timings),
+        'min_ms': timings[0] * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'p95_ms': timings[max(0, int(len(timings) * 0.95) - 1)] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'queries': statistics.median(queries),
+    }
+
+
+def reset_database(app):
+    """Drop everything in a PostgreSQL database so the next size starts empty"""
+    from extensions import db
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("DROP SCHEMA public CASCADE")
+            connection.exec_driver_sql("CREATE SCHEMA public")
+
+
+def database_benchmarks(rounds, time_limit):
+    """(name, func, setup) for every benchmark that runs against the seeded data"""
+    from ai_friend_service import ai_friend_service
+    from email_scheduler import email_scheduler
+    from email_service import EmailService
+    from extensions import db
+    from models import DailyStats, Task, User
+    from routes import build_leaderboard
+    from sqlalchemy import exists
+    import pytz
+
+    # Per-user paths run as the busiest user, whose queries have the most rows to go through
+    user_id = User.query.order_by(User.total_points.desc()).with_entities(User.id).first()[0]
+    # The daily reminder isn't built for users who studied today, so emails go to the busiest one who hasn't
+    today = datetime.now(pytz.timezone('Asia/Kolkata')).date()
+    idle = ~exists().where(DailyStats.user_id == User.id, DailyStats.date == today)
+    recipient_id = User.query.filter(idle).order_by(User.total_points.desc()).with_entities(User.id).first()[0]
+
+    # Sessions are cleared between rounds where the identity map would hide queries
+    def fresh_session():
+        db.session.remove()
+        return ()
+
+    def get_user():
+        db.session.remove()
+        return (db.session.get(User, user_id),)
+
+    def get_recipient():
+        db.session.remove()
+        return (db.session.get(User, recipient_id),)
+
+    def new_task():
+        task = Task(user_id=user_id, title='Benchmark task', duration_minutes=25)
+        db.session.add(task)
+        db.session.commit()
+        return (task,)
+
+    def complete_task(task):
+        task.complete_task()
+        db.session.commit()
+
+    messages = iter(CHAT_MESSAGES * rounds)
+
+    benchmarks = [
+        ('task.complete_task', complete_task, new_task),
+        ('leaderboard.build', build_leaderboard, fresh_session),
+        ('user.check_all_users_streaks', User.check_all_users_streaks, fresh_session),
+        ('email_scheduler.super_motivation_audience', email_scheduler.super_motivation_audience, None),
+        ('email_scheduler.daily_reminder_audience', lambda: email_scheduler.daily_reminder_audience(today), None),
+        ('email_scheduler.streak_warning_audience', lambda: email_scheduler.streak_warning_audience(today), None),
+        ('email_scheduler.weekly_progress_audience', email_scheduler.weekly_progress_audience, None),
+        ('email_scheduler.reengagement_audience',
+         lambda: email_scheduler.reengagement_audience(today - timedelta(days=7)), None),
+        ('email_scheduler.welcome_series_audience',
+         lambda: email_scheduler.welcome_series_audience(datetime.utcnow().date()), None),
+        ('ai_friend.process_user_message',
+         lambda user: ai_friend_service.process_user_message(user, next(messages)), get_user),
+        ('email.daily_reminder', EmailService.send_daily_reminder, get_recipient),
+        ('email.streak_warning', EmailService.send_streak_warning, get_recipient),
+        ('email.weekly_progress', EmailService.send_weekly_progress, get_recipient),
+        ('email.reengagement', EmailService.send_reengagement_email, get_recipient),
+    ]
+    for name, func, setup in benchmarks:
+        yield name, measure(name, func, setup, rounds, time_limit)
+
+
+def avatar_benchmarks(rounds, time_limit):
+    from PIL import Image
+    from avatar_processing import avatar_processor
+
+    folder = tempfile.mkdtemp()
+    avatar_processor.output_folder = folder
+    counter = iter(range(10 ** 9))
+
+    for width, height in AVATAR_RESOLUTIONS:
+        # Gradient plus noise, so the JPEG encoder has realistic work to do
+        gradient = Image.linear_gradient('L').resize((width, height))
+        noise = Image.effect_noise((width, height), 40)
+        source = os.path.join(folder, f"upload_{width}x{height}.jpg")
+        Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(
+            source, 'JPEG', quality=90)
+
+        # Variants that already exist are skipped, so every round writes under a new digest
+        yield ('avatar.write_variants', f"{width}x{height}",
+               measure('avatar.write_variants',
+                       lambda: avatar_processor.write_variants(source, f"{next(counter):020x}"),
+                       rounds=rounds, time_limit=time_limit))
+
+
+def run(args):
+    # create_app() reads its configuration from the environment
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+    os.environ.setdefault('DATABASE_URL', args.database_url or 'sqlite://')
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    from app import create_app, init_db
+    from seed_data import seed_database
+
+    results = []
+    config = {'WTF_CSRF_ENABLED': False, 'MAIL_SUPPRESS_SEND': True, 'QUERY_BUDGET_STRICT': False}
+    folder = tempfile.mkdtemp()
+    for size in args.sizes:
+        url = args.database_url or f"sqlite:///{os.path.join(folder, f'bench_{size}.sqlite')}"
+        app = create_app({**config, 'SQLALCHEMY_DATABASE_URI': url})
+        if args.database_url:
+            reset_database(app)
+        init_db(app)
+
+        with app.app_context():
+            started = time.perf_counter()
+            seed_database(size, seed=args.seed)
+            print(f"{size} users seeded in {time.perf_counter() - started:.1f}s")
+
+        # url_for(_external=True) in the email bodies needs a request
+        with app.test_request_context():
+            for name, stats in database_benchmarks(args.rounds, args.time_limit):
+                results.append({'benchmark': name, 'size': size, **stats})
+                print(f"  {name:<45} {stats['median_ms']:>10.2f} ms  {stats['queries']:>7g} queries")
+
+        with app.app_context():
+            from extensions import db
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+    for name, size, stats in avatar_benchmarks(args.rounds, args.time_limit):
+        results.append({'benchmark': name, 'size': size, **stats})
+        print(f"  {name:<32} {size:>12} {stats['median_ms']:>10.2f} ms")
+
+    return {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': 'postgresql' if args.database_url else 'sqlite',
+        'seed': args.seed,
+        'results': results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    """Print the change in median time and queries between two result files"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    previous = {(row['benchmark'], row['size']): row for row in before['results']}
+    print(f"{'benchmark':<45} {'size':>10} {'before ms':>11} {'after ms':>11} {'change':>8} {'queries':>15}")
+    for row in after['results']:
+        old = previous.get((row['benchmark'], row['size']))
+        if old is None:
+            continue
+        change = (row['median_ms'] - old['median_ms']) / old['median_ms'] * 100 if old['median_ms'] else 0
+        queries = f"{old['queries']:g} -> {row['queries']:g}"
+        print(f"{row['benchmark']:<45} {row['size']!s:>10} {old['median_ms']:>11.2f} "
+              f"{row['median_ms']:>11.2f} {change:>+7.1f}% {queries:>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000',
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help='comma-separated user counts to seed and benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic datasets')
+    parser.add_argument('--rounds', type=int, default=20, help='maximum calls per benchmark')
+    parser.add_argument('--time-limit', type=float, default=10.0,
+                        help='seconds after which a benchmark stops, once it has run 3 times')
+    parser.add_argument('--database-url', default=None,
+                        help='scratch PostgreSQL database to use instead of SQLite; it is emptied first')
+    parser.add_argument('--output', default=None,
+                        help='JSON file for the results (default: benchmarks/results/<time>-<database>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args)
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"{datetime.utcnow():%Y%m%d-%H%M%S}-{report['database']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
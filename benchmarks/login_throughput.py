@@ -0,0 +1,148 @@
+"""
+Login throughput benchmark
+
+Runs concurrent POST /login requests against a throwaway SQLite database and
+reports logins per second, latency percentiles and the most password checks
+that ran at once. With --processes, the clients are spread over forked
+processes the way gunicorn workers are, which shows the host-wide limit on
+hashing at work: peak concurrent checks stay at PASSWORD_HASH_WORKERS, and
+requests that can't get a slot within the queue timeout answer 503.
+
+    python benchmarks/login_throughput.py --threads 8 --requests 200
+    PASSWORD_HASH_WORKERS=2 python benchmarks/login_throughput.py --processes 4 --threads 4 --requests 200
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='total login attempts')
+    parser.add_argument('--processes', type=int, default=1, help='forked client processes, like gunicorn workers')
+    parser.add_argument('--method', default=None, help='PASSWORD_HASH_METHOD to benchmark, e.g. pbkdf2:sha256')
+    args = parser.parse_args()
+
+    # create_app() reads its configuration from the environment
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{db_file}')
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+    if args.method:
+        os.environ['PASSWORD_HASH_METHOD'] = args.method
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    from app import create_app, init_db
+    from extensions import db
+    from models import User
+
+    app = create_app({'WTF_CSRF_ENABLED': False})
+    init_db(app)
+    with app.app_context():
+        user = User.query.filter_by(username='bench_user').first()
+        if not user:
+            user = User(username='bench_user', email='bench@example.com', is_verified=True)
+            user.set_password('benchmark-password')
+            db.session.add(user)
+            db.session.commit()
+
+    form = {
+        'username': 'bench_user',
+        'email': 'bench@example.com',
+        'password': 'benchmark-password',
+    }
+    per_thread = max(1, args.requests // (args.threads * args.processes))
+
+    # Count checks in flight across every process, inherited through fork
+    import password_hashing
+    active = multiprocessing.Value('i', 0)
+    peak = multiprocessing.Value('i', 0)
+    check_password_hash = password_hashing.check_password_hash
+
+    def counted_check(*check_args):
+        with active.get_lock():
+            active.value += 1
+            peak.value = max(peak.value, active.value)
+        try:
+            return check_password_hash(*check_args)
+        finally:
+            with active.get_lock():
+                active.value -= 1
+
+    password_hashing.check_password_hash = counted_check
+
+    started = time.perf_counter()
+    if args.processes == 1:
+        latencies, statuses = run_clients(app, form, args.threads, per_thread)
+    else:
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=run_process, args=(app, form, args.threads, per_thread, results))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        latencies, statuses = [], {}
+        for _ in processes:
+            process_latencies, process_statuses = results.get()
+            latencies.extend(process_latencies)
+            for status, count in process_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+        for process in processes:
+            process.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"hash method:  {app.config['PASSWORD_HASH_METHOD']}")
+    print(f"hash workers: {app.config['PASSWORD_HASH_WORKERS']} per host")
+    print(f"clients:      {args.processes} processes x {args.threads} threads")
+    print(f"logins:       {len(latencies)} in {wall:.2f}s ({len(latencies) / wall:.1f}/s)")
+    print(f"latency p50:  {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"latency p95:  {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"peak checks:  {peak.value} at once")
+    print(f"statuses:     {statuses}")
+
+
+def run_clients(app, form, thread_count, per_thread):
+    """Log in and out per_thread times on each of thread_count threads; returns (latencies, statuses)"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            response = client.post('/login', data=form)
+            elapsed = time.perf_counter() - start
+            client.get('/logout')
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def run_process(app, form, thread_count, per_thread, results):
+    """run_clients in a forked process, like one gunicorn worker"""
+    from extensions import db
+    with app.app_context():
+        # Connections opened before the fork belong to the parent
+        db.engine.dispose(close=False)
+    results.put(run_clients(app, form, thread_count, per_thread))
+
+if __name__ == '__main__':
+    main()
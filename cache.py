@@ -0,0 +1,305 @@
+"""
+Application Cache
+A small cache layer for hot reads. The default backend is an in-process LRU
+with per-entry TTLs; setting CACHE_BACKEND=redis shares entries between
+workers through Redis (the redis package is only needed for that backend).
+
+Entries can carry tags. Models declare the tags their writes affect through a
+cache_tags() method, and every tag touched by a committed transaction is
+invalidated after the commit. Bulk query deletes and updates bypass the unit of
+work, so code running them adds the affected tags with add_cache_tags(). Concurrent misses on the same key are coalesced,
+so only one caller recomputes a cold entry while the rest wait for its result.
+"""
+from collections import OrderedDict
+import functools
+import logging
+import pickle
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """Per-process LRU with TTLs; invalidations only reach this process"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value, tags = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def wait_for_fill(self, key, timeout):
+        # Threads in this process are already coalesced by AppCache
+        return True
+
+    def release_fill(self, key):
+        pass
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisBackend:
+    """Shared cache in Redis; tags are sets of keys, fills are guarded by SET NX locks"""
+
+    def __init__(self, url, prefix='darkfocus:cache:'):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.tag_ttl = 86400
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return _MISSING if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl, tags=()):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            pipe.sadd(tag_key, key)
+            # Tag sets only need to outlive the entries in them
+            pipe.expire(tag_key, max(self.tag_ttl, int(ttl)))
+        pipe.execute()
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = self.client.smembers(tag_key)
+            pipe = self.client.pipeline()
+            for key in keys:
+                pipe.delete(self.prefix + key.decode())
+            pipe.delete(tag_key)
+            pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    def wait_for_fill(self, key, timeout):
+        """Take the fill lock for key, or wait up to timeout for its holder to finish
+
+        Returns True if this caller should compute the value.
+        """
+        lock_key = f"{self.prefix}lock:{key}"
+        if self.client.set(lock_key, b'1', nx=True, px=int(timeout * 1000)):
+            return True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            if not self.client.exists(lock_key):
+                break
+        return False
+
+    def release_fill(self, key):
+        self.client.delete(f"{self.prefix}lock:{key}")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _MISSING
+
+
+class AppCache:
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self.default_ttl = 60
+        self.fill_timeout = 10
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', self.default_ttl)
+        self.fill_timeout = app.config.get('CACHE_FILL_TIMEOUT', self.fill_timeout)
+        if app.config.get('CACHE_BACKEND', 'memory') == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        else:
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 10000))
+
+    @property
+    def shared(self):
+        """True if entries are shared between processes, so every worker sees invalidations"""
+        return isinstance(self.backend, RedisBackend)
+
+    def get(self, key, default=None):
+        value = self._backend_call('get', key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, ttl=None, tags=()):
+        self._backend_call('set', key, value, ttl or self.default_ttl, tags)
+
+    def delete(self, key):
+        self._backend_call('delete', key)
+
+    def invalidate_tags(self, *tags):
+        if tags:
+            self._backend_call('invalidate_tags', tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_or_set(self, key, build, ttl=None, tags=()):
+        """Return the cached value for key, or build and cache it
+
+        Concurrent misses for the same key in this process wait for a single
+        build; with the Redis backend, other processes wait on a fill lock too.
+        Values are shared between callers and must not be mutated.
+        """
+        value = self._backend_call('get', key)
+        if value is not _MISSING:
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            # If the leader fails or stalls, build it ourselves rather than fail
+            if flight.done.wait(self.fill_timeout) and flight.value is not _MISSING:
+                return flight.value
+            return build()
+
+        try:
+            if self._backend_call('wait_for_fill', key, self.fill_timeout, default=True):
+                try:
+                    value = build()
+                    self._backend_call('set', key, value, ttl or self.default_ttl, tags)
+                finally:
+                    self._backend_call('release_fill', key)
+            else:
+                # Another process held the fill lock and has most likely stored the value
+                value = self._backend_call('get', key)
+                if value is _MISSING:
+                    value = build()
+            flight.value = value
+            return value
+        finally:
+            flight.done.set()
+            with self._flights_lock:
+                self._flights.pop(key, None)
+
+    def memoize(self, ttl=None, tags=None, key=None, local_ttl=None):
+        """Cache a function's results
+
+        key(*args, **kwargs) and tags(*args, **kwargs) build the entry's key
+        suffix and tags from the call's arguments; by default the key is the
+        repr of the arguments and there are no tags. local_ttl replaces ttl
+        when the cache isn't shared, since writes in another worker can't
+        invalidate this process's entries.
+        """
+        def decorator(func):
+            name = f"{func.__module__}.{func.__qualname__}"
+
+            def cache_key(*args, **kwargs):
+                suffix = key(*args, **kwargs) if key else repr((args, sorted(kwargs.items())))
+                return f"{name}:{suffix}"
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                entry_tags = tags(*args, **kwargs) if callable(tags) else (tags or ())
+                entry_ttl = ttl if self.shared or local_ttl is None else local_ttl
+                return self.get_or_set(cache_key(*args, **kwargs),
+                                       lambda: func(*args, **kwargs),
+                                       ttl=entry_ttl, tags=entry_tags)
+
+            wrapper.cache_key = cache_key
+            wrapper.invalidate = lambda *args, **kwargs: self.delete(cache_key(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def _backend_call(self, method, *args, default=_MISSING):
+        # A cache outage should slow requests down, not break them
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            logging.error(f"Cache {method} failed: {e}")
+            return default
+
+
+def add_cache_tags(session, *tags):
+    """Invalidate tags once the session's transaction commits"""
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        cache_tags = getattr(instance, 'cache_tags', None)
+        if cache_tags is not None:
+            tags.update(cache_tags())
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cache_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        app_cache.invalidate_tags(*tags)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_cache_tags(session, previous_transaction):
+    session.info.pop('cache_tags', None)
+
+
+# Global instance
+app_cache = AppCache()
@@ -0,0 +1,201 @@
+"""
+AI chat history full-text search
+Uses a stored tsvector column with a GIN index on PostgreSQL and an FTS5 table
+kept in sync by triggers on SQLite.
+
+Only live messages are indexed. Messages older than CHAT_RETENTION_DAYS are
+moved into compressed archives, which are searched separately (and more
+slowly) with archived=True.
+"""
+import logging
+import re
+from sqlalchemy import bindparam, literal, select, text
+from extensions import db
+
+FTS_TABLE = 'ai_chat_history_fts'
+PG_COLUMN = 'message_tsv'
+PG_INDEX = 'ix_ai_chat_history_user_message_tsv'
+PG_OLD_INDEX = 'ix_ai_chat_history_message_fts'
+MAX_PER_PAGE = 50
+
+
+def setup_chat_search():
+    """Create the full-text index for the current database if it doesn't exist"""
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            _setup_postgres()
+        elif dialect == 'sqlite':
+            _setup_sqlite()
+        else:
+            logging.warning(f"Chat search has no full-text index for {dialect}, falling back to LIKE")
+    except Exception as e:
+        logging.error(f"Failed to set up chat search index: {e}")
+        db.session.rollback()
+
+
+def _setup_postgres():
+    # A generated column is computed once per write, so ranking doesn't re-parse every matching message
+    db.session.execute(text(
+        f"ALTER TABLE ai_chat_history ADD COLUMN IF NOT EXISTS {PG_COLUMN} tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', message)) STORED"
+    ))
+    db.session.commit()
+
+    # btree_gin lets one index match the user and the terms together, so a common
+    # word doesn't pull in every user's messages before the user_id filter
+    try:
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+        columns = f"user_id, {PG_COLUMN}"
+    except Exception as e:
+        logging.warning(f"btree_gin unavailable, indexing chat search terms without user_id: {e}")
+        db.session.rollback()
+        columns = PG_COLUMN
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON ai_chat_history USING GIN ({columns})"))
+    db.session.execute(text(f"DROP INDEX IF EXISTS {PG_OLD_INDEX}"))
+    db.session.commit()
+
+
+def _setup_sqlite():
+    exists = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': FTS_TABLE}).first()
+    if exists:
+        return
+
+    statements = [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        "message, content='ai_chat_history', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON ai_chat_history BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message); END",
+        f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON ai_chat_history BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message); END",
+        f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF message ON ai_chat_history BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message); "
+        f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message); END",
+        # Index any rows written before the search table existed
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def _fts5_query(query):
+    """Turn free text into an FTS5 query of quoted terms so user input can't break the syntax"""
+    terms = re.findall(r'\w+', query)
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _like_pattern(query):
+    """A LIKE pattern matching query as a literal substring, escaped with a backslash"""
+    return '%{}%'.format(re.sub(r'([\\%_])', r'\\\1', query))
+
+
+def search_chat_history(user_id, query, page=1, per_page=20, archived=False):
+    """Search a user's chat history, best matches first
+
+    Covers messages from the last CHAT_RETENTION_DAYS; pass archived=True to
+    search the older, archived messages instead, newest first.
+    Returns (results, has_more) where results is a list of dicts.
+    """
+    from models import ChatClearRequest
+
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    # Messages waiting on a batched clear must not show up in search
+    cleared_up_to = db.session.query(ChatClearRequest.up_to_id).filter_by(user_id=user_id).scalar()
+    if archived:
+        # A pending clear covers every archived message, since archives only hold older ones
+        if cleared_up_to is not None:
+            return [], False
+        return _search_archives(user_id, query, page, per_page)
+
+    params = {
+        'user_id': user_id,
+        'cleared_up_to': cleared_up_to or 0,
+        # Fetch one extra row to know whether there is another page without a COUNT
+        'limit': per_page + 1,
+        'offset': (page - 1) * per_page,
+    }
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        params['query'] = query
+        sql = text(
+            f"SELECT id, sender, message, timestamp, ts_rank({PG_COLUMN}, q) AS rank "
+            "FROM ai_chat_history, websearch_to_tsquery('english', :query) AS q "
+            "WHERE user_id = :user_id AND id > :cleared_up_to "
+            f"AND {PG_COLUMN} @@ q "
+            "ORDER BY rank DESC, id DESC LIMIT :limit OFFSET :offset"
+        )
+    elif dialect == 'sqlite':
+        params['query'] = _fts5_query(query)
+        if not params['query']:
+            return [], False
+        sql = text(
+            "SELECT h.id, h.sender, h.message, h.timestamp, "
+            f"-bm25({FTS_TABLE}) AS rank "
+            f"FROM {FTS_TABLE} JOIN ai_chat_history AS h ON h.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :query AND h.user_id = :user_id AND h.id > :cleared_up_to "
+            f"ORDER BY bm25({FTS_TABLE}), h.id DESC LIMIT :limit OFFSET :offset"
+        )
+    else:
+        from models import AIChatHistory
+        params['query'] = _like_pattern(query)
+        sql = select(
+            AIChatHistory.id, AIChatHistory.sender, AIChatHistory.message, AIChatHistory.timestamp,
+            literal(0).label('rank')
+        ).where(
+            AIChatHistory.user_id == bindparam('user_id'),
+            AIChatHistory.id > bindparam('cleared_up_to'),
+            AIChatHistory.message.like(bindparam('query'), escape='\\')
+        ).order_by(AIChatHistory.id.desc()).limit(bindparam('limit')).offset(bindparam('offset'))
+
+    rows = db.session.execute(sql, params).all()
+    results = [
+        {
+            'id': row.id,
+            'sender': row.sender,
+            'message': row.message,
+            'timestamp': row.timestamp.isoformat() if hasattr(row.timestamp, 'isoformat') else row.timestamp,
+            'rank': float(row.rank or 0),
+        }
+        for row in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
+
+
+def _search_archives(user_id, query, page, per_page):
+    """Scan a user's archived messages for every word in query, newest first
+
+    Archives are compressed blobs with no index, so each search decompresses
+    them in turn and stops once the requested page is full.
+    """
+    from models import AIChatArchive
+
+    terms = [term.lower() for term in re.findall(r'\w+', query)]
+    if not terms:
+        return [], False
+
+    # One extra match tells whether there is another page
+    wanted = page * per_page + 1
+    matches = []
+    archives = AIChatArchive.query.filter_by(user_id=user_id).order_by(AIChatArchive.last_message_at.desc())
+    for archive in archives.yield_per(20):
+        for message in reversed(archive.unpack_messages()):
+            text_lower = message['message'].lower()
+            if all(term in text_lower for term in terms):
+                matches.append({
+                    'id': None,
+                    'sender': message['sender'],
+                    'message': message['message'],
+                    'timestamp': message['timestamp'],
+                    'rank': 0.0,
+                    'archived': True,
+                })
+        if len(matches) >= wanted:
+            break
+
+    start = (page - 1) * per_page
+    return matches[start:start + per_page], len(matches) > start + per_page
@@ -0,0 +1,120 @@
+"""
+Data Versions
+Version stamps for the data behind cacheable pages. Flushing a change to a
+user's displayed fields or daily stats bumps "user:<id>". The leaderboard's
+version is a digest of the rows it shows, read through the total points index,
+so writes never touch a shared row and the version only moves when the board
+would. Pages build their ETags and fragment cache keys from these versions, so
+they can answer If-None-Match with 304 and reuse rendered fragments until the
+data actually changes.
+"""
+import hashlib
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session
+from cache import app_cache
+
+LEADERBOARD_SIZE = 10
+
+# User columns that the sidebar, progress page or leaderboard display
+DISPLAYED_USER_FIELDS = ('username', 'email', 'profile_image', 'total_points', 'current_streak',
+                         'max_streak', 'total_study_time')
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+class DataVersions:
+    def __init__(self, fragment_ttl=3600):
+        self.fragment_ttl = fragment_ttl
+
+    def init_app(self, app):
+        self.fragment_ttl = app.config.get('FRAGMENT_CACHE_TTL', self.fragment_ttl)
+
+    def get(self, *scopes):
+        """Current versions of scopes, in order; 0 for scopes never bumped"""
+        from models import DataVersion
+        rows = dict(DataVersion.query.with_entities(DataVersion.scope, DataVersion.version)
+                    .filter(DataVersion.scope.in_(scopes)))
+        return tuple(rows.get(scope, 0) for scope in scopes)
+
+    def leaderboard_version(self):
+        """Digest of everything the leaderboard shows about its top users"""
+        from models import User
+        columns = [User.id] + [getattr(User, field) for field in DISPLAYED_USER_FIELDS]
+        rows = User.query.with_entities(*columns).order_by(User.total_points.desc()).limit(LEADERBOARD_SIZE).all()
+        return hashlib.sha256(repr([tuple(row) for row in rows]).encode()).hexdigest()[:16]
+
+    def bump(self, session, *scopes):
+        """Increment scopes inside the session's current transaction"""
+        from models import DataVersion
+        table = DataVersion.__table__
+        dialect = session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            for scope in sorted(scopes):
+                result = session.execute(
+                    update(table).where(table.c.scope == scope).values(version=table.c.version + 1)
+                )
+                if result.rowcount == 0:
+                    session.execute(table.insert().values(scope=scope, version=1))
+            return
+
+        # Sorted, so concurrent transactions lock the rows in the same order
+        for scope in sorted(scopes):
+            statement = insert(table).values(scope=scope, version=1)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.scope],
+                set_={'version': table.c.version + 1}
+            ))
+
+    def fragment(self, key, build):
+        """Return the cached value for key, building it on a miss
+
+        Keys must include the data versions the value was built from, so a
+        bump makes old entries unreachable; they expire from the app cache.
+        """
+        return app_cache.get_or_set('fragment:' + ':'.join(str(part) for part in key), build,
+                                    ttl=self.fragment_ttl)
+
+
+def _changed_scopes(session):
+    from models import User, DailyStats
+
+    scopes = set()
+    for instance in session.new:
+        if isinstance(instance, DailyStats):
+            scopes.add(user_scope(instance.user_id))
+
+    for instance in session.dirty:
+        if isinstance(instance, User):
+            state = inspect(instance)
+            if any(state.attrs[field].history.has_changes() for field in DISPLAYED_USER_FIELDS):
+                scopes.add(user_scope(instance.id))
+        elif isinstance(instance, DailyStats) and session.is_modified(instance):
+            scopes.add(user_scope(instance.user_id))
+
+    for instance in session.deleted:
+        if isinstance(instance, DailyStats):
+            scopes.add(user_scope(instance.user_id))
+
+    return scopes
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_scopes(session, flush_context, instances):
+    session.info.setdefault('changed_data_scopes', set()).update(_changed_scopes(session))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_scopes(session, flush_context):
+    scopes = session.info.pop('changed_data_scopes', None)
+    if scopes:
+        data_versions.bump(session, *scopes)
+
+
+# Global instance
+data_versions = DataVersions()
@@ -1,7 +1,7 @@
 """Email preferences management for DARKSULFOCUS"""
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required, current_user
-from app import db
+from extensions import db
 
 email_prefs = Blueprint('email_prefs', __name__)
 
@@ -3,21 +3,19 @@ from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime, timedelta
 import pytz
 import logging
+from metrics import email_queue, time_job
+from query_stats import query_stats
 
 class EmailScheduler:
+    @time_job('email_scheduler.send_super_motivation_emails')
+    @query_stats.track('email_scheduler.send_super_motivation_emails')
     def send_super_motivation_emails(self):
         """Send super motivation emails to all users"""
-        from app import db, app
-        from models import User
         from email_service import EmailService
-        with app.app_context():
+        with self.app.app_context():
             try:
-                users = db.session.query(User).filter(
-                    User.is_verified == True,
-                    User.email_notifications == True
-                ).all()
                 count = 0
-                for user in users:
+                for user in email_queue(self.super_motivation_audience()):
                     if EmailService.send_super_motivation_email(user):
                         count += 1
                 logging.info(f"Sent {count} super motivation emails")
@@ -26,6 +24,7 @@ class EmailScheduler:
     """Background email scheduler for automated email campaigns"""
     
     def __init__(self):
+        self.app = None
         self.scheduler = BackgroundScheduler()
         self.setup_jobs()
     
@@ -86,8 +85,9 @@ class EmailScheduler:
             replace_existing=True
         )
     
-    def start(self):
+    def start(self, app):
         """Start the email scheduler"""
+        self.app = app
         if not self.scheduler.running:
             self.scheduler.start()
             logging.info("Email scheduler started")
@@ -98,94 +98,154 @@ class EmailScheduler:
             self.scheduler.shutdown()
             logging.info("Email scheduler stopped")
     
+    # Audiences: who each job emails. Call inside an app context.
+
+    def super_motivation_audience(self):
+        """Verified users with email notifications on"""
+        from extensions import db
+        from models import User
+        return db.session.query(User).filter(
+            User.is_verified == True,
+            User.email_notifications == True
+        ).all()
+
+    def daily_reminder_audience(self, today):
+        """Verified users with daily reminders on who haven't studied today"""
+        from extensions import db
+        from models import User, DailyStats
+        users = db.session.query(User).filter(
+            User.is_verified.is_(True),
+            User.daily_reminders.is_(True)
+        ).all()
+        
+        audience = []
+        for user in users:
+            # Check if user has studied today
+            daily_stat = DailyStats.query.filter_by(
+                user_id=user.id, 
+                date=today
+            ).first()
+            
+            if not daily_stat or daily_stat.minutes_studied == 0:
+                audience.append(user)
+        return audience
+
+    def streak_warning_audience(self, today):
+        """Verified users with an active streak who haven't studied today"""
+        from extensions import db
+        from models import User, DailyStats
+        users_at_risk = db.session.query(User).filter(
+            User.current_streak > 0,
+            User.is_verified.is_(True),
+            User.email_notifications.is_(True)
+        ).all()
+        
+        audience = []
+        for user in users_at_risk:
+            # Check if user hasn't studied today
+            daily_stat = DailyStats.query.filter_by(
+                user_id=user.id, 
+                date=today
+            ).first()
+            
+            if not daily_stat or daily_stat.minutes_studied == 0:
+                audience.append(user)
+        return audience
+
+    def weekly_progress_audience(self):
+        """Verified users with weekly summaries on"""
+        from extensions import db
+        from models import User
+        return db.session.query(User).filter(
+            User.is_verified.is_(True),
+            User.weekly_summaries.is_(True)
+        ).all()
+
+    def reengagement_audience(self, week_ago):
+        """Verified users with email notifications on who haven't studied since week_ago"""
+        from extensions import db
+        from models import User, DailyStats
+        users = db.session.query(User).filter(
+            User.is_verified.is_(True),
+            User.email_notifications.is_(True)
+        ).all()
+        
+        audience = []
+        for user in users:
+            # Check if user has any recent activity
+            recent_stats = DailyStats.query.filter(
+                DailyStats.user_id == user.id,
+                DailyStats.date >= week_ago,
+                DailyStats.minutes_studied > 0
+            ).first()
+            
+            if not recent_stats:
+                audience.append(user)
+        return audience
+
+    def welcome_series_audience(self, today):
+        """Verified users who registered the day before today (for the day 1 email)"""
+        from extensions import db
+        from models import User
+        yesterday = today - timedelta(days=1)
+        return db.session.query(User).filter(
+            User.joined_date >= yesterday,
+            User.joined_date < today,
+            User.is_verified.is_(True)
+        ).all()
+
+    @time_job('email_scheduler.send_daily_reminders')
+    @query_stats.track('email_scheduler.send_daily_reminders')
     def send_daily_reminders(self):
         """Send daily study reminders to users who haven't studied today"""
-        from app import db
-        from models import User, DailyStats
         from email_service import EmailService
-        from app import app
         
-        with app.app_context():
+        with self.app.app_context():
             try:
                 ist = pytz.timezone('Asia/Kolkata')
                 today = datetime.now(ist).date()
                 
-                # Get users who haven't studied today and are active
-                users_to_remind = db.session.query(User).filter(
-                    User.is_verified.is_(True),
-                    User.daily_reminders.is_(True)
-                ).all()
-                
                 reminder_count = 0
-                for user in users_to_remind:
-                    # Check if user has studied today
-                    daily_stat = DailyStats.query.filter_by(
-                        user_id=user.id, 
-                        date=today
-                    ).first()
-                    
-                    if not daily_stat or daily_stat.minutes_studied == 0:
-                        if EmailService.send_daily_reminder(user):
-                            reminder_count += 1
+                for user in email_queue(self.daily_reminder_audience(today)):
+                    if EmailService.send_daily_reminder(user):
+                        reminder_count += 1
                 
                 logging.info(f"Sent {reminder_count} daily reminder emails")
                 
             except Exception as e:
                 logging.error(f"Error sending daily reminders: {e}")
     
+    @time_job('email_scheduler.send_streak_warnings')
+    @query_stats.track('email_scheduler.send_streak_warnings')
     def send_streak_warnings(self):
         """Send streak warning emails to users about to lose their streak"""
-        from app import db
-        from models import User, DailyStats
         from email_service import EmailService
-        from app import app
         
-        with app.app_context():
+        with self.app.app_context():
             try:
                 ist = pytz.timezone('Asia/Kolkata')
                 today = datetime.now(ist).date()
                 
-                # Get users with active streaks who haven't studied today
-                users_at_risk = db.session.query(User).filter(
-                    User.current_streak > 0,
-                    User.is_verified.is_(True),
-                    User.email_notifications.is_(True)
-                ).all()
-                
                 warning_count = 0
-                for user in users_at_risk:
-                    # Check if user hasn't studied today
-                    daily_stat = DailyStats.query.filter_by(
-                        user_id=user.id, 
-                        date=today
-                    ).first()
-                    
-                    if not daily_stat or daily_stat.minutes_studied == 0:
-                        if EmailService.send_streak_warning(user):
-                            warning_count += 1
+                for user in email_queue(self.streak_warning_audience(today)):
+                    if EmailService.send_streak_warning(user):
+                        warning_count += 1
                 
                 logging.info(f"Sent {warning_count} streak warning emails")
                 
             except Exception as e:
                 logging.error(f"Error sending streak warnings: {e}")
     
+    @time_job('email_scheduler.send_weekly_progress')
+    @query_stats.track('email_scheduler.send_weekly_progress')
     def send_weekly_progress(self):
         """Send weekly progress summaries"""
-        from app import db
-        from models import User, DailyStats
         from email_service import EmailService
-        from app import app
         
-        with app.app_context():
+        with self.app.app_context():
             try:
-                # Get all active users
-                active_users = db.session.query(User).filter(
-                    User.is_verified.is_(True),
-                    User.weekly_summaries.is_(True)
-                ).all()
-                
                 progress_count = 0
-                for user in active_users:
+                for user in email_queue(self.weekly_progress_audience()):
                     if EmailService.send_weekly_progress(user):
                         progress_count += 1
                 
@@ -194,63 +254,39 @@ class EmailScheduler:
             except Exception as e:
                 logging.error(f"Error sending weekly progress emails: {e}")
     
+    @time_job('email_scheduler.send_reengagement_emails')
+    @query_stats.track('email_scheduler.send_reengagement_emails')
     def send_reengagement_emails(self):
         """Send re-engagement emails to inactive users"""
-        from app import db
-        from models import User, DailyStats
         from email_service import EmailService
-        from app import app
         
-        with app.app_context():
+        with self.app.app_context():
             try:
                 ist = pytz.timezone('Asia/Kolkata')
                 week_ago = datetime.now(ist).date() - timedelta(days=7)
                 
-                # Find users who haven't studied in the last 7 days
-                inactive_users = db.session.query(User).filter(
-                    User.is_verified.is_(True),
-                    User.email_notifications.is_(True)
-                ).all()
-                
                 reengagement_count = 0
-                for user in inactive_users:
-                    # Check if user has any recent activity
-                    recent_stats = DailyStats.query.filter(
-                        DailyStats.user_id == user.id,
-                        DailyStats.date >= week_ago,
-                        DailyStats.minutes_studied > 0
-                    ).first()
-                    
-                    if not recent_stats:
-                        if EmailService.send_reengagement_email(user):
-                            reengagement_count += 1
+                for user in email_queue(self.reengagement_audience(week_ago)):
+                    if EmailService.send_reengagement_email(user):
+                        reengagement_count += 1
                 
                 logging.info(f"Sent {reengagement_count} re-engagement emails")
                 
             except Exception as e:
                 logging.error(f"Error sending re-engagement emails: {e}")
     
+    @time_job('email_scheduler.send_welcome_series')
+    @query_stats.track('email_scheduler.send_welcome_series')
     def send_welcome_series(self):
         """Send welcome series emails to new users"""
-        from app import db
-        from models import User, DailyStats
         from email_service import EmailService
-        from app import app
         
-        with app.app_context():
+        with self.app.app_context():
             try:
                 today = datetime.utcnow().date()
-                yesterday = today - timedelta(days=1)
-                
-                # Find users who registered yesterday (for day 1 email)
-                new_users = db.session.query(User).filter(
-                    User.joined_date >= yesterday,
-                    User.joined_date < today,
-                    User.is_verified.is_(True)
-                ).all()
                 
                 welcome_count = 0
-                for user in new_users:
+                for user in email_queue(self.welcome_series_audience(today)):
                     if EmailService.send_welcome_series_day1(user):
                         welcome_count += 1
                 
@@ -55,7 +55,7 @@ class EmailService:
     def send_verification_email(user):
         """Send email verification to user"""
         template = EmailService.get_email_template_base()
-        token = user.verification_token
+        token = user.get_verification_token()
         
         msg = Message(
             'Verify Your DARKSULFOCUS Account',
@@ -104,7 +104,7 @@ class EmailService:
     def send_reset_email(user):
         """Send password reset email to user"""
         template = EmailService.get_email_template_base()
-        token = user.reset_token
+        token = user.get_reset_token()
         
         msg = Message(
             'Reset Your DARKSULFOCUS Password',
@@ -267,7 +267,7 @@ class EmailService:
     @staticmethod
     def send_weekly_progress(user):
         """Send weekly progress summary"""
-        from app import db
+        from extensions import db
         from models import DailyStats
         
         template = EmailService.get_email_template_base()
@@ -785,11 +785,15 @@ class EmailService:
     @staticmethod
     def _send_email(msg):
         """Helper method to send email with error handling"""
+        from metrics import EMAILS_SENT, EMAIL_SEND_LATENCY, timed
         try:
-            from app import mail
-            mail.send(msg)
+            from extensions import mail
+            with timed(EMAIL_SEND_LATENCY):
+                mail.send(msg)
+            EMAILS_SENT.labels('sent').inc()
             current_app.logger.info(f'Email sent successfully to {msg.recipients}')
             return True
         except Exception as e:
+            EMAILS_SENT.labels('failed').inc()
             current_app.logger.error(f'Failed to send email: {e}')
             return False
\ No newline at end of file
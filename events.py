@@ -0,0 +1,156 @@
+"""
+Live Events
+Per-user pub/sub behind the /events server-sent-events stream. Events are
+queued on the database session and only published once it commits, then fanned
+out to every web worker through PostgreSQL LISTEN/NOTIFY (or in-process only
+on other databases).
+
+The stream is only offered when SSE_ENABLED is set and the database is
+PostgreSQL. In-process delivery would never see events published by worker.py,
+such as background timer completions, so without NOTIFY pages keep polling.
+"""
+from collections import defaultdict
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+NOTIFY_CHANNEL = 'darkfocus_events'
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self.engine = None
+        self.enabled = False
+        self.listener_thread = None
+        self.listener_pid = None
+
+    def subscribe(self, user_id, maxsize=100):
+        """Register a queue that receives every event for a user"""
+        self._ensure_listener()
+        subscriber = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        """Remove a queue registered with subscribe()"""
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def deliver(self, user_id, event_name, data):
+        """Hand an event to this process's subscribers for a user"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event_name, data))
+            except queue.Full:
+                # A stalled client shouldn't hold up everyone else
+                logging.warning(f"Dropping {event_name} event for slow subscriber of user {user_id}")
+
+    def publish(self, user_id, event_name, data):
+        """Publish an event to every worker, falling back to this process only"""
+        if self._uses_notify():
+            try:
+                payload = json.dumps({'user_id': user_id, 'event': event_name, 'data': data})
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                 {'channel': NOTIFY_CHANNEL, 'payload': payload})
+                    conn.commit()
+                return
+            except Exception as e:
+                logging.error(f"Failed to NOTIFY {event_name} event: {e}")
+        self.deliver(user_id, event_name, data)
+
+    def init_app(self, app, db):
+        """Remember the engine used to NOTIFY and LISTEN across workers"""
+        with app.app_context():
+            self.engine = db.engine
+
+        self.enabled = app.config.get('SSE_ENABLED', False) and self._uses_notify()
+        if app.config.get('SSE_ENABLED') and not self.enabled:
+            logging.warning("SSE_ENABLED is ignored: live events need PostgreSQL to reach web workers from worker.py")
+        # Pages only open the stream when it can carry every event; otherwise they poll
+        app.add_template_global(self.enabled, 'live_events_enabled')
+
+    def start(self):
+        """Start this process's LISTEN thread now rather than on first subscribe"""
+        if self.enabled:
+            self._ensure_listener()
+
+    def _uses_notify(self):
+        return self.engine is not None and self.engine.dialect.name == 'postgresql'
+
+    def _ensure_listener(self):
+        """Start the LISTEN thread in this process if it isn't running"""
+        if not self._uses_notify():
+            return
+        with self._lock:
+            if self.listener_pid == os.getpid() and self.listener_thread and self.listener_thread.is_alive():
+                return
+            self.listener_pid = os.getpid()
+            self.listener_thread = threading.Thread(target=self._listen, daemon=True)
+            self.listener_thread.start()
+
+    def _listen(self):
+        """Relay NOTIFY payloads from PostgreSQL to local subscribers"""
+        while True:
+            connection = None
+            try:
+                connection = self.engine.raw_connection()
+                dbapi_connection = connection.driver_connection
+                dbapi_connection.autocommit = True
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                logging.info(f"Listening for live events on {NOTIFY_CHANNEL}")
+
+                while True:
+                    if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        message = json.loads(notify.payload)
+                        self.deliver(message['user_id'], message['event'], message['data'])
+            except Exception as e:
+                logging.error(f"Live event listener error, reconnecting: {e}")
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate()
+                    except Exception:
+                        pass
+
+
+def queue_event(session, user_id, event_name, data):
+    """Queue an event to be published once the session's transaction commits"""
+    session.info.setdefault('pending_events', []).append((user_id, event_name, data))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending_events(session):
+    pending = session.info.pop('pending_events', None)
+    for user_id, event_name, data in pending or ():
+        event_broker.publish(user_id, event_name, data)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending_events(session, previous_transaction):
+    session.info.pop('pending_events', None)
+
+
+# Global instance
+event_broker = EventBroker()
@@ -0,0 +1,124 @@
+"""
+Gunicorn configuration
+The app is imported once in the master (preload_app) and forked into the
+workers, so its code and read-only data are shared copy-on-write. Everything
+that must not cross a fork (pooled DB connections, threads) is reset or
+started per worker in post_fork. Background services never run here; they
+live in worker.py.
+
+Each worker logs its boot time and memory once it is ready, and toggles the
+sampling profiler on SIGURG (POST /_profiler/sampling is the usual way in;
+the master ignores SIGURG). Set GUNICORN_RELOAD=true for development
+auto-reload, which turns preloading off.
+"""
+import gc
+import logging
+import os
+import resource
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', str((os.cpu_count() or 1) * 2 + 1)))
+reuse_port = True
+
+# Workers write metric samples to files here, which /metrics sums together with
+# worker.py's. Set before the app (and prometheus_client) is imported; CLI
+# commands and benchmarks don't set it, so their samples stay out of /metrics.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'prometheus'))
+
+# Each open /events stream (SSE_ENABLED=true) occupies one request slot for up to
+# SSE_MAX_STREAM_SECONDS. A sync worker would be tied up by a single tab and
+# killed by the timeout, so live events run on gthread workers, whose heartbeat
+# doesn't wait for requests. The server then handles WEB_CONCURRENCY *
+# GUNICORN_THREADS requests at once, open streams included: size it for one
+# stream per open tab plus the normal request load. Streams release their
+# database connection once the response starts, so the pool isn't the limit.
+if os.environ.get('SSE_ENABLED', 'false').lower() in ['true', 'on', '1']:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+    timeout = int(os.environ.get('SSE_MAX_STREAM_SECONDS', '300')) + 60
+else:
+    threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+
+# Reloading re-imports the app in each worker, which preloading would defeat
+reload = os.environ.get('GUNICORN_RELOAD', 'false').lower() in ['true', 'on', '1']
+preload_app = not reload
+
+# Set in the master just before each fork; the new worker inherits the value
+_fork_started = None
+
+
+def memory_usage():
+    """RSS of this process in MB, split into shared and private pages when the kernel reports them"""
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty'):
+                    usage[name] = int(value.split()[0]) / 1024
+    except OSError:
+        # No /proc: peak RSS is the best available (kilobytes on Linux, bytes on macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': maxrss / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024)}
+    return {
+        'rss': usage.get('Rss', 0),
+        'pss': usage.get('Pss', 0),
+        'shared': usage.get('Shared_Clean', 0) + usage.get('Shared_Dirty', 0),
+        'private': usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0),
+    }
+
+
+def _format_memory(usage):
+    return ', '.join(f"{name} {value:.1f} MB" for name, value in usage.items())
+
+
+def on_starting(server):
+    from metrics import clear_dead_process_files
+    clear_dead_process_files()
+
+
+def when_ready(server):
+    server.log.info(f"Master ready: {_format_memory(memory_usage())}")
+    if preload_app:
+        # Move everything allocated so far out of the collector's reach, so
+        # garbage collection in the workers doesn't touch (and copy) shared pages
+        gc.freeze()
+
+
+def pre_fork(server, worker):
+    global _fork_started
+    _fork_started = time.monotonic()
+
+
+def post_fork(server, worker):
+    worker.boot_started = _fork_started or time.monotonic()
+    if preload_app:
+        from main import app
+        from app import init_worker_process
+        init_worker_process(app)
+
+
+def post_worker_init(worker):
+    # After the worker has set up its own signal handlers
+    from profiler import profiler
+    profiler.install_signal_handler()
+
+    boot_ms = (time.monotonic() - getattr(worker, 'boot_started', time.monotonic())) * 1000
+    worker.log.info(f"Worker {worker.pid} booted in {boot_ms:.0f} ms: {_format_memory(memory_usage())}")
+
+
+def child_exit(server, worker):
+    # Its live gauges (open connections, pending emails) no longer count
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Write any buffered last_active times before the worker goes away
+    try:
+        from presence import presence_buffer
+        presence_buffer.flush()
+    except Exception as e:
+        logging.error(f"Error flushing presence buffer on exit: {e}")
@@ -0,0 +1,106 @@
+"""
+Identity Cache
+Per-process, short-TTL cache of slim User snapshots for the login manager's
+user_loader. A cache hit attaches the snapshot to the request's session without
+a query; columns left out of the snapshot still load on first access.
+
+Snapshots can be up to IDENTITY_CACHE_TTL seconds old, and invalidation only
+reaches this process, so they are for reading. Updates that build on a user's
+current values (points, study time, streaks) reload the row first with
+User.load_for_update().
+"""
+from collections import OrderedDict
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, load_only
+
+# Columns templates and the before_request hooks read on every page
+SNAPSHOT_COLUMNS = (
+    'id', 'username', 'email', 'profile_image', 'total_points', 'current_streak',
+    'max_streak', 'total_study_time', 'last_active', 'is_verified', 'joined_date',
+    'email_notifications', 'daily_reminders', 'weekly_summaries', 'achievement_emails',
+    'challenge_emails', 'ai_name', 'ai_personality',
+)
+
+
+class IdentityCache:
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        self.max_size = app.config.get('IDENTITY_CACHE_SIZE', self.max_size)
+
+    def load_user(self, user_id):
+        """Return the User for user_id attached to the current session, or None"""
+        from extensions import db
+        from models import User
+
+        snapshot = self._get(user_id)
+        if snapshot is None:
+            user = User.query.options(
+                load_only(*(getattr(User, name) for name in SNAPSHOT_COLUMNS))
+            ).filter_by(id=user_id).first()
+            if user is None:
+                return None
+            # Keep a detached copy for later requests and hand back a session-bound one
+            db.session.expunge(user)
+            self._set(user_id, user)
+            snapshot = user
+
+        return db.session.merge(snapshot, load=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return snapshot
+
+    def _set(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    from models import User
+    changed = session.info.setdefault('changed_user_ids', set())
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, User) and instance.id is not None:
+            changed.add(instance.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changed_users(session, previous_transaction):
+    session.info.pop('changed_user_ids', None)
+
+
+# Global instance
+identity_cache = IdentityCache()
@@ -0,0 +1,222 @@
+"""
+Metrics
+Prometheus metrics for the web workers and the background worker, served at
+/metrics. gunicorn.conf.py and worker.py point PROMETHEUS_MULTIPROC_DIR at
+instance/prometheus, every process started by them writes its samples to files
+there, and a scrape of any web worker adds up all of them, so one scrape covers
+every gunicorn worker and worker.py. Other processes (flask CLI commands,
+benchmarks, tests) keep their samples in memory, so they never reach /metrics.
+
+Covers request latency per endpoint, DB pool usage, timer completion lag,
+email sends and pending scheduler emails, scheduler job durations and AI
+response latency. The prometheus_client package is optional; without it the
+metrics are no-ops and /metrics returns 404. Scrapes need METRICS_TOKEN, sent
+as "Authorization: Bearer <token>"; without one set, /metrics is only served
+in debug mode.
+"""
+import contextlib
+import glob
+import logging
+import os
+import re
+import time
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+# prometheus_client picks its storage when it is imported, so the entry points
+# that share samples set this before anything imports this module
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Sample files are named like histogram_1234.db or gauge_livesum_1234.db
+_SAMPLE_FILE_PID = re.compile(r'_(\d+)\.db$')
+
+
+class _NoopMetric:
+    """Stands in for every metric when prometheus_client isn't installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=(), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+
+REQUEST_LATENCY = _metric(
+    'Histogram', 'darkfocus_http_request_duration_seconds',
+    'Time to produce a response, by endpoint', ('method', 'endpoint'),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUESTS = _metric(
+    'Counter', 'darkfocus_http_requests_total',
+    'Responses sent, by endpoint and status', ('method', 'endpoint', 'status'))
+DB_CONNECTIONS_OPEN = _metric(
+    'Gauge', 'darkfocus_db_connections_open',
+    'Pooled database connections open', multiprocess_mode='livesum')
+DB_CONNECTIONS_IN_USE = _metric(
+    'Gauge', 'darkfocus_db_connections_in_use',
+    'Database connections checked out of the pool', multiprocess_mode='livesum')
+TIMER_COMPLETION_LAG = _metric(
+    'Histogram', 'darkfocus_timer_completion_lag_seconds',
+    'How long after its expected completion the background service completed a timer',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 21600))
+EMAILS_SENT = _metric(
+    'Counter', 'darkfocus_emails_total', 'Emails sent, by result', ('result',))
+EMAIL_SEND_LATENCY = _metric(
+    'Histogram', 'darkfocus_email_send_duration_seconds', 'Time to hand one email to the mail server',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+EMAILS_PENDING = _metric(
+    'Gauge', 'darkfocus_emails_pending',
+    'Recipients a running scheduler job has yet to email', multiprocess_mode='livesum')
+JOB_DURATION = _metric(
+    'Histogram', 'darkfocus_job_duration_seconds', 'Background job run time, by job', ('job',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900))
+AI_RESPONSE_LATENCY = _metric(
+    'Histogram', 'darkfocus_ai_response_duration_seconds', 'Time to generate an AI friend reply',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+
+@contextlib.contextmanager
+def timed(histogram):
+    """Observe the block's run time in a histogram; also usable as a decorator"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started)
+
+
+def time_job(name):
+    """Record a background job's run time under JOB_DURATION"""
+    return timed(JOB_DURATION.labels(name))
+
+
+def email_queue(recipients):
+    """Iterate over a scheduler job's recipients, counting those not yet handled in EMAILS_PENDING"""
+    remaining = len(recipients)
+    EMAILS_PENDING.inc(remaining)
+    try:
+        for recipient in recipients:
+            yield recipient
+            remaining -= 1
+            EMAILS_PENDING.dec()
+    finally:
+        EMAILS_PENDING.dec(remaining)
+
+
+def clear_dead_process_files():
+    """Remove sample files left by processes that are no longer running
+
+    Called when gunicorn and worker.py start; files of live processes are kept,
+    since either may start first.
+    """
+    if not MULTIPROC_DIR:
+        return
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, '*.db')):
+        match = _SAMPLE_FILE_PID.search(path)
+        if not match:
+            continue
+        pid = int(match.group(1))
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            os.remove(path)
+        except PermissionError:
+            pass
+
+
+def mark_process_dead(pid):
+    """Drop an exited process's live gauges from the totals"""
+    if prometheus_client is not None and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
+
+
+class Metrics:
+    def __init__(self):
+        self.token = None
+
+    def init_app(self, app):
+        self.token = app.config.get('METRICS_TOKEN')
+        if prometheus_client is not None and not self.token and not app.debug:
+            logging.warning("METRICS_TOKEN is not set, so /metrics is disabled outside debug mode")
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # Unmatched URLs share one label so scanners can't blow up the series count
+            endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+            REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        return response
+
+    def serve(self):
+        """Metrics from every process, in the Prometheus text format"""
+        if prometheus_client is None:
+            abort(404)
+        if self.token:
+            if request.headers.get('Authorization') != f"Bearer {self.token}":
+                abort(401)
+        elif not current_app.debug:
+            abort(403)
+
+        if MULTIPROC_DIR:
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+        else:
+            # A single process, such as the development server
+            registry = prometheus_client.REGISTRY
+        return Response(prometheus_client.generate_latest(registry),
+                        content_type=prometheus_client.CONTENT_TYPE_LATEST,
+                        headers={'Cache-Control': 'no-store'})
+
+
+@event.listens_for(Pool, 'connect')
+def _pool_connect(dbapi_connection, connection_record):
+    DB_CONNECTIONS_OPEN.inc()
+
+
+@event.listens_for(Pool, 'close')
+def _pool_close(dbapi_connection, connection_record):
+    DB_CONNECTIONS_OPEN.dec()
+
+
+@event.listens_for(Pool, 'checkout')
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_CONNECTIONS_IN_USE.inc()
+
+
+@event.listens_for(Pool, 'checkin')
+def _pool_checkin(dbapi_connection, connection_record):
+    DB_CONNECTIONS_IN_USE.dec()
+
+
+# Global instance
+metrics = Metrics()
@@ -0,0 +1,23 @@
+"""Baseline: the schema db.create_all() built before migrations were added
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19 09:00:00
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_baseline'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing tables came from db.create_all(); init_db() stamps them with this revision
+    pass
+
+
+def downgrade():
+    pass
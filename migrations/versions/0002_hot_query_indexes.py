@@ -0,0 +1,68 @@
+"""Indexes for the hot queries in routes, the background timer and the email scheduler
+
+Revision ID: 0002_hot_query_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-19 09:30:00
+
+"""
+import contextlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_query_indexes'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, partial index predicate per dialect or None)
+INDEXES = [
+    # home, timer_status and the AI context: a user's open tasks;
+    # leaderboard: a user's latest completed task
+    ('ix_task_user_completed', 'task', ['user_id', 'is_completed', 'completed_at'], None),
+    # leaderboard: a user's latest task of any kind
+    ('ix_task_user_created', 'task', ['user_id', 'created_at'], None),
+    # background timer: active challenges past their end date
+    ('ix_challenge_status_end_date', 'challenge', ['status', 'end_date'], None),
+    # competition: sent and received challenges, newest first, and a user's active ones
+    ('ix_challenge_challenger_created', 'challenge', ['challenger_id', 'created_at'], None),
+    ('ix_challenge_challenged_created', 'challenge', ['challenged_id', 'created_at'], None),
+    # stats across all users for a day; per-user lookups use unique_user_date
+    ('ix_daily_stats_date', 'daily_stats', ['date'], None),
+    # AI friend: a user's recent chat history
+    ('ix_ai_chat_history_user_timestamp', 'ai_chat_history', ['user_id', 'timestamp'], None),
+    # retention: messages older than the cutoff
+    ('ix_ai_chat_history_timestamp', 'ai_chat_history', ['timestamp'], None),
+    # leaderboard: top users by points
+    ('ix_user_total_points', 'user', ['total_points'], None),
+    # email scheduler: verified users who joined yesterday
+    ('ix_user_joined_date_verified', 'user', ['joined_date'], {
+        'postgresql': 'is_verified IS true',
+        'sqlite': 'is_verified IS 1',
+    }),
+]
+
+
+def _outside_transaction():
+    """PostgreSQL only builds indexes without blocking writes outside a transaction"""
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return contextlib.nullcontext()
+
+
+def upgrade():
+    # CONCURRENTLY keeps the tables writable while the indexes build. If a build
+    # fails it leaves an INVALID index behind; drop it before retrying, since
+    # IF NOT EXISTS would skip it.
+    with _outside_transaction():
+        for name, table, columns, where in INDEXES:
+            options = {f"{dialect}_where": sa.text(predicate) for dialect, predicate in (where or {}).items()}
+            # Tables created by db.create_all() after the models declared these already have them
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True, **options)
+
+
+def downgrade():
+    with _outside_transaction():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
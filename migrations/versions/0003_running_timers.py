@@ -0,0 +1,41 @@
+"""Running timers table for the due-timer sweep
+
+Revision ID: 0003_running_timers
+Revises: 0002_hot_query_indexes
+Create Date: 2026-10-19 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_running_timers'
+down_revision = '0002_hot_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table with db.create_all()
+    if not sa.inspect(op.get_bind()).has_table('running_timer'):
+        op.create_table(
+            'running_timer',
+            sa.Column('task_id', sa.Integer(), sa.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('expected_completion', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_running_timer_user_id', 'running_timer', ['user_id'])
+        op.create_index('ix_running_timer_expected_completion', 'running_timer', ['expected_completion'])
+
+    # Timers running at upgrade time
+    op.execute(sa.text(
+        "INSERT INTO running_timer (task_id, user_id, expected_completion) "
+        "SELECT id, user_id, expected_completion FROM task "
+        "WHERE is_active = :active AND is_completed = :completed AND expected_completion IS NOT NULL "
+        "AND id NOT IN (SELECT task_id FROM running_timer)"
+    ).bindparams(active=True, completed=False))
+
+
+def downgrade():
+    op.drop_table('running_timer')
@@ -0,0 +1,41 @@
+"""Archive table for old completed tasks
+
+Revision ID: 0004_archived_tasks
+Revises: 0003_running_timers
+Create Date: 2026-10-19 12:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_archived_tasks'
+down_revision = '0003_running_timers'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table with db.create_all()
+    if not sa.inspect(op.get_bind()).has_table('archived_task'):
+        op.create_table(
+            'archived_task',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('task_id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('title', sa.String(length=200), nullable=False),
+            sa.Column('duration_minutes', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('completed_at', sa.DateTime()),
+            sa.Column('archived_at', sa.DateTime()),
+        )
+        op.create_index('ix_archived_task_user_completed_at', 'archived_task', ['user_id', 'completed_at'])
+
+    # Lets the retention service find old completed tasks without scanning the table
+    op.create_index('ix_task_completed_at', 'task', ['completed_at'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_task_completed_at', table_name='task', if_exists=True)
+    op.drop_table('archived_task')
@@ -0,0 +1,35 @@
+"""Drop the stored verification and reset tokens, replaced by signed tokens
+
+Revision ID: 0005_drop_stored_tokens
+Revises: 0004_archived_tasks
+Create Date: 2026-10-19 13:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_drop_stored_tokens'
+down_revision = '0004_archived_tasks'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('verification_token', 'reset_token', 'reset_token_expires')
+
+
+def upgrade():
+    # Databases created by db.create_all() after the models dropped them never had them
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('user')}
+    with op.batch_alter_table('user') as batch_op:
+        for name in COLUMNS:
+            if name in existing:
+                batch_op.drop_column(name)
+
+
+def downgrade():
+    # Links sent with the old tokens stay invalid; the columns only come back empty
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('verification_token', sa.String(length=100)))
+        batch_op.add_column(sa.Column('reset_token', sa.String(length=100)))
+        batch_op.add_column(sa.Column('reset_token_expires', sa.DateTime()))
@@ -0,0 +1,69 @@
+"""Chat archive, chat clear, offline sync and data version tables
+
+Revision ID: 0006_chat_sync_tables
+Revises: 0005_drop_stored_tokens
+Create Date: 2026-10-19 14:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_chat_sync_tables'
+down_revision = '0005_drop_stored_tokens'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created these tables with db.create_all()
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'ai_chat_archive' not in existing:
+        op.create_table(
+            'ai_chat_archive',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('first_message_at', sa.DateTime()),
+            sa.Column('last_message_at', sa.DateTime()),
+            sa.Column('message_count', sa.Integer()),
+            sa.Column('payload', sa.LargeBinary(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+        )
+        op.create_index('ix_ai_chat_archive_user_id', 'ai_chat_archive', ['user_id'])
+
+    if 'chat_clear_request' not in existing:
+        op.create_table(
+            'chat_clear_request',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), primary_key=True),
+            sa.Column('up_to_id', sa.Integer(), nullable=False),
+            sa.Column('requested_at', sa.DateTime()),
+        )
+
+    if 'sync_operation' not in existing:
+        op.create_table(
+            'sync_operation',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('client_op_id', sa.String(length=64), nullable=False),
+            sa.Column('op_type', sa.String(length=32), nullable=False),
+            sa.Column('result', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+            sa.UniqueConstraint('user_id', 'client_op_id', name='unique_user_client_op'),
+        )
+        op.create_index('ix_sync_operation_created_at', 'sync_operation', ['created_at'])
+
+    if 'data_version' not in existing:
+        op.create_table(
+            'data_version',
+            sa.Column('scope', sa.String(length=64), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('data_version')
+    op.drop_table('sync_operation')
+    op.drop_table('chat_clear_request')
+    op.drop_table('ai_chat_archive')
@@ -1,7 +1,13 @@
 from datetime import datetime, timedelta
-from app import db
+import hashlib
+import json
+import zlib
+from extensions import db
+from events import queue_event
+from flask import current_app
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from password_hashing import HashingBusy, password_hasher
 import pytz
 
 class User(UserMixin, db.Model):
@@ -18,9 +24,6 @@ class User(UserMixin, db.Model):
     grace_days_used = db.Column(db.Integer, default=0)
     total_study_time = db.Column(db.Integer, default=0)  # in minutes
     is_verified = db.Column(db.Boolean, default=False)
-    verification_token = db.Column(db.String(100))
-    reset_token = db.Column(db.String(100))
-    reset_token_expires = db.Column(db.DateTime)
     joined_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Email preferences
@@ -34,6 +37,13 @@ class User(UserMixin, db.Model):
     ai_name = db.Column(db.String(64), default="StudyBot")
     ai_personality = db.Column(db.String(50), default="supportive")  # supportive, motivational, casual, professional
     
+    # Leaderboard ranking and the scheduler's new-user emails
+    __table_args__ = (
+        db.Index('ix_user_total_points', 'total_points'),
+        db.Index('ix_user_joined_date_verified', 'joined_date',
+                 postgresql_where=is_verified.is_(True), sqlite_where=is_verified.is_(True)),
+    )
+    
     # Relationships
     tasks = db.relationship('Task', backref='user', lazy=True, cascade='all, delete-orphan')
     sent_challenges = db.relationship('Challenge', foreign_keys='Challenge.challenger_id', backref='challenger', lazy=True)
@@ -41,10 +51,70 @@ class User(UserMixin, db.Model):
     daily_stats = db.relationship('DailyStats', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def rehash_password_if_needed(self, password):
+        """Re-hash a just-verified password when the configured hash method or its parameters changed
+
+        Skipped while the hashing pool is busy; the next login tries again.
+        """
+        if password_hasher.needs_rehash(self.password_hash):
+            try:
+                self.set_password(password)
+            except HashingBusy:
+                return False
+            return True
+        return False
+    
+    @staticmethod
+    def _token_serializer(purpose):
+        return URLSafeTimedSerializer(current_app.secret_key, salt=f'darkfocus-{purpose}')
+    
+    def _password_fingerprint(self):
+        """Short digest of the password hash so reset tokens die once the password changes"""
+        return hashlib.sha256(self.password_hash.encode('utf-8')).hexdigest()[:16]
+    
+    def get_verification_token(self):
+        """Signed token carrying the user ID and email for the verification link"""
+        return self._token_serializer('verify-email').dumps({'user_id': self.id, 'email': self.email})
+    
+    @staticmethod
+    def verify_verification_token(token, max_age=7 * 24 * 3600):
+        """Return the user a verification token belongs to, or None if it is invalid"""
+        try:
+            data = User._token_serializer('verify-email').loads(token, max_age=max_age)
+        except (BadSignature, SignatureExpired):
+            return None
+        user = db.session.get(User, data.get('user_id'))
+        if user and user.email == data.get('email'):
+            return user
+        return None
+    
+    def get_reset_token(self):
+        """Signed password reset token carrying the user ID and a password hash fingerprint"""
+        return self._token_serializer('reset-password').dumps({
+            'user_id': self.id,
+            'fingerprint': self._password_fingerprint()
+        })
+    
+    @staticmethod
+    def verify_reset_token(token, max_age=3600):
+        """Return the user a reset token belongs to, or None if it is invalid, expired or used"""
+        try:
+            data = User._token_serializer('reset-password').loads(token, max_age=max_age)
+        except (BadSignature, SignatureExpired):
+            return None
+        user = db.session.get(User, data.get('user_id'))
+        if user and user._password_fingerprint() == data.get('fingerprint'):
+            return user
+        return None
+    
+    def cache_tags(self):
+        """Cache tags invalidated when this user is written"""
+        return [f"user:{self.id}"]
     
     def get_rank(self):
         points = self.total_points
@@ -145,6 +215,30 @@ class User(UserMixin, db.Model):
             if self.current_streak > self.max_streak:
                 self.max_streak = self.current_streak
                 
+    def queue_points_event(self):
+        """Push the user's new point total to their open pages once the session commits"""
+        queue_event(db.session, self.id, 'points', {
+            'total_points': self.total_points,
+            'rank': self.get_rank()
+        })
+    
+    def queue_avatar_event(self):
+        """Tell the user's open pages that their new profile image is ready once the session commits"""
+        queue_event(db.session, self.id, 'avatar_ready', {
+            'profile_image': self.profile_image
+        })
+    
+    @staticmethod
+    def load_for_update(user_id):
+        """The user's current row, locked until commit, for read-modify-write updates
+
+        current_user can be an identity cache snapshot up to IDENTITY_CACHE_TTL
+        seconds old, and other processes may have written since. Refreshing the
+        instance here keeps point, study time and streak updates from writing
+        stale values back over theirs.
+        """
+        return db.session.get(User, user_id, populate_existing=True, with_for_update=True)
+    
     @staticmethod
     def check_all_users_streaks():
         """Check and update streaks for all users - called daily by background service"""
@@ -167,6 +261,20 @@ class Task(db.Model):
     expected_completion = db.Column(db.DateTime)  # When timer should complete
     is_active = db.Column(db.Boolean, default=False)  # Is timer currently running
     
+    __table_args__ = (
+        # A user's open tasks, and their latest completed task for the leaderboard
+        db.Index('ix_task_user_completed', 'user_id', 'is_completed', 'completed_at'),
+        db.Index('ix_task_user_created', 'user_id', 'created_at'),
+        # Finds completed tasks old enough to archive
+        db.Index('ix_task_completed_at', 'completed_at'),
+    )
+    
+    # Present only while the timer runs, so the due-timer sweep never reads finished tasks
+    running_timer = db.relationship('RunningTimer', uselist=False, cascade='all, delete-orphan', backref='task')
+    
+    def cache_tags(self):
+        return [f"user:{self.user_id}"]
+    
     def get_time_display(self):
         total_seconds = self.duration_minutes * 60
         hours = int(total_seconds // 3600)
@@ -180,6 +288,18 @@ class Task(db.Model):
         self.started_at = datetime.utcnow()
         self.expected_completion = datetime.utcnow() + timedelta(minutes=self.duration_minutes)
         
+        if self.running_timer is None:
+            self.running_timer = RunningTimer()
+            self.running_timer.user_id = self.user_id
+        self.running_timer.expected_completion = self.expected_completion
+    
+    def stop_timer(self):
+        """Clear the server-side timer, leaving duration_minutes as it is"""
+        self.is_active = False
+        self.started_at = None
+        self.expected_completion = None
+        self.running_timer = None
+        
     def pause_timer(self):
         """Pause the server-side timer and calculate remaining time"""
         if self.is_active and self.started_at:
@@ -187,9 +307,7 @@ class Task(db.Model):
             elapsed_minutes = (datetime.utcnow() - self.started_at).total_seconds() / 60
             # Update duration_minutes to remaining time
             self.duration_minutes = max(0, int(self.duration_minutes - elapsed_minutes))
-            self.is_active = False
-            self.started_at = None
-            self.expected_completion = None
+            self.stop_timer()
     
     def get_remaining_seconds(self):
         """Get remaining seconds for active timer"""
@@ -208,6 +326,7 @@ class Task(db.Model):
     
     def complete_task(self):
         if not self.is_completed:
+            self.stop_timer()
             self.is_completed = True
             self.completed_at = datetime.utcnow()
             
@@ -216,7 +335,7 @@ class Task(db.Model):
             points_earned = total_minutes * 0.083333  # 1/12 point per minute
             
             # Add points to user
-            user = db.session.get(User, self.user_id)
+            user = User.load_for_update(self.user_id)
             if user:
                 user.total_points += points_earned
             
@@ -234,6 +353,7 @@ class Task(db.Model):
                     challenge.challenger_points += points_earned
                 elif challenge.challenged_id == self.user_id:
                     challenge.challenged_points += points_earned
+                challenge.queue_update_events()
             
             # Update daily stats
             ist = pytz.timezone('Asia/Kolkata')
@@ -259,9 +379,44 @@ class Task(db.Model):
                 # Update streak
                 user.update_streak(daily_stat.minutes_studied)
             
+            # Push live updates to the user's open pages once this commits
+            queue_event(db.session, self.user_id, 'timer_complete', {
+                'task_id': self.id,
+                'title': self.title,
+                'points_earned': points_earned
+            })
+            if user:
+                user.queue_points_event()
+            
             return points_earned
         return 0
 
+class RunningTimer(db.Model):
+    """A task whose server-side timer is running, kept by Task.start_timer() and stop_timer()"""
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    expected_completion = db.Column(db.DateTime, nullable=False, index=True)
+
+class ArchivedTask(db.Model):
+    """A completed task moved out of the task table by the retention service
+
+    Totals come from DailyStats, so archived tasks are only read for a
+    user's last completion time.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, nullable=False)  # id the task had in the task table
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_archived_task_user_completed_at', 'user_id', 'completed_at'),)
+    
+    # Reference back to user
+    user = db.relationship('User', backref=db.backref('archived_tasks', lazy=True, cascade='all, delete-orphan'))
+
 class Challenge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     challenger_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -276,8 +431,26 @@ class Challenge(db.Model):
     points_gained = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_challenge_status_end_date', 'status', 'end_date'),
+        db.Index('ix_challenge_challenger_created', 'challenger_id', 'created_at'),
+        db.Index('ix_challenge_challenged_created', 'challenged_id', 'created_at'),
+    )
+    
     winner = db.relationship('User', foreign_keys=[winner_id], backref='challenges_won')
     
+    def queue_update_events(self):
+        """Push the challenge's scores and status to both participants once the session commits"""
+        data = {
+            'challenge_id': self.id,
+            'status': self.status,
+            'challenger_points': self.challenger_points,
+            'challenged_points': self.challenged_points,
+            'winner_id': self.winner_id
+        }
+        queue_event(db.session, self.challenger_id, 'challenge_update', data)
+        queue_event(db.session, self.challenged_id, 'challenge_update', data)
+    
     def calculate_winner(self):
         if self.status == 'active' and datetime.utcnow() >= self.end_date:
             if self.challenger_points > self.challenged_points:
@@ -292,16 +465,21 @@ class Challenge(db.Model):
             
             # Award challenge bonus points
             if self.winner_id:
-                winner = db.session.get(User, self.winner_id)
                 loser_id = self.challenged_id if self.winner_id == self.challenger_id else self.challenger_id
-                loser = db.session.get(User, loser_id)
+                # Locked in id order, so two results for the same pair can't deadlock
+                locked = {user_id: User.load_for_update(user_id) for user_id in sorted((self.winner_id, loser_id))}
+                winner, loser = locked[self.winner_id], locked[loser_id]
                 
                 if winner:
                     winner.total_points += self.points_gained
+                    winner.queue_points_event()
                     
                 # Give consolation points to loser
                 if loser:
                     loser.total_points += 2.0
+                    loser.queue_points_event()
+            
+            self.queue_update_events()
                     
             # Send result emails
             try:
@@ -330,7 +508,14 @@ class DailyStats(db.Model):
     points_earned = db.Column(db.Float, default=0.0)
     tasks_completed = db.Column(db.Integer, default=0)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'date', name='unique_user_date'),)
+    # unique_user_date also serves the per-user lookups by date
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'date', name='unique_user_date'),
+        db.Index('ix_daily_stats_date', 'date'),
+    )
+    
+    def cache_tags(self):
+        return [f"user:{self.user_id}"]
 
 class AIChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -339,9 +524,68 @@ class AIChatHistory(db.Model):
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_ai_chat_history_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_ai_chat_history_timestamp', 'timestamp'),
+    )
+    
     # Reference back to user
     user = db.relationship('User', backref=db.backref('ai_chats', lazy=True, cascade='all, delete-orphan'))
 
+class AIChatArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    first_message_at = db.Column(db.DateTime)
+    last_message_at = db.Column(db.DateTime)
+    message_count = db.Column(db.Integer, default=0)
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON list of messages
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Reference back to user
+    user = db.relationship('User', backref=db.backref('ai_chat_archives', lazy=True, cascade='all, delete-orphan'))
+    
+    @staticmethod
+    def pack_messages(chats):
+        """Compress a list of AIChatHistory rows into an archive payload"""
+        messages = [
+            {
+                'sender': chat.sender,
+                'message': chat.message,
+                'timestamp': chat.timestamp.isoformat() if chat.timestamp else None
+            }
+            for chat in chats
+        ]
+        return zlib.compress(json.dumps(messages, separators=(',', ':')).encode('utf-8'), 9)
+    
+    def unpack_messages(self):
+        """Decompress the archive payload back into a list of message dicts"""
+        return json.loads(zlib.decompress(self.payload).decode('utf-8'))
+
+class ChatClearRequest(db.Model):
+    """Pending chat history clear, processed in batches by the retention service"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    up_to_id = db.Column(db.Integer, nullable=False, default=0)  # Clear messages with id <= up_to_id
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SyncOperation(db.Model):
+    """Offline operation already applied by /sync, kept so replays return the same result"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    client_op_id = db.Column(db.String(64), nullable=False)  # Idempotency key chosen by the client
+    op_type = db.Column(db.String(32), nullable=False)
+    result = db.Column(db.Text, nullable=False)  # JSON result returned to the client
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'client_op_id', name='unique_user_client_op'),)
+
+    def get_result(self):
+        return json.loads(self.result)
+
+class DataVersion(db.Model):
+    """Version stamp for a scope of page data, bumped whenever that data changes"""
+    scope = db.Column(db.String(64), primary_key=True)  # e.g. "user:42" or "leaderboard"
+    version = db.Column(db.Integer, nullable=False, default=1)
+
 class UserQuality(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -353,3 +597,6 @@ class UserQuality(db.Model):
     user = db.relationship('User', backref=db.backref('ai_qualities', lazy=True, cascade='all, delete-orphan'))
     
     __table_args__ = (db.UniqueConstraint('user_id', 'quality_name', name='unique_user_quality'),)
+    
+    def cache_tags(self):
+        return [f"user:{self.user_id}"]
@@ -0,0 +1,134 @@
+"""
+Offline Sync
+Applies a batch of actions a device queued while offline in a single
+transaction. Every operation carries a client-chosen id used as an idempotency
+key: an operation that was already applied is not applied again, and its
+stored result is returned instead, so a device can safely resend a batch
+after a dropped response.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+
+
+class SyncError(Exception):
+    """Raised when a single operation can't be applied; the rest of the batch continues"""
+
+
+def _add_task(user, data, resolve_task_id):
+    from extensions import db
+    from models import Task
+
+    title = (data.get('title') or '').strip()
+    if not 1 <= len(title) <= 200:
+        raise SyncError('Title must be between 1 and 200 characters')
+    try:
+        duration_minutes = int(data.get('duration_minutes'))
+    except (TypeError, ValueError):
+        raise SyncError('Duration must be a number of minutes')
+    if not 1 <= duration_minutes <= 720:
+        raise SyncError('Duration must be between 1 and 720 minutes (12 hours)')
+
+    task = Task()
+    task.user_id = user.id
+    task.title = title
+    task.duration_minutes = duration_minutes
+    db.session.add(task)
+    db.session.flush()
+    return {'task_id': task.id}
+
+
+def _complete_task(user, data, resolve_task_id):
+    from models import Task
+
+    task_id = resolve_task_id(data.get('task_id'))
+    task = Task.query.filter_by(id=task_id, user_id=user.id).first() if task_id else None
+    if not task:
+        raise SyncError('Task not found')
+    if task.is_completed:
+        return {'task_id': task.id, 'points_earned': 0.0, 'already_completed': True}
+
+    points_earned = task.complete_task()
+    return {'task_id': task.id, 'points_earned': points_earned}
+
+
+OPERATIONS = {
+    'add_task': _add_task,
+    'complete_task': _complete_task,
+}
+
+
+def apply_operations(user, operations):
+    """Apply operations in order and return one result per operation
+
+    Each operation is {'id': str, 'type': str, 'data': dict}. A complete_task
+    operation may refer to a task created offline by giving the id of its
+    add_task operation as task_id. The caller commits.
+    """
+    from extensions import db
+    from models import SyncOperation
+
+    op_ids = [str(op.get('id')) for op in operations if isinstance(op, dict) and op.get('id')]
+    applied = {
+        record.client_op_id: record
+        for record in SyncOperation.query.filter(
+            SyncOperation.user_id == user.id,
+            SyncOperation.client_op_id.in_(op_ids)
+        )
+    } if op_ids else {}
+
+    def resolve_task_id(reference):
+        # Numeric ids are server tasks; anything else names an add_task operation
+        if isinstance(reference, int) or (isinstance(reference, str) and reference.isdigit()):
+            return int(reference)
+        record = applied.get(str(reference)) or SyncOperation.query.filter_by(
+            user_id=user.id, client_op_id=str(reference), op_type='add_task'
+        ).first()
+        return record.get_result().get('task_id') if record else None
+
+    results = []
+    for op in operations:
+        if not isinstance(op, dict) or not op.get('id') or len(str(op['id'])) > 64:
+            results.append({'id': op.get('id') if isinstance(op, dict) else None,
+                            'status': 'error', 'error': 'Operation needs an id of at most 64 characters'})
+            continue
+
+        op_id = str(op['id'])
+        if op_id in applied:
+            results.append({**applied[op_id].get_result(), 'id': op_id, 'replayed': True})
+            continue
+
+        handler = OPERATIONS.get(op.get('type'))
+        if handler is None:
+            results.append({'id': op_id, 'status': 'error', 'error': f"Unknown operation type: {op.get('type')}"})
+            continue
+
+        # A savepoint per operation, so one bad operation doesn't undo the others
+        savepoint = db.session.begin_nested()
+        try:
+            result = {'status': 'ok', **handler(user, op.get('data') or {}, resolve_task_id)}
+            savepoint.commit()
+        except SyncError as e:
+            savepoint.rollback()
+            result = {'status': 'error', 'error': str(e)}
+
+        record = SyncOperation(user_id=user.id, client_op_id=op_id, op_type=op['type'],
+                               result=json.dumps(result))
+        db.session.add(record)
+        applied[op_id] = record
+        results.append({**result, 'id': op_id})
+
+    return results
+
+
+def prune_sync_operations(retention_days):
+    """Delete idempotency records older than retention_days"""
+    from extensions import db
+    from models import SyncOperation
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = SyncOperation.query.filter(SyncOperation.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logging.info(f"Pruned {deleted} offline sync records")
+    return deleted
@@ -0,0 +1,150 @@
+"""
+Password Hashing
+Limits how many password hashes and verifications run at once across every
+process on the host, so a burst of logins can't put every web worker and CPU
+on CPU-heavy hashing. A hash first takes one of PASSWORD_HASH_WORKERS slots,
+which are flock()ed files in a shared folder; the kernel drops a process's
+locks when it exits, so a crashed worker never leaks a slot. When no slot
+frees up within the queue timeout, or too many requests in this process are
+already waiting, callers get HashingBusy instead of piling up.
+
+Without fcntl (Windows), the slots are per process.
+"""
+import os
+import threading
+import time
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class HashingBusy(Exception):
+    """Raised when every hashing slot stays taken for the queue timeout"""
+
+
+class HostSlots:
+    """A counting semaphore shared by every process that opens the same folder
+
+    The folder must be on a local filesystem; flock() isn't reliable over NFS.
+    """
+
+    def __init__(self, folder, count, poll_interval=0.005):
+        os.makedirs(folder, exist_ok=True)
+        self.poll_interval = poll_interval
+        # A thread's flock() on a file this process already holds would succeed, so track our own
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self._files = [os.open(os.path.join(folder, f"slot-{i}"), os.O_RDWR | os.O_CREAT, 0o600)
+                       for i in range(count)]
+
+    def acquire(self, timeout):
+        """Take a free slot, waiting up to timeout seconds; returns its index or None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                for slot, fd in enumerate(self._files):
+                    if slot in self._in_use:
+                        continue
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    self._in_use.add(slot)
+                    return slot
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, slot):
+        with self._lock:
+            fcntl.flock(self._files[slot], fcntl.LOCK_UN)
+            self._in_use.discard(slot)
+
+
+class ProcessSlots:
+    """The same interface over a plain semaphore, for platforms without flock()"""
+
+    def __init__(self, count):
+        self._semaphore = threading.BoundedSemaphore(count)
+
+    def acquire(self, timeout):
+        return 0 if self._semaphore.acquire(timeout=timeout) else None
+
+    def release(self, slot):
+        self._semaphore.release()
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = 'scrypt'
+        self.max_workers = os.cpu_count() or 2
+        self.max_queued = 32
+        self.queue_timeout = 2.0
+        self.slot_folder = None
+        self._slots = None
+        self._slots_pid = None
+        self._waiting = None
+        self._method_prefix = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.max_workers = app.config.get('PASSWORD_HASH_WORKERS', self.max_workers)
+        self.max_queued = app.config.get('PASSWORD_HASH_QUEUE', self.max_queued)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', self.queue_timeout)
+        self.slot_folder = (app.config.get('PASSWORD_HASH_SLOT_FOLDER')
+                            or os.path.join(app.instance_path, 'password_hash_slots'))
+        self._slots = None
+        self._method_prefix = None
+
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different method or different parameters"""
+        return password_hash.split('$', 1)[0] != self._current_prefix()
+
+    def _current_prefix(self):
+        # e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:1000000"; werkzeug fills in its defaults
+        if self._method_prefix is None:
+            self._method_prefix = generate_password_hash('', method=self.method).split('$', 1)[0]
+        return self._method_prefix
+
+    def _run(self, func, *args, **kwargs):
+        slots, waiting = self._get_slots()
+        # Hashes running or queued in this process are bounded too, so threads don't pile up
+        if not waiting.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            slot = slots.acquire(self.queue_timeout)
+            if slot is None:
+                raise HashingBusy()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                slots.release(slot)
+        finally:
+            waiting.release()
+
+    def _get_slots(self):
+        """Open the slot files in this process on first use; forked workers must not share them"""
+        with self._lock:
+            if self._slots is None or self._slots_pid != os.getpid():
+                if fcntl is not None and self.slot_folder:
+                    self._slots = HostSlots(self.slot_folder, self.max_workers)
+                else:
+                    self._slots = ProcessSlots(self.max_workers)
+                self._slots_pid = os.getpid()
+                self._waiting = threading.BoundedSemaphore(self.max_workers + self.max_queued)
+            return self._slots, self._waiting
+
+# Global instance
+password_hasher = PasswordHasher()
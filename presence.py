@@ -0,0 +1,97 @@
+"""
+Presence Buffer
+Collects users' last-seen times in memory and writes them in one batched
+UPDATE every few seconds, so recording presence never blocks a request
+"""
+from datetime import datetime
+import atexit
+import logging
+import os
+import threading
+import time
+from sqlalchemy import Integer, DateTime, bindparam, column, update, values
+
+
+class PresenceBuffer:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.engine = None
+        self.table = None
+        self.flush_interval = 5
+        self.thread = None
+        self.thread_pid = None
+
+    def init_app(self, app, db):
+        """Bind the buffer to the app's engine and the user table"""
+        from models import User
+        self.flush_interval = app.config.get('PRESENCE_FLUSH_SECONDS', self.flush_interval)
+        with app.app_context():
+            self.engine = db.engine
+        self.table = User.__table__
+        atexit.register(self.flush)
+
+    def touch(self, user_id, seen_at=None):
+        """Record that a user was active; written on the next flush"""
+        with self._lock:
+            self._pending[user_id] = seen_at or datetime.utcnow()
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        """Start the flusher thread in this process on first use"""
+        if self.thread_pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self._lock:
+            if self.thread_pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            self.thread_pid = os.getpid()
+            self.thread = threading.Thread(target=self._run_flusher, daemon=True)
+            self.thread.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing presence buffer: {e}")
+
+    def flush(self):
+        """Write all buffered last-seen times in a single statement"""
+        if self.engine is None:
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        rows = sorted(pending.items())
+        try:
+            with self.engine.begin() as conn:
+                if self.engine.dialect.name == 'postgresql':
+                    # UPDATE "user" SET last_active = v.last_active FROM (VALUES ...) AS v(id, last_active)
+                    seen = values(
+                        column('id', Integer), column('last_active', DateTime), name='seen'
+                    ).data(rows)
+                    conn.execute(
+                        update(self.table)
+                        .values(last_active=seen.c.last_active)
+                        .where(self.table.c.id == seen.c.id)
+                    )
+                else:
+                    conn.execute(
+                        update(self.table)
+                        .where(self.table.c.id == bindparam('user_id'))
+                        .values(last_active=bindparam('seen_at')),
+                        [{'user_id': user_id, 'seen_at': seen_at} for user_id, seen_at in rows]
+                    )
+        except Exception:
+            # Put the times back unless a newer one arrived meanwhile
+            with self._lock:
+                for user_id, seen_at in rows:
+                    self._pending.setdefault(user_id, seen_at)
+            raise
+        return len(rows)
+
+# Global instance
+presence_buffer = PresenceBuffer()
@@ -0,0 +1,175 @@
+"""
+Profiler
+Two opt-in ways to see where time goes in production, both producing folded
+stacks ("frame;frame;frame count" lines) that flamegraph.pl, speedscope and
+similar tools read directly.
+
+- Single request: send the PROFILER_TOKEN value in an X-Profile header, and
+  the response body is replaced by a profile of that request, sampled every
+  millisecond. The token is only read from the header, so it never ends up in
+  access logs.
+- Whole process: POST /_profiler/sampling with the token starts a low-rate
+  sampler of every thread in the worker serving it; the next one stops it and
+  writes the aggregated stacks to PROFILER_DUMP_FOLDER. Processes without an
+  HTTP endpoint, like worker.py, toggle it on SIGURG instead. Gunicorn reserves
+  SIGUSR1/SIGUSR2 (log reopening, binary upgrade) and SIGURG is ignored by
+  default, so one sent to the wrong process does nothing.
+
+Nothing is hooked into requests unless PROFILER_TOKEN is set, and no thread
+runs unless a profile is being taken.
+"""
+from collections import Counter
+import hmac
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from flask import Response, abort, g, request
+
+
+class StackSampler:
+    """Samples thread stacks on a background thread and counts identical stacks"""
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id  # None samples every thread
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def folded(self):
+        """Aggregated stacks in the folded format, most frequent first"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_id is not None and thread_id != self.thread_id):
+                    continue
+                root = None if self.thread_id is not None else thread_names.get(thread_id, str(thread_id))
+                self.stacks[self._fold(frame, root)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _fold(frame, root):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            name = getattr(code, 'co_qualname', code.co_name)
+            names.append(f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})".replace(';', ':'))
+            frame = frame.f_back
+        if root:
+            names.append(root.replace(';', ':'))
+        return ';'.join(reversed(names))
+
+
+class Profiler:
+    def __init__(self):
+        self.token = None
+        self.request_interval = 0.001
+        self.sample_interval = 0.01
+        self.dump_folder = None
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.token = app.config.get('PROFILER_TOKEN')
+        self.request_interval = app.config.get('PROFILER_REQUEST_INTERVAL', self.request_interval)
+        self.sample_interval = app.config.get('PROFILER_SAMPLE_INTERVAL', self.sample_interval)
+        self.dump_folder = app.config.get('PROFILER_DUMP_FOLDER') or os.path.join(app.instance_path, 'profiles')
+
+        if not self.token:
+            return
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start_request)
+        app.after_request(self._finish_request)
+
+        from extensions import csrf
+        app.add_url_rule('/_profiler/sampling', 'profiler_sampling', csrf.exempt(self.sampling_view),
+                         methods=['POST'])
+
+    def _authorized(self):
+        supplied = request.headers.get('X-Profile') or ''
+        return bool(self.token) and hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    def _start_request(self):
+        if request.endpoint != 'profiler_sampling' and self._authorized():
+            g.request_sampler = StackSampler(self.request_interval, threading.get_ident())
+            g.request_sampler.start()
+
+    def _finish_request(self, response):
+        sampler = g.pop('request_sampler', None)
+        if sampler is None:
+            return response
+        sampler.stop()
+        logging.info(f"Profiled {request.method} {request.path}: {sampler.samples} samples")
+        profile = Response(sampler.folded(), mimetype='text/plain')
+        profile.headers['X-Profile-Samples'] = str(sampler.samples)
+        profile.headers['X-Profile-Status'] = str(response.status_code)
+        profile.headers['Cache-Control'] = 'no-store'
+        return profile
+
+    def sampling_view(self):
+        """Start or stop (?action=start|stop) the sampler in the worker serving this request"""
+        if not self._authorized():
+            abort(404)
+        action = request.args.get('action', 'toggle')
+        running = self._sampler is not None
+        if action == 'start' or (action == 'toggle' and not running):
+            self.start_sampling()
+            return {'sampling': True, 'pid': os.getpid()}
+        path = self.stop_sampling()
+        return {'sampling': False, 'pid': os.getpid(), 'dump': path}
+
+    def start_sampling(self):
+        """Start sampling every thread in this process, if it isn't already"""
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = StackSampler(self.sample_interval)
+                self._sampler.start()
+                logging.info(f"Sampling profiler started in process {os.getpid()}")
+
+    def stop_sampling(self):
+        """Stop the sampler and write its stacks to the dump folder; returns the file's path"""
+        with self._lock:
+            sampler, self._sampler = self._sampler, None
+        if sampler is None:
+            return None
+        sampler.stop()
+
+        os.makedirs(self.dump_folder, exist_ok=True)
+        path = os.path.join(self.dump_folder, f"{os.getpid()}-{int(sampler.started_at)}.folded")
+        with open(path, 'w') as f:
+            f.write(sampler.folded())
+        logging.info(f"Sampling profiler stopped in process {os.getpid()}: {sampler.samples} samples written to {path}")
+        return path
+
+    def toggle_sampling(self):
+        if self._sampler is None:
+            self.start_sampling()
+        else:
+            self.stop_sampling()
+
+    def install_signal_handler(self):
+        """Toggle sampling on SIGURG; call from the process's main thread once its own handlers are set"""
+        # Stopping joins the sampler thread and writes a file, so do it off the signal handler
+        signal.signal(signal.SIGURG, lambda signum, frame: threading.Thread(
+            target=self.toggle_sampling, name='profiler-toggle', daemon=True).start())
+
+
+# Global instance
+profiler = Profiler()
@@ -0,0 +1,128 @@
+"""
+Query Plan Checks
+EXPLAINs the hot queries from routes.py, background_timer.py,
+email_scheduler.py and the AI friend and retention services, and reports any
+that don't use the index added for them. Run it after changing a query or an
+index with `flask --app main check-query-plans`; it exits non-zero on a miss.
+
+PostgreSQL is checked with sequential scans disabled, so an empty development
+database still shows whether the index can serve the query.
+"""
+from datetime import date, datetime, timedelta
+import logging
+from sqlalchemy import or_
+from extensions import db
+
+
+def _hot_queries():
+    """(name, statement, indexes any of which the plan must use)"""
+    from models import AIChatHistory, ArchivedTask, Challenge, DailyStats, RunningTimer, Task, User
+
+    now = datetime.utcnow()
+    user_id = 1
+    return [
+        ('home: open tasks',
+         Task.query.filter_by(user_id=user_id, is_completed=False),
+         ('ix_task_user_completed',)),
+        ('timer_status: open and tracked tasks',
+         Task.query.filter(Task.user_id == user_id,
+                           or_(Task.is_completed.is_(False), Task.id.in_([1, 2]))).order_by(Task.id),
+         ('ix_task_user_completed', 'ix_task_user_created')),
+        ('leaderboard: top users',
+         User.query.order_by(User.total_points.desc()).limit(10),
+         ('ix_user_total_points',)),
+        ('leaderboard: last completions',
+         db.session.query(Task.user_id, db.func.max(Task.completed_at))
+         .filter(Task.user_id.in_([1, 2]), Task.is_completed.is_(True)).group_by(Task.user_id),
+         ('ix_task_user_completed',)),
+        ('leaderboard: last archived completions',
+         db.session.query(ArchivedTask.user_id, db.func.max(ArchivedTask.completed_at))
+         .filter(ArchivedTask.user_id.in_([1, 2])).group_by(ArchivedTask.user_id),
+         ('ix_archived_task_user_completed_at',)),
+        ('leaderboard: last tasks',
+         db.session.query(Task.user_id, db.func.max(Task.created_at))
+         .filter(Task.user_id.in_([1, 2])).group_by(Task.user_id),
+         ('ix_task_user_created',)),
+        ('competition: sent challenges',
+         Challenge.query.filter_by(challenger_id=user_id).order_by(Challenge.created_at.desc()).limit(10),
+         ('ix_challenge_challenger_created',)),
+        ('competition: received challenges',
+         Challenge.query.filter_by(challenged_id=user_id).order_by(Challenge.created_at.desc()).limit(10),
+         ('ix_challenge_challenged_created',)),
+        ('competition: active challenges',
+         Challenge.query.filter_by(status='active').filter(
+             (Challenge.challenger_id == user_id) | (Challenge.challenged_id == user_id)),
+         ('ix_challenge_challenger_created', 'ix_challenge_challenged_created', 'ix_challenge_status_end_date')),
+        ('background timer: due timers',
+         Task.query.join(Task.running_timer).filter(RunningTimer.expected_completion <= now),
+         ('ix_running_timer_expected_completion',)),
+        ('background timer: ended challenges',
+         Challenge.query.filter(Challenge.status == 'active').filter(Challenge.end_date <= now),
+         ('ix_challenge_status_end_date',)),
+        ('email scheduler: daily stat for a day',
+         DailyStats.query.filter_by(user_id=user_id, date=date.today()),
+         ('unique_user_date', 'sqlite_autoindex_daily_stats_1')),
+        ('email scheduler: recent study days',
+         DailyStats.query.filter(DailyStats.user_id == user_id,
+                                 DailyStats.date >= date.today() - timedelta(days=7),
+                                 DailyStats.minutes_studied > 0),
+         ('unique_user_date', 'sqlite_autoindex_daily_stats_1')),
+        ('email scheduler: new users',
+         User.query.filter(User.joined_date >= now - timedelta(days=1), User.joined_date < now,
+                           User.is_verified.is_(True)),
+         ('ix_user_joined_date_verified',)),
+        ('AI friend: chat history',
+         AIChatHistory.query.filter_by(user_id=user_id).filter(AIChatHistory.id > 0)
+         .order_by(AIChatHistory.timestamp.desc()).limit(50),
+         ('ix_ai_chat_history_user_timestamp',)),
+        ('retention: tasks past the archive window',
+         Task.query.with_entities(Task.id).filter(Task.completed_at < now - timedelta(days=90),
+                                                   Task.is_completed.is_(True))
+         .order_by(Task.completed_at).limit(500),
+         ('ix_task_completed_at',)),
+        ('retention: messages past the cutoff',
+         AIChatHistory.query.filter(AIChatHistory.timestamp < now - timedelta(days=30)),
+         ('ix_ai_chat_history_timestamp',)),
+    ]
+
+
+def explain(query):
+    """The database's plan for a query, as one line of text per plan node
+
+    Returns None on databases other than SQLite and PostgreSQL, whose plans
+    aren't checked.
+    """
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+        return [row[-1] for row in rows]
+    if dialect == 'postgresql':
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        return [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {compiled}", params)]
+    return None
+
+
+def check_query_plans():
+    """EXPLAIN every hot query; returns a list of (name, plan) for those missing their index
+
+    Returns None if the database's plans can't be checked.
+    """
+    failures = []
+    try:
+        for name, query, indexes in _hot_queries():
+            plan = explain(query)
+            if plan is None:
+                return None
+            if not any(index in line for line in plan for index in indexes):
+                failures.append((name, plan))
+            logging.debug(f"Query plan for {name}: {plan}")
+    finally:
+        # Drops the SET LOCAL along with the transaction
+        db.session.rollback()
+    return failures
@@ -0,0 +1,141 @@
+"""
+Query Stats
+Counts the SQL statements each request runs, and the time spent in them,
+through SQLAlchemy's cursor events. Background jobs are counted the same way
+inside query_stats.track().
+
+Statements run many times with identical SQL in one request or job are logged
+as probable N+1 queries, and requests over their query budget are logged too.
+With QUERY_BUDGET_STRICT set, going over budget raises QueryBudgetExceeded
+instead, so tests and benchmarks fail on a regression. In debug mode the
+counts are also sent as X-Query-Count, X-Query-Time-Ms and Server-Timing headers.
+"""
+from collections import Counter
+import contextlib
+import contextvars
+import logging
+import time
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Contextvars start empty in new threads, so worker threads never count into a request
+_current = contextvars.ContextVar('query_stats_log', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a request or job runs more queries than its budget"""
+
+
+class QueryLog:
+    """Queries run by one request or job"""
+
+    def __init__(self, name, budget=None):
+        self.name = name
+        self.budget = budget
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def repeated(self, threshold):
+        """(statement, count) for every statement run at least threshold times"""
+        return [(statement, count) for statement, count in self.statements.most_common()
+                if count >= threshold]
+
+
+def query_budget(limit):
+    """Set a view's query budget, overriding QUERY_BUDGET"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class QueryStats:
+    def __init__(self):
+        self.default_budget = None
+        self.repeat_threshold = 5
+        self.strict = False
+        self.send_headers = False
+
+    def init_app(self, app):
+        self.default_budget = app.config.get('QUERY_BUDGET', self.default_budget)
+        self.repeat_threshold = app.config.get('QUERY_REPEAT_THRESHOLD', self.repeat_threshold)
+        self.strict = app.config.get('QUERY_BUDGET_STRICT', self.strict)
+        self.send_headers = app.config.get('QUERY_STATS_HEADERS', app.debug)
+
+        # Run first, so queries made by other before_request hooks are counted
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._end_request)
+
+    @contextlib.contextmanager
+    def track(self, name, budget=None):
+        """Count the queries run inside the block; also usable as a decorator
+
+        Jobs have no budget unless one is given, since their query count
+        grows with the number of users they handle.
+        """
+        log = QueryLog(name, budget)
+        token = _current.set(log)
+        try:
+            yield log
+        finally:
+            _current.reset(token)
+        self._report(log)
+
+    def _start_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', self.default_budget)
+        _current.set(QueryLog(request.endpoint or request.path, budget))
+
+    def _finish_request(self, response):
+        log = _current.get()
+        if log is None:
+            return response
+        # Streamed bodies run after this point and aren't counted
+        _current.set(None)
+
+        if self.send_headers:
+            duration_ms = log.duration * 1000
+            response.headers['X-Query-Count'] = str(log.count)
+            response.headers['X-Query-Time-Ms'] = f"{duration_ms:.1f}"
+            response.headers.add('Server-Timing', f'db;dur={duration_ms:.1f};desc="{log.count} queries"')
+        self._report(log)
+        return response
+
+    def _end_request(self, exc):
+        _current.set(None)
+
+    def _report(self, log):
+        logging.debug(f"{log.name}: {log.count} queries in {log.duration * 1000:.1f} ms")
+
+        for statement, count in log.repeated(self.repeat_threshold):
+            logging.warning(f"Probable N+1 in {log.name}: statement ran {count} times: {' '.join(statement.split())[:300]}")
+
+        if log.budget is not None and log.count > log.budget:
+            message = f"{log.name} ran {log.count} queries, over its budget of {log.budget}"
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logging.warning(message)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info['query_stats_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('query_stats_start', None)
+    log = _current.get()
+    if log is None or start is None:
+        return
+    log.duration += time.perf_counter() - start
+    log.count += 1
+    log.statements[statement] += 1
+
+
+# Global instance
+query_stats = QueryStats()
@@ -0,0 +1,243 @@
+"""
+Retention Service
+Moves old AI chat messages into compressed per-user archives, moves old
+completed tasks into the archived_task table and processes chat history
+clears in small batches, off the request thread
+"""
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from avatar_processing import avatar_processor
+from cache import add_cache_tags
+from metrics import time_job
+from offline_sync import prune_sync_operations
+
+
+class RetentionService:
+    def __init__(self):
+        self.app = None
+        self.running = False
+        self.thread = None
+        self.check_interval = 30  # Pending clears are picked up within 30 seconds
+        self.archive_interval = 3600  # Archive old messages once an hour
+        self.last_archive_run = None
+
+    def start(self, app):
+        """Start the retention service"""
+        self.app = app
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run_retention, daemon=True)
+            self.thread.start()
+            logging.info("Retention Service started")
+
+    def stop(self):
+        """Stop the retention service"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+        logging.info("Retention Service stopped")
+
+    def _run_retention(self):
+        """Main loop for pending clears and periodic archival"""
+        while self.running:
+            try:
+                with self.app.app_context():
+                    self.process_pending_clears()
+                    if self._archive_due():
+                        with time_job('retention_service.hourly_pass'):
+                            self.archive_old_messages()
+                            self.archive_completed_tasks()
+                            avatar_processor.requeue_staged()
+                            avatar_processor.collect_orphans()
+                            prune_sync_operations(self.app.config['SYNC_RETENTION_DAYS'])
+                        self.last_archive_run = time.monotonic()
+            except Exception as e:
+                logging.error(f"Error in retention service: {e}")
+
+            time.sleep(self.check_interval)
+
+    def _archive_due(self):
+        """Check whether the hourly archival pass should run"""
+        if self.last_archive_run is None:
+            return True
+        return time.monotonic() - self.last_archive_run >= self.archive_interval
+
+    def archive_old_messages(self):
+        """Move chat messages older than the retention window into compressed archives"""
+        from flask import current_app
+        from extensions import db
+        from models import AIChatHistory
+
+        retention_days = current_app.config['CHAT_RETENTION_DAYS']
+        batch_size = current_app.config['CHAT_ARCHIVE_BATCH_SIZE']
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+        archived = 0
+        while True:
+            batch = AIChatHistory.query.filter(
+                AIChatHistory.timestamp < cutoff
+            ).order_by(AIChatHistory.id).limit(batch_size).all()
+
+            if not batch:
+                break
+
+            try:
+                self._archive_batch(batch)
+                db.session.commit()
+                archived += len(batch)
+            except Exception as e:
+                logging.error(f"Error archiving chat messages: {e}")
+                db.session.rollback()
+                break
+
+            if len(batch) < batch_size:
+                break
+
+        if archived:
+            logging.info(f"Archived {archived} chat messages older than {retention_days} days")
+        return archived
+
+    def _archive_batch(self, batch):
+        """Write one compressed archive row per user and delete the archived messages"""
+        from extensions import db
+        from models import AIChatHistory, AIChatArchive
+
+        by_user = {}
+        for chat in batch:
+            by_user.setdefault(chat.user_id, []).append(chat)
+
+        for user_id, chats in by_user.items():
+            archive = AIChatArchive()
+            archive.user_id = user_id
+            archive.first_message_at = chats[0].timestamp
+            archive.last_message_at = chats[-1].timestamp
+            archive.message_count = len(chats)
+            archive.payload = AIChatArchive.pack_messages(chats)
+            db.session.add(archive)
+
+        ids = [chat.id for chat in batch]
+        AIChatHistory.query.filter(AIChatHistory.id.in_(ids)).delete(synchronize_session=False)
+        add_cache_tags(db.session, *(f"user:{user_id}" for user_id in by_user))
+
+    def archive_completed_tasks(self):
+        """Move tasks completed before the archive window out of the task table
+
+        Keeps the table the home page and timer routes read proportional to
+        current activity. Each batch is copied and deleted in one transaction.
+        """
+        from flask import current_app
+        from extensions import db
+        from models import Task, ArchivedTask
+
+        archive_days = current_app.config['TASK_ARCHIVE_DAYS']
+        batch_size = current_app.config['TASK_ARCHIVE_BATCH_SIZE']
+        cutoff = datetime.utcnow() - timedelta(days=archive_days)
+        columns = ('user_id', 'title', 'duration_minutes', 'created_at', 'completed_at')
+
+        archived = 0
+        while True:
+            rows = db.session.query(Task.id, Task.user_id).filter(
+                Task.completed_at < cutoff,
+                Task.is_completed.is_(True)
+            ).order_by(Task.completed_at).limit(batch_size).all()
+
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+
+            try:
+                db.session.execute(db.insert(ArchivedTask).from_select(
+                    ['task_id', *columns, 'archived_at'],
+                    db.select(Task.id, *[getattr(Task, column) for column in columns],
+                              db.literal(datetime.utcnow(), db.DateTime)).where(Task.id.in_(ids))
+                ))
+                Task.query.filter(Task.id.in_(ids)).delete(synchronize_session=False)
+                add_cache_tags(db.session, *{f"user:{row.user_id}" for row in rows})
+                db.session.commit()
+                archived += len(ids)
+            except Exception as e:
+                logging.error(f"Error archiving completed tasks: {e}")
+                db.session.rollback()
+                break
+
+            if len(ids) < batch_size:
+                break
+
+        if archived:
+            logging.info(f"Archived {archived} tasks completed more than {archive_days} days ago")
+        return archived
+
+    def request_clear(self, user_id):
+        """Queue a chat history clear for a user and return immediately"""
+        from extensions import db
+        from models import AIChatHistory, ChatClearRequest
+
+        last_id = db.session.query(db.func.max(AIChatHistory.id)).filter(
+            AIChatHistory.user_id == user_id
+        ).scalar() or 0
+
+        clear_request = db.session.get(ChatClearRequest, user_id)
+        if not clear_request:
+            clear_request = ChatClearRequest()
+            clear_request.user_id = user_id
+            db.session.add(clear_request)
+
+        clear_request.up_to_id = max(clear_request.up_to_id or 0, last_id)
+        clear_request.requested_at = datetime.utcnow()
+        return clear_request
+
+    def process_pending_clears(self):
+        """Delete queued chat history clears in batches"""
+        from flask import current_app
+        from extensions import db
+        from models import AIChatHistory, AIChatArchive, ChatClearRequest
+
+        batch_size = current_app.config['CHAT_ARCHIVE_BATCH_SIZE']
+
+        for clear_request in ChatClearRequest.query.all():
+            user_id = clear_request.user_id
+            up_to_id = clear_request.up_to_id
+            try:
+                while True:
+                    ids = [row.id for row in db.session.query(AIChatHistory.id).filter(
+                        AIChatHistory.user_id == user_id,
+                        AIChatHistory.id <= up_to_id
+                    ).limit(batch_size)]
+
+                    if not ids:
+                        break
+
+                    AIChatHistory.query.filter(AIChatHistory.id.in_(ids)).delete(synchronize_session=False)
+                    db.session.commit()
+
+                    if len(ids) < batch_size:
+                        break
+
+                AIChatArchive.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+                add_cache_tags(db.session, f"user:{user_id}")
+
+                # A newer clear may have raised the watermark while we were deleting
+                db.session.refresh(clear_request)
+                if clear_request.up_to_id <= up_to_id:
+                    db.session.delete(clear_request)
+                db.session.commit()
+                logging.info(f"Cleared chat history for user {user_id}")
+            except Exception as e:
+                logging.error(f"Error clearing chat history for user {user_id}: {e}")
+                db.session.rollback()
+
+    @staticmethod
+    def load_archived_messages(user_id):
+        """Return a user's archived chat messages, oldest first"""
+        from models import AIChatArchive
+
+        messages = []
+        archives = AIChatArchive.query.filter_by(user_id=user_id).order_by(AIChatArchive.first_message_at).all()
+        for archive in archives:
+            messages.extend(archive.unpack_messages())
+        return messages
+
+# Global instance
+retention_service = RetentionService()
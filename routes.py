@@ -1,21 +1,37 @@
 import os
+import hashlib
+import json
+import queue
 import secrets
+import time
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, send_from_directory, session, make_response
+from markupsafe import Markup
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_mail import Message
 from werkzeug.utils import secure_filename
 from PIL import Image
-from sqlalchemy import desc
+from sqlalchemy import case, desc, or_
+from sqlalchemy.exc import IntegrityError
 import logging
 import pytz
 
-from app import db, mail
-from models import User, Task, Challenge, DailyStats, AIChatHistory, UserQuality
+from extensions import db, mail
+from models import User, Task, RunningTimer, ArchivedTask, Challenge, DailyStats, AIChatHistory, UserQuality
 from forms import LoginForm, RegisterForm, ProfileForm, TaskForm, ChallengeForm, ForgotPasswordForm, ResetPasswordForm
 from utils import send_verification_email, send_reset_email
 from email_service import EmailService
 from ai_friend_service import ai_friend_service
+from retention_service import retention_service
+from chat_search import search_chat_history
+from events import event_broker
+from password_hashing import HashingBusy
+from avatar_processing import avatar_processor
+from assets import asset_pipeline
+from offline_sync import apply_operations
+from data_versions import data_versions, user_scope, LEADERBOARD_SIZE
+from cache import add_cache_tags
+from query_stats import query_budget
 
 main = Blueprint('main', __name__)
 
@@ -32,12 +48,20 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
-        # Try to find user by username first, then by email
-        user = User.query.filter_by(username=form.username.data).first()
-        if not user:
-            user = User.query.filter_by(email=form.email.data).first()
+        # Find user by username or email in one query, preferring a username match
+        user = User.query.filter(
+            or_(User.username == form.username.data, User.email == form.email.data)
+        ).order_by(case((User.username == form.username.data, 0), else_=1)).first()
         
-        if user and user.check_password(form.password.data):
+        try:
+            password_ok = user is not None and user.check_password(form.password.data)
+        except HashingBusy:
+            flash('Too many people are logging in right now. Please try again in a moment.', 'warning')
+            return render_template('login.html', form=form), 503
+        
+        if password_ok:
+            if user.rehash_password_if_needed(form.password.data):
+                db.session.commit()
             if user.is_verified:
                 login_user(user, remember=form.remember_me.data)
                 next_page = request.args.get('next')
@@ -59,9 +83,12 @@ def register():
         user = User()
         user.username = form.username.data
         user.email = form.email.data
-        user.verification_token = secrets.token_urlsafe(32)
         user.is_verified = True  # Auto-verify for now due to email config issues
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash('Too many people are signing up right now. Please try again in a moment.', 'warning')
+            return render_template('register.html', form=form), 503
         
         db.session.add(user)
         db.session.commit()
@@ -80,10 +107,9 @@ def register():
 
 @main.route('/verify/<token>')
 def verify_email(token):
-    user = User.query.filter_by(verification_token=token).first()
+    user = User.verify_verification_token(token)
     if user:
         user.is_verified = True
-        user.verification_token = None
         db.session.commit()
         flash('Email verified successfully! You can now log in.', 'success')
     else:
@@ -93,6 +119,7 @@ def verify_email(token):
 
 @main.route('/home')
 @login_required
+@query_budget(8)
 def home():
     # Get user's active tasks (not completed)
     active_tasks = Task.query.filter_by(user_id=current_user.id, is_completed=False).all()
@@ -161,8 +188,12 @@ def start_server_timer(task_id):
     task = Task.query.filter_by(id=task_id, user_id=current_user.id, is_completed=False).first()
     
     if task:
-        # Pause all other active timers for this user (only one timer at a time)
-        Task.query.filter_by(user_id=current_user.id, is_active=True).update({'is_active': False})
+        # Pause all other running timers for this user (only one timer at a time)
+        other_tasks = Task.query.join(Task.running_timer).filter(
+            RunningTimer.user_id == current_user.id, Task.id != task.id
+        ).all()
+        for other_task in other_tasks:
+            other_task.pause_timer()
         
         # Start this timer
         task.start_timer()
@@ -217,9 +248,6 @@ def get_timer_status(task_id):
     if task.is_timer_completed():
         # Auto-complete the task
         points_earned = task.complete_task()
-        task.is_active = False
-        task.started_at = None
-        task.expected_completion = None
         db.session.commit()
         
         return jsonify({
@@ -236,6 +264,110 @@ def get_timer_status(task_id):
         'remaining_seconds': task.get_remaining_seconds()
     })
 
+@main.route('/timer_status', methods=['GET'])
+@login_required
+@query_budget(15)
+def timer_status():
+    """Get the status of all of the user's timers as NDJSON, one task per line
+
+    Running timers report when they end rather than how long is left, so the
+    payload only changes when timer state does and the ETag stays stable.
+    Pass ?ids=1,2,3 to also get the state of tasks the client still tracks.
+    """
+    tracked_ids = [int(task_id) for task_id in request.args.get('ids', '').split(',') if task_id.isdigit()]
+    
+    tasks = Task.query.filter(
+        Task.user_id == current_user.id,
+        or_(Task.is_completed.is_(False), Task.id.in_(tracked_ids))
+    ).order_by(Task.id).all()
+    
+    lines = []
+    completed_now = False
+    for task in tasks:
+        status = {'id': task.id}
+        if task.is_timer_completed():
+            # Auto-complete timers that ran out while nobody was polling
+            status['points'] = round(task.complete_task(), 2)
+            completed_now = True
+        
+        if task.is_completed:
+            status['state'] = 'completed'
+        elif task.is_active and task.expected_completion:
+            status['state'] = 'running'
+            status['ends_at'] = int(task.expected_completion.replace(tzinfo=pytz.utc).timestamp() * 1000)
+        else:
+            status['state'] = 'paused'
+            status['remaining'] = task.get_remaining_seconds()
+        lines.append(status)
+    
+    # Read before the commit expires the tasks, which would reload each one
+    found_ids = {task.id for task in tasks}
+    if completed_now:
+        db.session.commit()
+    
+    lines.extend({'id': task_id, 'state': 'missing'} for task_id in tracked_ids if task_id not in found_ids)
+    
+    body = ''.join(json.dumps(line, separators=(',', ':')) + '\n' for line in lines)
+    response = current_app.response_class(body, mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['X-Server-Time'] = str(int(datetime.utcnow().replace(tzinfo=pytz.utc).timestamp() * 1000))
+    response.add_etag()
+    return response.make_conditional(request)
+
+@main.route('/avatars/<path:filename>')
+def avatar_file(filename):
+    """Serve a content-addressed avatar variant; its name changes whenever its bytes do"""
+    response = send_from_directory(avatar_processor.output_folder, filename, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@main.route('/sw.js')
+def service_worker():
+    """Service worker with the precache manifest for the current build"""
+    response = current_app.response_class(asset_pipeline.service_worker_script, mimetype='text/javascript')
+    # Browsers revalidate the worker on navigation; the ETag changes only when the manifest does
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    response.set_etag(asset_pipeline.precache_manifest['version'])
+    return response.make_conditional(request)
+
+@main.route('/offline.html')
+def offline_page():
+    """Fallback page the service worker shows for uncached routes"""
+    return render_template('offline.html')
+
+@main.route('/events')
+@login_required
+def events():
+    """Server-sent events stream of timer, points and challenge updates for the user"""
+    if not event_broker.enabled:
+        # 204 tells EventSource to stop reconnecting, so the page keeps polling
+        return '', 204
+    user_id = current_user.id
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    max_stream = current_app.config['SSE_MAX_STREAM_SECONDS']
+    subscriber = event_broker.subscribe(user_id)
+    
+    def stream():
+        # Streams are capped so they don't pin a worker forever; the browser reconnects
+        deadline = time.monotonic() + max_stream
+        try:
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    event_name, data = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: {event_name}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            event_broker.unsubscribe(user_id, subscriber)
+    
+    response = current_app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @main.route('/complete_task/<int:task_id>', methods=['POST'])
 @login_required
 def complete_task_route(task_id):
@@ -249,10 +381,7 @@ def complete_task_route(task_id):
         old_streak = current_user.current_streak
         old_hours = current_user.total_study_time // 60
         
-        # Stop server-side timer and complete task
-        task.is_active = False
-        task.started_at = None
-        task.expected_completion = None
+        # Complete the task, which also stops its server-side timer
         points_earned = task.complete_task()
         db.session.commit()
         
@@ -296,6 +425,28 @@ def complete_task_route(task_id):
     
     return jsonify({'error': 'Task not found or already completed'})
 
+@main.route('/sync', methods=['POST'])
+@login_required
+def sync_offline_operations():
+    """Apply a batch of actions queued offline in one transaction, with per-operation results"""
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    if not isinstance(operations, list):
+        return jsonify({'error': 'Expected a list of operations'}), 400
+    if len(operations) > current_app.config['SYNC_MAX_OPERATIONS']:
+        return jsonify({'error': f"At most {current_app.config['SYNC_MAX_OPERATIONS']} operations per sync"}), 413
+
+    try:
+        results = apply_operations(current_user, operations)
+        db.session.commit()
+    except IntegrityError:
+        # Another request from this user applied some of the same operations first;
+        # retrying returns their stored results
+        db.session.rollback()
+        return jsonify({'error': 'Sync conflict, please retry'}), 409
+
+    return jsonify({'results': results, 'total_points': current_user.total_points})
+
 @main.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
@@ -304,42 +455,22 @@ def profile():
     if form.validate_on_submit():
         # Check current password if trying to change password
         if form.new_password.data:
-            if not form.current_password.data or not current_user.check_password(form.current_password.data):
-                flash('Current password is incorrect.', 'danger')
-                return render_template('profile.html', form=form)
-            current_user.set_password(form.new_password.data)
+            try:
+                if not form.current_password.data or not current_user.check_password(form.current_password.data):
+                    flash('Current password is incorrect.', 'danger')
+                    return render_template('profile.html', form=form)
+                current_user.set_password(form.new_password.data)
+            except HashingBusy:
+                flash('The server is busy right now, so your profile was not saved. Please try again in a moment.', 'warning')
+                return render_template('profile.html', form=form), 503
         
-        # Handle profile image upload
+        # Handle profile image upload; resizing happens off the request on the avatar pool
         if form.profile_image.data:
             try:
-                file = form.profile_image.data
-                filename = secure_filename(file.filename)
-                
-                # Generate unique filename
-                unique_filename = f"{current_user.id}_{secrets.token_hex(8)}_{filename}"
-                
-                # Save file
-                upload_path = os.path.join(current_app.root_path, 'static', 'uploads', 'profiles')
-                os.makedirs(upload_path, exist_ok=True)
-                file_path = os.path.join(upload_path, unique_filename)
-                
-                # Resize and save image
-                image = Image.open(file)
-                image = image.convert('RGB')  # Convert to RGB if needed
-                
-                # Resize to 300x300 pixels
-                image.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                image.save(file_path, 'JPEG', quality=85)
-                
-                # Delete old profile image if it exists and isn't default
-                if current_user.profile_image and current_user.profile_image != 'default.png':
-                    old_file_path = os.path.join(upload_path, current_user.profile_image)
-                    if os.path.exists(old_file_path):
-                        os.remove(old_file_path)
-                
-                current_user.profile_image = unique_filename
-                flash('Profile image updated successfully!', 'success')
+                avatar_processor.submit(current_user.id, form.profile_image.data)
+                flash('Profile image uploaded! It will appear in a few seconds.', 'success')
             except Exception as e:
+                current_app.logger.error(f"Profile image upload failed: {e}")
                 flash('Error uploading image. Please try again.', 'danger')
         
         current_user.username = form.username.data
@@ -355,20 +486,39 @@ def profile():
     
     return render_template('profile.html', form=form)
 
-@main.route('/progress')
-@login_required
-def progress():
-    # Get last 30 days of study data
-    ist = pytz.timezone('Asia/Kolkata')
-    end_date = datetime.now(ist).date()
-    start_date = end_date - timedelta(days=29)
-    
-    daily_stats = DailyStats.query.filter_by(user_id=current_user.id).filter(
+def wants_json():
+    """True if the client asked for the JSON variant of a page"""
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+def page_etag(*parts):
+    """ETag for the current user's view of a page built from the given data versions"""
+    # Asset fingerprints change the page's script and style URLs; the half-hour bucket keeps
+    # the CSRF token in a revalidated page well inside its time limit
+    key = [current_user.id, asset_pipeline.precache_manifest['version'], int(time.time() // 1800), wants_json(), *parts]
+    return hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()[:32]
+
+def cacheable(response, etag):
+    """Make a response revalidate against etag on every view"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept')
+    response.vary.add('Cookie')
+    return response
+
+def not_modified(etag):
+    """A 304 response if the client's copy is current, otherwise None"""
+    # Pending flash messages would be lost from a page that isn't re-rendered
+    if '_flashes' in session or not request.if_none_match.contains(etag):
+        return None
+    return cacheable(current_app.response_class(status=304), etag)
+
+def build_progress_chart(user_id, start_date, end_date):
+    """Hours studied per day between start_date and end_date"""
+    daily_stats = DailyStats.query.filter_by(user_id=user_id).filter(
         DailyStats.date >= start_date,
         DailyStats.date <= end_date
     ).all()
     
-    # Create data for chart
     chart_data = []
     current_date = start_date
     stats_dict = {stat.date: stat.minutes_studied for stat in daily_stats}
@@ -381,8 +531,39 @@ def progress():
             'hours': round(hours, 1)
         })
         current_date += timedelta(days=1)
+    return chart_data
+
+@main.route('/progress')
+@login_required
+@query_budget(8)
+def progress():
+    # Get last 30 days of study data
+    ist = pytz.timezone('Asia/Kolkata')
+    end_date = datetime.now(ist).date()
+    start_date = end_date - timedelta(days=29)
     
-    return render_template('progress.html', chart_data=chart_data)
+    user_version, = data_versions.get(user_scope(current_user.id))
+    etag = page_etag('progress', user_version, end_date)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    chart_data = data_versions.fragment(
+        ('progress', current_user.id, user_version, end_date),
+        lambda: build_progress_chart(current_user.id, start_date, end_date)
+    )
+    
+    if wants_json():
+        response = jsonify({
+            'chart_data': chart_data,
+            'total_points': current_user.total_points,
+            'rank': current_user.get_rank(),
+            'current_streak': current_user.current_streak,
+            'max_streak': current_user.max_streak,
+        })
+    else:
+        response = make_response(render_template('progress.html', chart_data=chart_data))
+    return cacheable(response, etag)
 
 @main.route('/competition', methods=['GET', 'POST'])
 @login_required
@@ -443,6 +624,7 @@ def accept_challenge(challenge_id):
     challenge.status = 'active'
     challenge.start_date = datetime.utcnow()  # Reset start date when accepted
     challenge.end_date = datetime.utcnow() + timedelta(days=challenge.duration_days)
+    challenge.queue_update_events()
     db.session.commit()
     
     # Send acceptance confirmation email to challenger 
@@ -485,25 +667,29 @@ def decline_challenge(challenge_id):
     flash('Challenge declined.', 'info')
     return redirect(url_for('main.competition'))
 
-@main.route('/leaderboard')
-@login_required
-def leaderboard():
-    # Get top 10 users by total points
-    top_users = User.query.order_by(User.total_points.desc()).limit(10).all()
+def build_leaderboard():
+    """Top 10 users as JSON-ready entries plus their rendered table rows"""
+    # Get the top users by total points
+    top_users = User.query.order_by(User.total_points.desc()).limit(LEADERBOARD_SIZE).all()
+    user_ids = [user.id for user in top_users]
+    
+    # Last activity for all of them at once (last completed task, else last task creation)
+    last_completed = dict(db.session.query(Task.user_id, db.func.max(Task.completed_at)).filter(
+        Task.user_id.in_(user_ids), Task.is_completed.is_(True)
+    ).group_by(Task.user_id))
+    # Older completions have been moved to the archive
+    last_archived = dict(db.session.query(ArchivedTask.user_id, db.func.max(ArchivedTask.completed_at)).filter(
+        ArchivedTask.user_id.in_(user_ids)
+    ).group_by(ArchivedTask.user_id))
+    last_created = dict(db.session.query(Task.user_id, db.func.max(Task.created_at)).filter(
+        Task.user_id.in_(user_ids)
+    ).group_by(Task.user_id))
     
     leaderboard_data = []
     ist = pytz.timezone('Asia/Kolkata')
     for i, user in enumerate(top_users, 1):
-        # Calculate last active (last completed task or task creation)
-        last_completed_task = Task.query.filter_by(user_id=user.id, is_completed=True).order_by(Task.completed_at.desc()).first()
-        last_any_task = Task.query.filter_by(user_id=user.id).order_by(Task.created_at.desc()).first()
-
-        if last_completed_task and last_completed_task.completed_at:
-            last_active_utc = last_completed_task.completed_at
-        elif last_any_task:
-            last_active_utc = last_any_task.created_at
-        else:
-            last_active_utc = user.joined_date
+        last_active_utc = (last_completed.get(user.id) or last_archived.get(user.id)
+                           or last_created.get(user.id) or user.joined_date)
 
         # Convert UTC to Asia/Kolkata
         if last_active_utc and last_active_utc.tzinfo is None:
@@ -519,7 +705,41 @@ def leaderboard():
             'last_active': last_active
         })
     
-    return render_template('leaderboard.html', leaderboard_data=leaderboard_data)
+    # Only plain values are cached, never the ORM objects
+    return {
+        'html': Markup(render_template('_leaderboard_table.html', leaderboard_data=leaderboard_data)),
+        'user_ids': [entry['user'].id for entry in leaderboard_data],
+        'entries': [{
+            'rank': entry['rank'],
+            'user_id': entry['user'].id,
+            'username': entry['user'].username,
+            'points': entry['points'],
+            'rank_name': entry['rank_name'],
+            'streak': entry['streak'],
+            'last_active': entry['last_active'].isoformat() if entry['last_active'] else None,
+        } for entry in leaderboard_data],
+    }
+
+@main.route('/leaderboard')
+@login_required
+@query_budget(10)
+def leaderboard():
+    leaderboard_version = data_versions.leaderboard_version()
+    user_version, = data_versions.get(user_scope(current_user.id))
+    etag = page_etag('leaderboard', leaderboard_version, user_version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    board = data_versions.fragment(('leaderboard', leaderboard_version), build_leaderboard)
+    
+    if wants_json():
+        response = jsonify({'leaderboard': board['entries']})
+    else:
+        response = make_response(render_template('leaderboard.html',
+                                                 leaderboard_table=board['html'],
+                                                 leaderboard_user_ids=board['user_ids']))
+    return cacheable(response, etag)
 
 @main.route('/help')
 def help():
@@ -548,9 +768,6 @@ def forgot_password():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user:
-            user.reset_token = secrets.token_urlsafe(32)
-            user.reset_token_expires = datetime.utcnow() + timedelta(hours=1)
-            db.session.commit()
             send_reset_email(user)
         
         flash('If an account with that email exists, a password reset link has been sent.', 'info')
@@ -563,16 +780,19 @@ def reset_password(token):
     if current_user.is_authenticated:
         return redirect(url_for('main.home'))
     
-    user = User.query.filter_by(reset_token=token).first()
-    if not user or user.reset_token_expires < datetime.utcnow():
+    user = User.verify_reset_token(token)
+    if not user:
         flash('Invalid or expired reset token.', 'danger')
         return redirect(url_for('main.forgot_password'))
     
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        user.set_password(form.password.data)
-        user.reset_token = None
-        user.reset_token_expires = None
+        # Changing the hash also invalidates this token
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash('The server is busy right now. Please try again in a moment.', 'warning')
+            return render_template('reset_password.html', form=form), 503
         db.session.commit()
         flash('Password reset successful! You can now log in.', 'success')
         return redirect(url_for('main.login'))
@@ -645,6 +865,38 @@ def ai_friend_chat():
         current_app.logger.error(f"AI Friend chat error: {e}")
         return jsonify({'error': 'Failed to process message'}), 500
 
+@main.route('/ai-friend/search')
+@login_required
+def ai_friend_search():
+    """Full-text search over the user's AI chat history
+
+    Searches the last CHAT_RETENTION_DAYS by default; archived=1 searches older messages.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Search query cannot be empty'}), 400
+    
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    archived = request.args.get('archived', '0') == '1'
+    
+    try:
+        results, has_more = search_chat_history(current_user.id, query, page=page, per_page=per_page,
+                                                archived=archived)
+        return jsonify({
+            'success': True,
+            'query': query,
+            'page': page,
+            'has_more': has_more,
+            'archived': archived,
+            # Older messages are only found by a separate archived=1 search
+            'retention_days': current_app.config['CHAT_RETENTION_DAYS'],
+            'results': results
+        })
+    except Exception as e:
+        current_app.logger.error(f"AI Friend search error: {e}")
+        return jsonify({'error': 'Failed to search chat history'}), 500
+
 @main.route('/ai-friend/settings', methods=['POST'])
 @login_required
 def ai_friend_settings():
@@ -681,8 +933,11 @@ def ai_friend_settings():
 def clear_ai_history():
     """Clear AI chat history"""
     try:
-        AIChatHistory.query.filter_by(user_id=current_user.id).delete()
+        # Chat history can be huge, so the retention service deletes it in batches
+        retention_service.request_clear(current_user.id)
         UserQuality.query.filter_by(user_id=current_user.id).delete()
+        # A bulk delete skips the unit of work, so the AI context cache needs telling
+        add_cache_tags(db.session, f"user:{current_user.id}")
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Chat history and learned qualities cleared'})
@@ -0,0 +1,300 @@
+"""
+Synthetic Data
+Fills the database with a realistic, deterministic dataset for load and scale
+testing:
+
+    flask --app main seed-data --users 100000 --seed 42
+
+Activity follows a long tail: many users barely use the app and a few study
+every day. Each user's tasks, daily stats, AI chats and learned qualities are
+generated from a random stream seeded by (seed, user number), so the same seed
+and anchor date always produce the same rows, whatever the batch size; only
+the password hash's salt differs between runs. Points, streaks, study time and
+DailyStats are derived from the generated tasks, so the aggregates agree with
+the rows. Rows go in with COPY on PostgreSQL and executemany elsewhere.
+
+Every generated user has the password SEED_PASSWORD.
+"""
+import csv
+from datetime import datetime, time, timedelta
+import io
+import logging
+import random
+from extensions import db
+
+SEED_PASSWORD = 'seed-password'
+
+# complete_task() awards 1/12 point per minute and files stats under the IST date
+POINTS_PER_MINUTE = 0.083333
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+TASK_TITLES = ['Calculus problem set', 'Read chapter', 'Organic chemistry notes', 'Physics revision',
+               'History essay draft', 'Vocabulary flashcards', 'Past paper', 'Lab report',
+               'Programming exercises', 'Statistics homework', 'Literature review', 'Mock test']
+TASK_DURATIONS = [15, 20, 25, 30, 45, 60, 90, 120, 180]
+TASK_DURATION_WEIGHTS = [6, 4, 12, 14, 12, 20, 10, 6, 2]
+AI_PERSONALITIES = ['supportive', 'motivational', 'casual', 'professional']
+QUALITIES = {
+    'favorite_subject': ['maths', 'physics', 'biology', 'history', 'literature', 'computer science'],
+    'study_time': ['early morning', 'afternoon', 'late night'],
+    'goal': ['pass my exams', 'get into university', 'learn to code', 'improve my grades'],
+    'learning_style': ['visual', 'practice problems', 'reading', 'group study'],
+    'motivation': ['my family', 'a scholarship', 'my future career', 'proving myself'],
+}
+USER_MESSAGES = ['How can I focus better?', 'I keep procrastinating', 'Can you make me a study plan?',
+                 'I finished my tasks today!', 'I feel tired', 'What should I study next?',
+                 'Give me some motivation', 'How do I keep my streak going?']
+AI_MESSAGES = ['Try a 25 minute focus block, then a short break.', 'Great work, keep the momentum going!',
+               'Start with the hardest subject while you are fresh.', 'Small steps every day add up.',
+               'Let\'s break that into smaller tasks.', 'Remember to rest; a tired mind learns slowly.']
+
+COLUMNS = {
+    'user': ('id', 'username', 'email', 'password_hash', 'profile_image', 'total_points', 'current_streak',
+             'max_streak', 'last_study_date', 'grace_days_used', 'total_study_time', 'is_verified',
+             'joined_date', 'last_active', 'email_notifications', 'daily_reminders', 'weekly_summaries',
+             'achievement_emails', 'challenge_emails', 'ai_name', 'ai_personality'),
+    'task': ('id', 'user_id', 'title', 'duration_minutes', 'is_completed', 'created_at', 'completed_at',
+             'started_at', 'expected_completion', 'is_active'),
+    'running_timer': ('task_id', 'user_id', 'expected_completion'),
+    'daily_stats': ('id', 'user_id', 'date', 'minutes_studied', 'points_earned', 'tasks_completed'),
+    'challenge': ('id', 'challenger_id', 'challenged_id', 'duration_days', 'start_date', 'end_date',
+                  'challenger_points', 'challenged_points', 'status', 'winner_id', 'points_gained', 'created_at'),
+    'ai_chat_history': ('id', 'user_id', 'sender', 'message', 'timestamp'),
+    'user_quality': ('id', 'user_id', 'quality_name', 'quality_value', 'learned_date'),
+}
+# Parents before children, for foreign keys
+TABLE_ORDER = ('user', 'task', 'running_timer', 'daily_stats', 'challenge', 'ai_chat_history', 'user_quality')
+
+
+class _IdSequence:
+    def __init__(self, start):
+        self.next_id = start
+
+    def take(self):
+        value = self.next_id
+        self.next_id += 1
+        return value
+
+
+class DatasetGenerator:
+    """Builds the rows for users number first..first+count-1 of a dataset"""
+
+    def __init__(self, seed, anchor, prefix, password_hash, first_user_id, next_ids):
+        self.seed = seed
+        self.anchor = anchor  # midnight UTC after the last day of generated activity
+        self.prefix = prefix
+        self.password_hash = password_hash
+        self.first_user_id = first_user_id
+        self.ids = {table: _IdSequence(start) for table, start in next_ids.items()}
+
+    def build_batch(self, first, count):
+        rows = {table: [] for table in TABLE_ORDER}
+        for number in range(first, first + count):
+            self._build_user(number, rows)
+        return rows
+
+    def _build_user(self, number, rows):
+        rng = random.Random(f"{self.seed}:{number}")
+        user_id = self.first_user_id + number
+        joined = self.anchor - timedelta(seconds=rng.uniform(3600, 365 * 86400))
+
+        # Long-tailed activity: a third of users never come back after signing up
+        active = rng.random() > 0.33
+        task_count = min(400, int(rng.paretovariate(1.2) * 3)) if active else rng.randint(0, 1)
+
+        study_days = {}
+        total_minutes = 0
+        total_points = 0.0
+        last_completed = None
+        for _ in range(task_count):
+            task_id = self.ids['task'].take()
+            duration = rng.choices(TASK_DURATIONS, TASK_DURATION_WEIGHTS)[0]
+            created = joined + (self.anchor - joined) * (rng.random() ** 0.5)
+            completed_at = started_at = expected_completion = None
+            is_active = False
+            if rng.random() < 0.85 and created + timedelta(minutes=duration) < self.anchor:
+                completed_at = min(created + timedelta(minutes=duration + rng.uniform(0, 240)), self.anchor)
+                points = duration * POINTS_PER_MINUTE
+                day = (completed_at + IST_OFFSET).date()
+                minutes, day_points, tasks = study_days.get(day, (0, 0.0, 0))
+                study_days[day] = (minutes + duration, day_points + points, tasks + 1)
+                total_minutes += duration
+                total_points += points
+                last_completed = max(last_completed or completed_at, completed_at)
+            elif rng.random() < 0.1:
+                is_active = True
+                started_at = self.anchor - timedelta(minutes=rng.uniform(0, duration))
+                expected_completion = started_at + timedelta(minutes=duration)
+                rows['running_timer'].append((task_id, user_id, expected_completion))
+            rows['task'].append((task_id, user_id, rng.choice(TASK_TITLES), duration, completed_at is not None,
+                                 created, completed_at, started_at, expected_completion, is_active))
+
+        for day in sorted(study_days):
+            minutes, day_points, tasks = study_days[day]
+            rows['daily_stats'].append((self.ids['daily_stats'].take(), user_id, day, minutes, day_points, tasks))
+
+        current_streak, max_streak, last_study_date = self._streaks(study_days)
+        username = f"{self.prefix}{number}"
+        rows['user'].append((
+            user_id, username, f"{username}@example.com", self.password_hash, 'default.png', total_points,
+            current_streak, max_streak, last_study_date, 0, total_minutes, rng.random() < 0.85,
+            joined, last_completed or joined, rng.random() < 0.9, rng.random() < 0.8, rng.random() < 0.8,
+            rng.random() < 0.9, rng.random() < 0.9, 'StudyBot', rng.choice(AI_PERSONALITIES),
+        ))
+
+        if active and rng.random() < 0.1 and number > 0:
+            self._build_challenge(rng, user_id, number, joined, rows)
+        if active and rng.random() < 0.25:
+            self._build_chats(rng, user_id, joined, rows)
+        if active and rng.random() < 0.4:
+            for name in rng.sample(sorted(QUALITIES), rng.randint(1, 3)):
+                learned = joined + (self.anchor - joined) * rng.random()
+                rows['user_quality'].append((self.ids['user_quality'].take(), user_id, name,
+                                             rng.choice(QUALITIES[name]), learned))
+
+    def _streaks(self, study_days):
+        """(current streak, longest streak, last study date) from the days a user studied"""
+        if not study_days:
+            return 0, 0, None
+        days = sorted(study_days)
+        longest = run = 1
+        for previous, day in zip(days, days[1:]):
+            run = run + 1 if (day - previous).days == 1 else 1
+            longest = max(longest, run)
+        # The streak only counts if it reaches today or yesterday
+        today = (self.anchor - timedelta(seconds=1) + IST_OFFSET).date()
+        current = run if (today - days[-1]).days <= 1 else 0
+        return current, longest, days[-1]
+
+    def _build_challenge(self, rng, user_id, number, joined, rows):
+        opponent_id = self.first_user_id + rng.randrange(number)
+        duration_days = rng.choice([3, 7, 14, 30])
+        start = joined + (self.anchor - joined) * rng.random()
+        end = start + timedelta(days=duration_days)
+        status = rng.choices(['completed', 'active', 'pending', 'declined'], [50, 15, 15, 20])[0]
+        if status == 'completed' and end > self.anchor:
+            status = 'active'
+        elif status == 'active' and end <= self.anchor:
+            status = 'completed'
+        challenger_points = challenged_points = 0.0
+        winner_id = None
+        points_gained = 0.0
+        if status in ('active', 'completed'):
+            challenger_points = round(rng.uniform(0, 20) * duration_days, 2)
+            challenged_points = round(rng.uniform(0, 20) * duration_days, 2)
+        if status == 'completed' and challenger_points != challenged_points:
+            winner_id = user_id if challenger_points > challenged_points else opponent_id
+            points_gained = round(abs(challenger_points - challenged_points) * 0.1, 2)
+        rows['challenge'].append((self.ids['challenge'].take(), user_id, opponent_id, duration_days, start, end,
+                                  challenger_points, challenged_points, status, winner_id, points_gained,
+                                  start - timedelta(hours=rng.uniform(0, 48))))
+
+    def _build_chats(self, rng, user_id, joined, rows):
+        for _ in range(min(20, int(rng.paretovariate(1.5)))):
+            timestamp = joined + (self.anchor - joined) * rng.random()
+            for _ in range(rng.randint(1, 4)):
+                rows['ai_chat_history'].append((self.ids['ai_chat_history'].take(), user_id, 'user',
+                                                rng.choice(USER_MESSAGES), timestamp))
+                timestamp += timedelta(seconds=rng.uniform(1, 5))
+                rows['ai_chat_history'].append((self.ids['ai_chat_history'].take(), user_id, 'ai',
+                                                rng.choice(AI_MESSAGES), timestamp))
+                timestamp += timedelta(seconds=rng.uniform(10, 300))
+
+
+def _copy_rows(connection, table, columns, rows):
+    """Load rows with COPY ... FROM STDIN, PostgreSQL's fastest bulk path"""
+    buffer = io.StringIO()
+    # Strings are quoted and None is written unquoted, which COPY reads as NULL
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    column_list = ', '.join(preparer.quote(column) for column in columns)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {preparer.format_table(table)} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def _executemany_rows(connection, table, columns, rows):
+    """Load rows with one DBAPI executemany, skipping SQLAlchemy's per-row parameter handling"""
+    dialect = connection.dialect
+    compiled = table.insert().compile(dialect=dialect, column_keys=list(columns))
+    processors = [table.c[column].type.dialect_impl(dialect).bind_processor(dialect) for column in columns]
+    converted = [[value if processor is None else processor(value) for processor, value in zip(processors, row)]
+                 for row in rows]
+    if compiled.positional:
+        order = [columns.index(name) for name in compiled.positiontup]
+        parameters = [tuple(row[index] for index in order) for row in converted]
+    else:
+        parameters = [dict(zip(columns, row)) for row in converted]
+    connection.exec_driver_sql(str(compiled), parameters)
+
+
+def _insert_rows(connection, table_name, rows):
+    if not rows:
+        return
+    table = db.metadata.tables[table_name]
+    columns = COLUMNS[table_name]
+    if connection.dialect.name == 'postgresql':
+        _copy_rows(connection, table, columns, rows)
+    else:
+        _executemany_rows(connection, table, columns, rows)
+
+
+def _next_ids(connection):
+    """First free id in every table that has an integer id column"""
+    next_ids = {}
+    for table_name in TABLE_ORDER:
+        table = db.metadata.tables[table_name]
+        if 'id' in table.columns:
+            next_ids[table_name] = (connection.execute(db.select(db.func.max(table.c.id))).scalar() or 0) + 1
+    return next_ids
+
+
+def _reset_sequences(connection):
+    """Move PostgreSQL id sequences past the ids COPY wrote explicitly"""
+    preparer = connection.dialect.identifier_preparer
+    for table_name in TABLE_ORDER:
+        table = db.metadata.tables[table_name]
+        if 'id' not in table.columns:
+            continue
+        quoted = preparer.format_table(table)
+        connection.exec_driver_sql(
+            f"SELECT setval(pg_get_serial_sequence('{quoted}', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {quoted}), false)")
+
+
+def seed_database(user_count, seed=0, anchor=None, prefix='seed', batch_size=5000):
+    """Generate user_count users and their activity; returns rows inserted per table
+
+    anchor is the date activity runs up to (today by default). Run inside an
+    app context; each batch is committed on its own.
+    """
+    from models import User
+    from password_hashing import password_hasher
+
+    if User.query.filter_by(username=f"{prefix}0").first():
+        raise ValueError(f"Users named {prefix}* already exist; choose another prefix")
+
+    anchor = datetime.combine(anchor or datetime.utcnow().date(), time()) + timedelta(days=1)
+    connection = db.session.connection()
+    next_ids = _next_ids(connection)
+    generator = DatasetGenerator(seed, anchor, prefix, password_hasher.hash(SEED_PASSWORD),
+                                 next_ids.pop('user'), next_ids)
+
+    totals = dict.fromkeys(TABLE_ORDER, 0)
+    for first in range(0, user_count, batch_size):
+        rows = generator.build_batch(first, min(batch_size, user_count - first))
+        connection = db.session.connection()
+        for table_name in TABLE_ORDER:
+            _insert_rows(connection, table_name, rows[table_name])
+            totals[table_name] += len(rows[table_name])
+        db.session.commit()
+        logging.info(f"Seeded {min(first + batch_size, user_count)}/{user_count} users")
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        _reset_sequences(connection)
+        db.session.commit()
+    return totals
@@ -0,0 +1,111 @@
+/**
+ * DARKSULFOCUS - Live Updates
+ * Listens to the server-sent events stream and updates the page as timers
+ * complete, points change, challenge scores move and new avatars are ready,
+ * instead of polling.
+ * Every event is also re-dispatched on window as `darkfocus:<event>`.
+ */
+
+class LiveEvents {
+    constructor() {
+        this.source = null;
+        this.connected = false;
+        this.eventNames = ['timer_complete', 'points', 'challenge_update', 'avatar_ready'];
+    }
+
+    connect() {
+        if (!window.EventSource || this.source) return;
+
+        this.source = new EventSource('/events');
+
+        this.source.onopen = () => {
+            this.connected = true;
+        };
+
+        this.source.onerror = () => {
+            // EventSource reconnects on its own; fall back to polling meanwhile
+            this.connected = false;
+        };
+
+        this.eventNames.forEach(eventName => {
+            this.source.addEventListener(eventName, (e) => {
+                const data = JSON.parse(e.data);
+                this.handleEvent(eventName, data);
+                window.dispatchEvent(new CustomEvent(`darkfocus:${eventName}`, { detail: data }));
+            });
+        });
+    }
+
+    handleEvent(eventName, data) {
+        if (eventName === 'points') {
+            document.querySelectorAll('[data-live="total-points"]').forEach(element => {
+                element.textContent = data.total_points.toFixed(1);
+            });
+            document.querySelectorAll('[data-live="rank"]').forEach(element => {
+                element.textContent = data.rank;
+            });
+        } else if (eventName === 'avatar_ready') {
+            // Swap in the new profile image once the server has resized it
+            document.querySelectorAll('img[data-live="avatar"]').forEach(element => {
+                this.updateAvatar(element, data.profile_image);
+            });
+        } else if (eventName === 'challenge_update') {
+            document.querySelectorAll(`[data-challenge-id="${data.challenge_id}"]`).forEach(element => {
+                this.updateChallenge(element, data);
+            });
+        }
+    }
+
+    updateAvatar(element, digest) {
+        // Variant names mirror avatar_processing.AVATAR_SIZES
+        const displaySize = parseInt(element.dataset.avatarSize || '300', 10);
+        const pick = (size) => [64, 128, 300].find(s => s >= size) || 300;
+        const url = (size, ext) => `/avatars/${digest}_${pick(size)}.${ext}`;
+        const srcset = (ext) => `${url(displaySize, ext)} 1x, ${url(displaySize * 2, ext)} 2x`;
+
+        const picture = element.parentElement.tagName === 'PICTURE' ? element.parentElement : null;
+        const webpSource = picture && picture.querySelector('source[type="image/webp"]');
+        if (webpSource) {
+            webpSource.srcset = srcset('webp');
+        }
+        element.srcset = srcset('jpg');
+        element.src = url(displaySize, 'jpg');
+    }
+
+    updateChallenge(element, data) {
+        const challengerPoints = element.querySelector('[data-live="challenger-points"]');
+        const challengedPoints = element.querySelector('[data-live="challenged-points"]');
+        if (challengerPoints) challengerPoints.textContent = data.challenger_points.toFixed(1);
+        if (challengedPoints) challengedPoints.textContent = data.challenged_points.toFixed(1);
+
+        const total = data.challenger_points + data.challenged_points;
+        const challengerPercent = total > 0 ? data.challenger_points / total * 100 : 50;
+        const challengerBar = element.querySelector('[data-live="challenger-bar"]');
+        const challengedBar = element.querySelector('[data-live="challenged-bar"]');
+        if (challengerBar) challengerBar.style.width = `${challengerPercent}%`;
+        if (challengedBar) challengedBar.style.width = `${100 - challengerPercent}%`;
+
+        if (data.status === 'completed') {
+            element.classList.add('competition-ended');
+        }
+    }
+
+    close() {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+            this.connected = false;
+        }
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    window.liveEvents = new LiveEvents();
+    window.liveEvents.connect();
+});
+
+window.addEventListener('beforeunload', function() {
+    if (window.liveEvents) {
+        window.liveEvents.close();
+    }
+});
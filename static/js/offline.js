@@ -136,7 +136,7 @@ class OfflineManager {
     // Add task offline
     addTaskOffline(formData) {
         const task = {
-            id: 'offline_' + Date.now(),
+            id: this.newOperationId('offline'),
             title: formData.get('title'),
             duration_minutes: parseInt(formData.get('duration_minutes')),
             created_at: new Date().toISOString(),
@@ -159,6 +159,7 @@ class OfflineManager {
         
         const completedTask = {
             id: taskId,
+            op_id: this.newOperationId('complete'),
             time_spent_minutes: timeSpent,
             points: points,
             completed_at: new Date().toISOString(),
@@ -258,39 +259,50 @@ class OfflineManager {
         }
     }
 
-    // Sync offline data when back online
+    // Sync offline data when back online, in a single request
     async syncWhenOnline() {
         if (!this.isOnline || this.isSyncing) return;
 
+        const operations = this.buildSyncOperations();
+        if (operations.length === 0) return;
+
         this.isSyncing = true;
         this.showOfflineMessage('Syncing offline changes...', 'info');
 
         try {
-            // Sync tasks
-            for (const task of this.offlineData.tasks) {
-                if (task.offline) {
-                    await this.syncTask(task);
-                }
+            const response = await fetch('/sync', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': this.getCSRFToken()
+                },
+                body: JSON.stringify({ operations })
+            });
+
+            if (!response.ok) {
+                throw new Error(`Sync failed with status ${response.status}`);
             }
 
-            // Sync completed tasks
-            for (const completedTask of this.offlineData.completedTasks) {
-                if (completedTask.offline) {
-                    await this.syncCompletedTask(completedTask);
-                }
-            }
+            // Every operation the server answered has been applied or rejected for good;
+            // operation ids are idempotency keys, so a lost response is safe to resend
+            const { results } = await response.json();
+            const answered = new Set(results.map(result => result.id));
+            const failed = results.filter(result => result.status === 'error');
 
-            // Clear synced data
-            this.offlineData.tasks = this.offlineData.tasks.filter(t => !t.offline);
-            this.offlineData.completedTasks = this.offlineData.completedTasks.filter(t => !t.offline);
+            this.offlineData.tasks = this.offlineData.tasks.filter(t => !(t.offline && answered.has(t.id)));
+            this.offlineData.completedTasks = this.offlineData.completedTasks.filter(t => !(t.offline && answered.has(t.op_id)));
             this.offlineData.lastSync = new Date().toISOString();
             this.saveOfflineData();
 
-            this.showOfflineMessage('All changes synced successfully!', 'success');
-            
+            if (failed.length > 0) {
+                this.showOfflineMessage(`Synced with ${failed.length} change(s) rejected: ${failed[0].error}`, 'error');
+            } else {
+                this.showOfflineMessage('All changes synced successfully!', 'success');
+            }
+
             // Reload page to get fresh data
             setTimeout(() => window.location.reload(), 2000);
-            
+
         } catch (error) {
             console.error('Sync failed:', error);
             this.showOfflineMessage('Sync failed. Will retry later.', 'error');
@@ -299,44 +311,49 @@ class OfflineManager {
         }
     }
 
-    // Sync individual task
-    async syncTask(task) {
-        const formData = new FormData();
-        formData.append('title', task.title);
-        formData.append('duration_minutes', task.duration_minutes);
-        formData.append('csrf_token', this.getCSRFToken());
+    // Queued changes in the order they were made, tagged with their idempotency keys
+    buildSyncOperations() {
+        const operations = [];
+
+        this.offlineData.tasks.filter(task => task.offline).forEach(task => {
+            operations.push({
+                id: task.id,
+                type: 'add_task',
+                at: task.created_at,
+                data: { title: task.title, duration_minutes: task.duration_minutes }
+            });
+        });
 
-        const response = await fetch('/add_task', {
-            method: 'POST',
-            body: formData
+        this.offlineData.completedTasks.filter(task => task.offline).forEach(completedTask => {
+            // Entries saved before operation ids existed get one now
+            if (!completedTask.op_id) {
+                completedTask.op_id = this.newOperationId('complete');
+            }
+            operations.push({
+                id: completedTask.op_id,
+                type: 'complete_task',
+                at: completedTask.completed_at,
+                // Either a server task id or the id of a task added offline
+                data: { task_id: completedTask.id }
+            });
         });
+        this.saveOfflineData();
 
-        if (!response.ok) {
-            throw new Error('Failed to sync task');
-        }
+        return operations
+            .sort((a, b) => a.at.localeCompare(b.at))
+            .map(({ at, ...operation }) => operation);
     }
 
-    // Sync completed task
-    async syncCompletedTask(completedTask) {
-        const formData = new FormData();
-        formData.append('task_id', completedTask.id);
-        formData.append('time_spent_minutes', completedTask.time_spent_minutes);
-        formData.append('csrf_token', this.getCSRFToken());
-
-        const response = await fetch('/complete_task', {
-            method: 'POST',
-            body: formData
-        });
-
-        if (!response.ok) {
-            throw new Error('Failed to sync completed task');
-        }
+    newOperationId(prefix) {
+        const random = Math.random().toString(36).slice(2, 10);
+        return `${prefix}_${Date.now()}_${random}`;
     }
 
     // Get CSRF token from page
     getCSRFToken() {
-        const token = document.querySelector('input[name="csrf_token"]');
-        return token ? token.value : '';
+        const token = document.querySelector('meta[name="csrf-token"]') ||
+                      document.querySelector('input[name="csrf_token"]');
+        return token ? token.content || token.value : '';
     }
 
     // Show offline message
@@ -1,28 +1,18 @@
 /**
  * DARKSULFOCUS - Service Worker for Offline Functionality
- * Caches pages, assets, and enables offline access
+ * Caches pages, assets, and enables offline access.
+ * Pages are network first, fingerprinted assets and avatars cache first, and
+ * other same-origin GETs (JSON, NDJSON, event streams) are never intercepted.
+ * Served from /sw.js, which prepends the precache manifest for the current build.
  */
 
-const CACHE_NAME = 'darksulfocus-v2';
-const STATIC_CACHE = 'darksulfocus-static-v2';
-const DYNAMIC_CACHE = 'darksulfocus-dynamic-v2';
-
-// Files to cache immediately
-const CORE_CACHE_FILES = [
-    '/',
-    '/home',
-    '/profile',
-    '/progress', 
-    '/help',
-    '/login',
-    '/register',
-    '/static/css/style.css',
-    '/static/js/app.js',
-    '/static/js/timer.js',
-    '/static/js/offline.js',
-    '/static/img/favicon.png',
-    '/offline.html'
-];
+// Injected by /sw.js: fingerprinted asset URLs, unversioned shell files and pages for this build
+const MANIFEST = self.__PRECACHE_MANIFEST;
+const PRECACHE_PREFIX = 'darksulfocus-precache-';
+const STATIC_CACHE = PRECACHE_PREFIX + MANIFEST.version;
+// v2 could hold API responses cached by an older worker; activating v3 drops it
+const DYNAMIC_CACHE = 'darksulfocus-dynamic-v3';
+const FINGERPRINTED = new Set(MANIFEST.assets);
 
 // External resources to cache
 const EXTERNAL_CACHE_FILES = [
@@ -31,37 +21,74 @@ const EXTERNAL_CACHE_FILES = [
     'https://cdn.jsdelivr.net/npm/chart.js'
 ];
 
-// Install event - cache core files
+// Install event - cache this build's files, reusing unchanged assets from the previous build
 self.addEventListener('install', event => {
-    console.log('Service Worker installing...');
+    console.log('Service Worker installing...', MANIFEST.version);
     event.waitUntil(
-        Promise.all([
-            // Cache core files
-            caches.open(STATIC_CACHE).then(cache => {
-                console.log('Caching core files...');
-                return cache.addAll(CORE_CACHE_FILES.concat(EXTERNAL_CACHE_FILES));
-            })
-        ])
+        precacheAssets().then(() => {
+            // Pages need a session; cache what we can without blocking the install
+            cachePages();
+        })
     );
     self.skipWaiting();
 });
 
-// Activate event - clean up old caches
+async function precacheAssets() {
+    const cache = await caches.open(STATIC_CACHE);
+    const previousCaches = (await caches.keys())
+        .filter(key => key.startsWith(PRECACHE_PREFIX) && key !== STATIC_CACHE);
+
+    // Fingerprinted URLs never change content, so a copy from an older cache is as good as a fetch
+    const copyOrFetch = async url => {
+        if (await cache.match(url)) return;
+        for (const key of previousCaches) {
+            const previous = await caches.open(key);
+            const cachedResponse = await previous.match(url);
+            if (cachedResponse) {
+                return cache.put(url, cachedResponse);
+            }
+        }
+        return cache.add(url);
+    };
+
+    await Promise.all(MANIFEST.assets.map(copyOrFetch));
+    await cache.addAll(MANIFEST.shell.concat(EXTERNAL_CACHE_FILES));
+}
+
+function cachePages() {
+    return caches.open(DYNAMIC_CACHE).then(cache => Promise.all(
+        MANIFEST.pages.map(url => fetch(url).then(response => {
+            if (response.ok && !response.redirected) {
+                return cache.put(url, response);
+            }
+        }).catch(() => {}))
+    ));
+}
+
+// Activate event - drop other builds' caches and assets they cached at runtime
 self.addEventListener('activate', event => {
     console.log('Service Worker activating...');
     event.waitUntil(
-        caches.keys().then(keys => {
-            return Promise.all(
-                keys.filter(key => 
-                    key !== STATIC_CACHE && 
-                    key !== DYNAMIC_CACHE
-                ).map(key => caches.delete(key))
-            );
-        })
+        caches.keys().then(keys => Promise.all(
+            keys.filter(key => key !== STATIC_CACHE && key !== DYNAMIC_CACHE)
+                .map(key => caches.delete(key))
+        )).then(pruneDynamicCache)
     );
     self.clients.claim();
 });
 
+function pruneDynamicCache() {
+    const current = new Set(MANIFEST.assets);
+    return caches.open(DYNAMIC_CACHE).then(cache => cache.keys().then(requests => Promise.all(
+        requests.filter(request => {
+            const url = new URL(request.url);
+            return url.origin === self.location.origin &&
+                (url.pathname.startsWith('/static/css/') || url.pathname.startsWith('/static/js/')) &&
+                !current.has(url.pathname);
+        }).map(request => cache.delete(request))
+    )));
+}
+
 // Fetch event - serve from cache when offline
 self.addEventListener('fetch', event => {
     const { request } = event;
@@ -73,7 +100,7 @@ self.addEventListener('fetch', event => {
             fetch(request)
                 .then(response => {
                     // If online, cache the page and return it
-                    if (response.ok) {
+                    if (isCacheable(response)) {
                         const responseClone = response.clone();
                         caches.open(DYNAMIC_CACHE).then(cache => {
                             cache.put(request, responseClone);
@@ -143,35 +170,61 @@ self.addEventListener('fetch', event => {
         return;
     }
 
-    // Handle other requests (CSS, JS, images)
+    if (request.method !== 'GET') {
+        return;
+    }
+
+    // Every other same-origin GET (timer status, chat search, ?format=json views,
+    // the event stream) goes straight to the network, so its own Cache-Control
+    // and ETag revalidation apply and nothing is served stale from here
+    const sameOrigin = url.origin === self.location.origin;
+    if (sameOrigin && !isImmutable(url) && !url.pathname.startsWith('/static/')) {
+        return;
+    }
+
+    // Fingerprinted assets and content-addressed avatars never change: cache first
+    if (isImmutable(url)) {
+        event.respondWith(
+            caches.match(request).then(cachedResponse => cachedResponse || fetchAndCache(request))
+                .catch(() => offlineFallback(request))
+        );
+        return;
+    }
+
+    // Unversioned static files and CDN resources: network first, cached copy offline
     event.respondWith(
-        caches.match(request)
-            .then(cachedResponse => {
-                if (cachedResponse) {
-                    return cachedResponse;
-                }
-                return fetch(request)
-                    .then(response => {
-                        // Cache successful responses
-                        if (response.ok) {
-                            const responseClone = response.clone();
-                            caches.open(DYNAMIC_CACHE).then(cache => {
-                                cache.put(request, responseClone);
-                            });
-                        }
-                        return response;
-                    })
-                    .catch(() => {
-                        // Return fallback for failed requests
-                        if (request.destination === 'image') {
-                            return caches.match('/static/img/favicon.png');
-                        }
-                        return new Response('Offline', { status: 503 });
-                    });
-            })
+        fetchAndCache(request)
+            .catch(() => caches.match(request).then(cachedResponse => cachedResponse || offlineFallback(request)))
     );
 });
 
+function isImmutable(url) {
+    return url.origin === self.location.origin &&
+        (FINGERPRINTED.has(url.pathname) || url.pathname.startsWith('/avatars/'));
+}
+
+function isCacheable(response) {
+    const contentType = response.headers.get('Content-Type') || '';
+    return response.ok && !contentType.startsWith('text/event-stream');
+}
+
+function fetchAndCache(request) {
+    return fetch(request).then(response => {
+        if (isCacheable(response)) {
+            const responseClone = response.clone();
+            caches.open(DYNAMIC_CACHE).then(cache => cache.put(request, responseClone));
+        }
+        return response;
+    });
+}
+
+function offlineFallback(request) {
+    if (request.destination === 'image') {
+        return caches.match('/static/img/favicon.png');
+    }
+    return new Response('Offline', { status: 503 });
+}
+
 // Store failed requests for background sync
 function storeFailedRequest(request) {
     request.clone().text().then(body => {
@@ -12,6 +12,11 @@ class TimerManager {
         this.storageKey = 'darksulfocus_timers';
         this.isPageVisible = !document.hidden;
         this.backgroundStartTime = null;
+        this.statusEtag = null;
+        this.statusIds = null;
+        this.serverClockOffset = 0;
+        this.lastStatusCheck = 0;
+        this.statusCheckInterval = 5000; // Minimum gap between server status checks
         
         this.init();
     }
@@ -472,41 +477,73 @@ class TimerManager {
         }
     }
     
-    async checkServerCompletion(taskId) {
+    async fetchServerStatus() {
+        // One request covers every tracked timer; unchanged state comes back as a 304
+        const ids = Array.from(this.timers.keys()).join(',');
+        const headers = {};
+        if (this.statusEtag && this.statusIds === ids) {
+            headers['If-None-Match'] = this.statusEtag;
+        }
+        
+        const response = await fetch(`/timer_status?ids=${ids}`, {
+            method: 'GET',
+            headers: headers,
+            cache: 'no-store'
+        });
+        
+        if (response.status === 304 || !response.ok) {
+            return null;
+        }
+        
+        const serverTime = parseInt(response.headers.get('X-Server-Time'));
+        if (serverTime) {
+            this.serverClockOffset = serverTime - Date.now();
+        }
+        this.statusEtag = response.headers.get('ETag');
+        this.statusIds = ids;
+        
+        const body = await response.text();
+        return body.split('\n').filter(line => line).map(line => JSON.parse(line));
+    }
+    
+    async syncServerStatus() {
+        let hasCompletedTimers = false;
         try {
-            const response = await fetch(`/get_timer_status/${taskId}`, {
-                method: 'GET',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': this.getCSRFToken()
-                }
-            });
+            const statuses = await this.fetchServerStatus();
+            if (!statuses) return false;
             
-            const data = await response.json();
-            if (data.success && data.completed) {
-                // Server says task is completed
-                console.log(`Server confirmed task ${taskId} completed with ${data.points_earned} points`);
-                this.handleServerCompletion(taskId, data.points_earned);
-                return true;
-            } else if (data.success && !data.completed && !data.is_completed) {
-                // Task exists but not completed - update remaining time if different
-                const timer = this.timers.get(taskId);
-                if (timer && data.remaining_seconds !== undefined) {
-                    timer.remainingSeconds = data.remaining_seconds;
+            statuses.forEach(status => {
+                const taskId = String(status.id);
+                if (!this.timers.has(taskId)) return;
+                
+                if (status.state === 'completed') {
+                    // Server says task is completed
+                    console.log(`Server confirmed task ${taskId} completed with ${status.points || 0} points`);
+                    this.handleServerCompletion(taskId, status.points || 0);
+                    hasCompletedTimers = true;
+                } else if (status.state === 'missing') {
+                    // Task was deleted on server, remove from client
+                    console.log(`Task ${taskId} not found on server - removing from client`);
+                    this.timers.delete(taskId);
+                    hasCompletedTimers = true;
+                } else {
+                    // Task exists but not completed - update remaining time if different
+                    const timer = this.timers.get(taskId);
+                    if (status.state === 'running') {
+                        const serverNow = Date.now() + (this.serverClockOffset || 0);
+                        timer.remainingSeconds = Math.max(0, Math.ceil((status.ends_at - serverNow) / 1000));
+                    } else {
+                        timer.remainingSeconds = status.remaining;
+                    }
                     this.updateTimerDisplay(taskId);
                 }
-            } else if (!data.success && data.error === 'Task not found') {
-                // Task was deleted on server, remove from client
-                console.log(`Task ${taskId} not found on server - removing from client`);
-                this.timers.delete(taskId);
-                this.saveTimersToStorage();
-                return true; // Treat as completed to stop further processing
-            }
-            return false;
+            });
+            
+            this.saveTimersToStorage();
         } catch (error) {
-            console.error('Error checking server completion:', error);
-            return false;
+            console.error('Error checking server timer status:', error);
         }
+        return hasCompletedTimers;
     }
     
     handleServerCompletion(taskId, pointsEarned) {
@@ -626,6 +663,14 @@ class TimerManager {
             }
         });
         
+        // Server pushes timer completions over the live events stream
+        window.addEventListener('darkfocus:timer_complete', (e) => {
+            const taskId = String(e.detail.task_id);
+            if (this.timers.has(taskId)) {
+                this.handleServerCompletion(taskId, e.detail.points_earned);
+            }
+        });
+        
         // Enhanced mobile-friendly page visibility handling
         document.addEventListener('visibilitychange', () => {
             this.handleVisibilityChange();
@@ -693,7 +738,7 @@ class TimerManager {
         }
         
         // Check for server-side completed timers first
-        this.checkForCompletedTimers();
+        this.checkForCompletedTimers(true);
         
         // Update timer displays
         this.findAndInitializeTimers();
@@ -702,54 +747,58 @@ class TimerManager {
         this.saveTimersToStorage();
     }
     
-    async checkForCompletedTimers() {
+    async checkForCompletedTimers(force = false) {
         let hasCompletedTimers = false;
+        
+        if (this.timers.size === 0) {
+            return false;
+        }
+        
+        // First check server-side completion for all timers in a single request,
+        // throttled because this runs on every click, key press and touch.
+        // While the live events stream is up, completions are pushed instead.
+        const pushed = window.liveEvents && window.liveEvents.connected;
+        if (force || (!pushed && Date.now() - this.lastStatusCheck >= this.statusCheckInterval)) {
+            this.lastStatusCheck = Date.now();
+            hasCompletedTimers = await this.syncServerStatus();
+        }
+        
         const now = Date.now();
         
         // Create array copy to avoid modification during iteration
         const timerEntries = Array.from(this.timers.entries());
         
-        // Check all timers for completion
+        // Then check client-side completion for timers the server didn't complete
         for (const [taskId, timer] of timerEntries) {
             // Skip if timer was already removed
             if (!this.timers.has(taskId)) {
                 continue;
             }
             
-            // First check server-side completion
-            const serverCompleted = await this.checkServerCompletion(taskId);
-            if (serverCompleted) {
+            // Check if timer was supposed to complete while in background
+            if (timer.endTimestamp && timer.endTimestamp <= now) {
+                console.log(`Found client-side completed timer: ${taskId}`);
                 hasCompletedTimers = true;
-                continue; // Server handled completion, skip client-side checks
+                timer.remainingSeconds = 0;
+                timer.isPaused = true;
+                delete timer.endTimestamp;
+                
+                // Trigger completion immediately
+                setTimeout(() => {
+                    if (this.timers.has(taskId)) { // Final check before completion
+                        this.handleTimerCompletion(taskId);
+                    }
+                }, 100);
             }
-            
-            // Then check client-side completion only if server didn't complete it
-            if (this.timers.has(taskId)) { // Double-check timer still exists
-                // Check if timer was supposed to complete while in background
-                if (timer.endTimestamp && timer.endTimestamp <= now) {
-                    console.log(`Found client-side completed timer: ${taskId}`);
-                    hasCompletedTimers = true;
-                    timer.remainingSeconds = 0;
-                    timer.isPaused = true;
-                    delete timer.endTimestamp;
-                    
-                    // Trigger completion immediately
-                    setTimeout(() => {
-                        if (this.timers.has(taskId)) { // Final check before completion
-                            this.handleTimerCompletion(taskId);
-                        }
-                    }, 100);
-                }
-                // Also check for paused timers with 0 remaining time
-                else if (timer.isPaused && timer.remainingSeconds <= 0) {
-                    console.log(`Found paused completed timer: ${taskId}`);
-                    hasCompletedTimers = true;
-                    setTimeout(() => {
-                        if (this.timers.has(taskId)) { // Final check before completion
-                            this.handleTimerCompletion(taskId);
-                        }
-                    }, 100);
-                }
+            // Also check for paused timers with 0 remaining time
+            else if (timer.isPaused && timer.remainingSeconds <= 0) {
+                console.log(`Found paused completed timer: ${taskId}`);
+                hasCompletedTimers = true;
+                setTimeout(() => {
+                    if (this.timers.has(taskId)) { // Final check before completion
+                        this.handleTimerCompletion(taskId);
+                    }
+                }, 100);
             }
         }
         
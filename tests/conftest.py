@@ -0,0 +1,55 @@
+import os
+import pytest
+
+# create_app() reads its configuration from the environment
+os.environ.setdefault('SESSION_SECRET', 'test')
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    from app import create_app
+    database = tmp_path_factory.mktemp('db') / 'test.sqlite'
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{database}",
+        'WTF_CSRF_ENABLED': False,
+        'MAIL_SUPPRESS_SEND': True,
+        # Views over their query budget fail the test instead of logging a warning
+        'QUERY_BUDGET_STRICT': True,
+    })
+
+
+@pytest.fixture
+def db(app):
+    """An empty schema and cache for each test, inside an app context"""
+    from extensions import db
+    from cache import app_cache
+    from presence import presence_buffer
+    with app.app_context():
+        db.create_all()
+        app_cache.clear()
+        yield db
+        # Buffered last_active writes would otherwise land after the tables are gone
+        presence_buffer.flush()
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(db):
+    from models import User
+    user = User(username='alice', email='alice@example.com', is_verified=True)
+    user.password_hash = 'unused'
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client(app, user):
+    """A test client logged in as user"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
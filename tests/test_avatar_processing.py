@@ -0,0 +1,65 @@
+import os
+import time
+import pytest
+from PIL import Image
+from avatar_processing import RETRY_PREFIX, avatar_processor
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    monkeypatch.setattr(avatar_processor, 'staging_folder', str(tmp_path / 'staging'))
+    monkeypatch.setattr(avatar_processor, 'output_folder', str(tmp_path / 'avatars'))
+    os.makedirs(avatar_processor.staging_folder)
+    os.makedirs(avatar_processor.output_folder)
+    return avatar_processor.staging_folder
+
+
+def stage(folder, name, color, age):
+    path = os.path.join(folder, name)
+    Image.new('RGB', (32, 32), color).save(path, 'PNG')
+    staged_at = time.time() - age
+    os.utime(path, (staged_at, staged_at))
+    return path
+
+
+def wait_for_processing():
+    avatar_processor._executor.shutdown(wait=True)
+    avatar_processor._executor = None
+
+
+def test_requeue_processes_the_newest_abandoned_upload(db, user, folders):
+    from models import User
+    older = stage(folders, f"{user.id}_{'a' * 16}_old.png", 'red', age=1200)
+    newer = stage(folders, f"{user.id}_{'b' * 16}_new.png", 'blue', age=900)
+    recent = stage(folders, f"{user.id}_{'c' * 16}_recent.png", 'green', age=10)
+    expected = avatar_processor.file_digest(newer)
+
+    assert avatar_processor.requeue_staged(min_age=600) == 1
+    wait_for_processing()
+
+    db.session.expire_all()
+    assert db.session.get(User, user.id).profile_image == expected
+    # The upload still within min_age may be in another worker's queue
+    assert os.listdir(folders) == [os.path.basename(recent)]
+    assert not os.path.exists(older)
+
+
+def test_requeue_skips_uploads_older_than_the_current_avatar(db, user, folders):
+    staged = stage(folders, f"{user.id}_{'a' * 16}_old.png", 'red', age=1200)
+    avatar_processor.write_variants(staged, 'f' * 20)
+    user.profile_image = 'f' * 20
+    db.session.commit()
+
+    assert avatar_processor.requeue_staged(min_age=600) == 0
+    assert os.listdir(folders) == []
+
+
+def test_collect_orphans_removes_stale_retried_uploads(db, user, folders):
+    stale = stage(folders, f"{RETRY_PREFIX}{user.id}_{'a' * 16}_x.png", 'red', age=7200)
+    fresh = stage(folders, f"{RETRY_PREFIX}{user.id}_{'b' * 16}_y.png", 'red', age=60)
+    untried = stage(folders, f"{user.id}_{'c' * 16}_z.png", 'red', age=7200)
+
+    avatar_processor.collect_orphans(grace_seconds=3600)
+
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh) and os.path.exists(untried)
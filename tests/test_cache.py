@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+import threading
+import time
+import pytest
+import cache
+from cache import AppCache, MemoryBackend, RedisBackend, add_cache_tags, app_cache
+
+
+@pytest.fixture
+def redis_backend():
+    fakeredis = pytest.importorskip('fakeredis')
+    backend = RedisBackend('redis://localhost:6379/0')
+    backend.client = fakeredis.FakeRedis()
+    return backend
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request):
+    if request.param == 'redis':
+        return request.getfixturevalue('redis_backend')
+    return MemoryBackend()
+
+
+def make_cache(backend):
+    app_cache = AppCache()
+    app_cache.backend = backend
+    return app_cache
+
+
+def test_get_set_delete(backend):
+    app_cache = make_cache(backend)
+    assert app_cache.get('missing', 'default') == 'default'
+    app_cache.set('key', {'value': 1}, ttl=60)
+    assert app_cache.get('key') == {'value': 1}
+    app_cache.delete('key')
+    assert app_cache.get('key') is None
+
+
+def test_invalidate_tags_removes_only_tagged_entries(backend):
+    app_cache = make_cache(backend)
+    app_cache.set('first', 1, tags=['user:1'])
+    app_cache.set('second', 2, tags=['user:1', 'user:2'])
+    app_cache.set('third', 3, tags=['user:2'])
+    app_cache.invalidate_tags('user:1')
+    assert app_cache.get('first') is None
+    assert app_cache.get('second') is None
+    assert app_cache.get('third') == 3
+
+
+def test_memory_entries_expire(monkeypatch):
+    backend = MemoryBackend()
+    now = time.monotonic()
+    backend.set('key', 'value', ttl=10)
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now + 11)
+    assert backend.get('key') is cache._MISSING
+
+
+def test_memory_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', 1, ttl=60)
+    backend.set('b', 2, ttl=60)
+    backend.get('a')
+    backend.set('c', 3, ttl=60)
+    assert backend.get('a') == 1
+    assert backend.get('b') is cache._MISSING
+    assert backend.get('c') == 3
+
+
+def test_redis_fill_lock(redis_backend):
+    assert redis_backend.wait_for_fill('key', timeout=1)
+    started = time.monotonic()
+    assert not redis_backend.wait_for_fill('key', timeout=0.2)
+    assert time.monotonic() - started >= 0.2
+    redis_backend.release_fill('key')
+    assert redis_backend.wait_for_fill('key', timeout=1)
+
+
+def test_get_or_set_coalesces_concurrent_misses(backend):
+    app_cache = make_cache(backend)
+    builds = []
+    release = threading.Event()
+
+    def build():
+        builds.append(1)
+        release.wait(5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app_cache.get_or_set('key', build)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['value'] * 5
+    assert len(builds) == 1
+
+
+def test_backend_errors_fall_back_to_building():
+    class BrokenBackend:
+        def __getattr__(self, name):
+            def fail(*args):
+                raise ConnectionError('down')
+            return fail
+
+    app_cache = make_cache(BrokenBackend())
+    assert app_cache.get_or_set('key', lambda: 'value') == 'value'
+    assert app_cache.get('key', 'default') == 'default'
+
+
+def test_memoize_uses_key_and_tags(backend):
+    app_cache = make_cache(backend)
+    calls = []
+
+    @app_cache.memoize(ttl=60, key=lambda user_id: str(user_id), tags=lambda user_id: [f"user:{user_id}"])
+    def context(user_id):
+        calls.append(user_id)
+        return {'user_id': user_id}
+
+    assert context(1) == context(1) == {'user_id': 1}
+    assert calls == [1]
+    app_cache.invalidate_tags('user:1')
+    context(1)
+    assert calls == [1, 1]
+
+
+def test_commit_invalidates_tags_of_written_models(db, user):
+    app_cache.set('context', 'stale', tags=[f"user:{user.id}"])
+    user.total_points = 10
+    db.session.commit()
+    assert app_cache.get('context') is None
+
+
+def test_rollback_keeps_entries(db, user):
+    app_cache.set('context', 'cached', tags=[f"user:{user.id}"])
+    add_cache_tags(db.session, f"user:{user.id}")
+    user.total_points = 10
+    db.session.flush()
+    db.session.rollback()
+    assert app_cache.get('context') == 'cached'
+
+
+def test_clear_ai_history_invalidates_user_context(db, user, client):
+    from ai_friend_service import ai_friend_service
+    from models import UserQuality
+
+    db.session.add(UserQuality(user_id=user.id, quality_name='favorite_subject', quality_value='physics'))
+    db.session.commit()
+    assert ai_friend_service.get_user_context(user)['qualities'] == {'favorite_subject': 'physics'}
+
+    response = client.post('/ai-friend/clear-history')
+    assert response.status_code == 200
+    assert ai_friend_service.get_user_context(user)['qualities'] == {}
+
+
+def test_archiving_tasks_invalidates_their_users(app, db, user):
+    from models import Task
+    from retention_service import retention_service
+
+    completed_at = datetime.utcnow() - timedelta(days=app.config['TASK_ARCHIVE_DAYS'] + 1)
+    db.session.add(Task(user_id=user.id, title='Old task', duration_minutes=25,
+                        is_completed=True, completed_at=completed_at))
+    db.session.commit()
+    app_cache.set('context', 'stale', tags=[f"user:{user.id}"])
+
+    assert retention_service.archive_completed_tasks() == 1
+    assert app_cache.get('context') is None
+
+
+def test_memoize_uses_local_ttl_unless_shared(backend):
+    app_cache = make_cache(backend)
+    ttls = []
+    app_cache.get_or_set = lambda key, build, ttl=None, tags=(): ttls.append(ttl)
+
+    @app_cache.memoize(ttl=300, local_ttl=10)
+    def context(user_id):
+        return {'user_id': user_id}
+
+    context(1)
+    assert ttls == [300 if isinstance(backend, RedisBackend) else 10]
+
+
+def test_user_context_is_rebuilt_on_a_new_day(db, user, monkeypatch):
+    import ai_friend_service as service
+
+    class Tomorrow(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=1)
+
+    first = service.ai_friend_service.get_user_context(user)
+    assert service.ai_friend_service.get_user_context(user) is first
+    monkeypatch.setattr(service, 'datetime', Tomorrow)
+    assert service.ai_friend_service.get_user_context(user) is not first
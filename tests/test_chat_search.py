@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from chat_search import FTS_TABLE, search_chat_history, setup_chat_search
+
+
+@pytest.fixture
+def chat(db, user):
+    """Adds messages for user; the search table is dropped afterwards since drop_all doesn't know it"""
+    from models import AIChatHistory
+    setup_chat_search()
+
+    def add(message, days_ago=0):
+        row = AIChatHistory(user_id=user.id, sender='user', message=message,
+                            timestamp=datetime.utcnow() - timedelta(days=days_ago))
+        db.session.add(row)
+        db.session.commit()
+        return row
+
+    yield add
+    db.session.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    db.session.commit()
+
+
+def test_full_text_search_only_returns_the_users_matches(db, user, chat):
+    from models import User, AIChatHistory
+    other = User(username='bob', email='bob@example.com', password_hash='unused')
+    db.session.add(other)
+    db.session.commit()
+    chat('Studying organic chemistry tonight')
+    chat('Going for a run')
+    db.session.add(AIChatHistory(user_id=other.id, sender='user', message='chemistry homework'))
+    db.session.commit()
+
+    results, has_more = search_chat_history(user.id, 'chemistry')
+
+    assert [r['message'] for r in results] == ['Studying organic chemistry tonight']
+    assert not has_more
+
+
+def test_like_fallback_matches_wildcards_literally(db, user, chat, monkeypatch):
+    chat('Scored 100% on the quiz')
+    chat('Scored 1000 on the quiz')
+    chat('snake_case names')
+    chat('snakeXcase names')
+    monkeypatch.setattr(db.engine.dialect, 'name', 'other')
+
+    assert [r['message'] for r in search_chat_history(user.id, '100%')[0]] == ['Scored 100% on the quiz']
+    assert [r['message'] for r in search_chat_history(user.id, 'snake_case')[0]] == ['snake_case names']
+
+
+def test_archived_messages_are_searched_on_request(app, db, user, chat):
+    from retention_service import retention_service
+    chat('Old notes about photosynthesis', days_ago=app.config['CHAT_RETENTION_DAYS'] + 5)
+    chat('New notes about photosynthesis')
+    retention_service.archive_old_messages()
+
+    live, _ = search_chat_history(user.id, 'photosynthesis')
+    archived, has_more = search_chat_history(user.id, 'photosynthesis', archived=True)
+
+    assert [r['message'] for r in live] == ['New notes about photosynthesis']
+    assert [r['message'] for r in archived] == ['Old notes about photosynthesis']
+    assert archived[0]['archived'] and not has_more
+
+    retention_service.request_clear(user.id)
+    db.session.commit()
+    assert search_chat_history(user.id, 'photosynthesis', archived=True) == ([], False)
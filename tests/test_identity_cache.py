@@ -0,0 +1,25 @@
+from sqlalchemy import update
+from identity_cache import identity_cache
+
+
+def test_completing_a_task_builds_on_points_written_elsewhere(db, user):
+    from models import Task, User
+    task = Task(user_id=user.id, title='Read', duration_minutes=60)
+    db.session.add(task)
+    db.session.commit()
+    task_id, user_id = task.id, user.id
+    identity_cache.clear()
+    identity_cache.load_user(user_id)
+    db.session.remove()
+
+    # Another process awards points; this one's snapshot doesn't see them
+    with db.engine.begin() as connection:
+        connection.execute(update(User.__table__).where(User.__table__.c.id == user_id).values(total_points=100))
+
+    current_user = identity_cache.load_user(user_id)
+    assert current_user.total_points == 0
+    points_earned = db.session.get(Task, task_id).complete_task()
+    db.session.commit()
+    db.session.remove()
+
+    assert db.session.get(User, user_id).total_points == 100 + points_earned
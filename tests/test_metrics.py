@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip('prometheus_client')
+
+
+def test_metrics_need_a_token_outside_debug(app, monkeypatch):
+    from metrics import metrics
+    monkeypatch.setattr(metrics, 'token', None)
+    assert app.test_client().get('/metrics').status_code == 403
+
+
+def test_metrics_check_the_bearer_token(app, monkeypatch):
+    from metrics import metrics
+    monkeypatch.setattr(metrics, 'token', 'secret')
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert b'darkfocus_http_requests_total' in response.data
@@ -0,0 +1,22 @@
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect, text
+
+SERIES_TABLES = ('ai_chat_archive', 'chat_clear_request', 'sync_operation', 'data_version')
+
+
+def test_upgrade_creates_the_tables_the_models_added(db):
+    import models  # noqa: F401
+    for table in SERIES_TABLES:
+        db.metadata.tables[table].drop(db.engine)
+    stamp(revision='0005_drop_stored_tokens')
+
+    try:
+        upgrade()
+        with db.engine.connect() as connection:
+            assert all(inspect(connection).has_table(table) for table in SERIES_TABLES)
+            assert compare_metadata(MigrationContext.configure(connection), db.metadata) == []
+    finally:
+        db.session.execute(text("DROP TABLE alembic_version"))
+        db.session.commit()
@@ -0,0 +1,36 @@
+import pytest
+from password_hashing import HashingBusy, HostSlots, PasswordHasher
+
+pytest.importorskip('fcntl')
+
+
+def test_slots_are_shared_between_openers_of_the_same_folder(tmp_path):
+    # Each HostSlots opens its own file descriptions, as separate processes do
+    first = HostSlots(str(tmp_path), 1)
+    second = HostSlots(str(tmp_path), 1)
+    slot = first.acquire(timeout=0)
+    assert slot == 0
+    assert second.acquire(timeout=0.05) is None
+    first.release(slot)
+    assert second.acquire(timeout=0) == 0
+
+
+def test_threads_in_one_process_take_separate_slots(tmp_path):
+    slots = HostSlots(str(tmp_path), 2)
+    assert {slots.acquire(timeout=0), slots.acquire(timeout=0)} == {0, 1}
+    assert slots.acquire(timeout=0) is None
+
+
+def test_hashing_is_refused_while_another_process_holds_every_slot(tmp_path):
+    hasher = PasswordHasher()
+    hasher.max_workers = 1
+    hasher.queue_timeout = 0.05
+    hasher.slot_folder = str(tmp_path)
+    hasher.method = 'pbkdf2:sha256:1000'
+
+    other_process = HostSlots(str(tmp_path), 1)
+    slot = other_process.acquire(timeout=0)
+    with pytest.raises(HashingBusy):
+        hasher.hash('password')
+    other_process.release(slot)
+    assert hasher.verify(hasher.hash('password'), 'password')
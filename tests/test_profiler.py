@@ -0,0 +1,31 @@
+import os
+import signal
+import time
+
+
+def test_token_is_only_accepted_in_the_header(app, monkeypatch):
+    from profiler import profiler
+    monkeypatch.setattr(profiler, 'token', 'secret')
+    with app.test_request_context('/?_profile=secret'):
+        assert not profiler._authorized()
+    with app.test_request_context('/', headers={'X-Profile': 'secret'}):
+        assert profiler._authorized()
+
+
+def test_sigurg_toggles_sampling(tmp_path, monkeypatch):
+    from profiler import profiler
+    monkeypatch.setattr(profiler, 'dump_folder', str(tmp_path))
+    previous = signal.getsignal(signal.SIGURG)
+    profiler.install_signal_handler()
+    try:
+        os.kill(os.getpid(), signal.SIGURG)
+        deadline = time.monotonic() + 5
+        while profiler._sampler is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert profiler._sampler is not None
+        os.kill(os.getpid(), signal.SIGURG)
+        while not list(tmp_path.iterdir()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(list(tmp_path.iterdir())) == 1
+    finally:
+        signal.signal(signal.SIGURG, previous)
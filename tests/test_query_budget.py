@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import logging
+import pytest
+from query_stats import QueryBudgetExceeded, query_stats
+
+HOT_PAGES = ('/home', '/progress', '/leaderboard', '/timer_status')
+
+
+@pytest.fixture
+def busy_user(db, user):
+    """A user with open, running, finished and completed tasks and a few days of stats"""
+    from models import DailyStats, Task, User
+    now = datetime.utcnow()
+    for day in range(10):
+        db.session.add(DailyStats(user_id=user.id, date=now.date() - timedelta(days=day),
+                                  minutes_studied=30, points_earned=10, tasks_completed=1))
+    for i in range(8):
+        db.session.add(Task(user_id=user.id, title=f"Completed {i}", duration_minutes=25,
+                            is_completed=True, completed_at=now - timedelta(days=i)))
+        db.session.add(Task(user_id=user.id, title=f"Open {i}", duration_minutes=25))
+    for i in range(12):
+        db.session.add(User(username=f"rival{i}", email=f"rival{i}@example.com", password_hash='unused',
+                            total_points=i * 10))
+    db.session.commit()
+
+    finished = Task(user_id=user.id, title='Finished timer', duration_minutes=1)
+    db.session.add(finished)
+    db.session.commit()
+    finished.start_timer()
+    db.session.commit()
+    finished.running_timer.expected_completion = finished.expected_completion = now - timedelta(seconds=1)
+    db.session.commit()
+    return user
+
+
+def test_views_declare_budgets(app):
+    for endpoint in ('main.home', 'main.progress', 'main.leaderboard', 'main.timer_status'):
+        assert getattr(app.view_functions[endpoint], 'query_budget', None) is not None
+
+
+@pytest.mark.parametrize('path', HOT_PAGES)
+def test_hot_pages_stay_within_budget(busy_user, client, path):
+    # Strict mode is on in tests, so going over budget raises QueryBudgetExceeded
+    assert client.get(path).status_code == 200
+
+
+def test_leaderboard_has_no_per_user_queries(busy_user, client, caplog):
+    with caplog.at_level(logging.WARNING):
+        assert client.get('/leaderboard').status_code == 200
+    assert 'Probable N+1' not in caplog.text
+
+
+def test_view_over_budget_raises_in_strict_mode(app, busy_user, client, monkeypatch):
+    monkeypatch.setattr(app.view_functions['main.home'], 'query_budget', 1)
+    with pytest.raises(QueryBudgetExceeded, match='main.home ran'):
+        client.get('/home')
+
+
+def test_repeated_statements_are_reported_as_n_plus_one(db, busy_user, caplog):
+    from models import Task, User
+    users = User.query.all()
+    with caplog.at_level(logging.WARNING):
+        with query_stats.track('loop'):
+            for user in users:
+                Task.query.filter_by(user_id=user.id).first()
+    assert f"Probable N+1 in loop: statement ran {len(users)} times" in caplog.text
+
+
+def test_tracked_block_over_budget(db, busy_user, monkeypatch, caplog):
+    from models import User
+
+    def run_queries():
+        with query_stats.track('job', budget=2):
+            for _ in range(3):
+                User.query.first()
+
+    with pytest.raises(QueryBudgetExceeded, match='job ran 3 queries, over its budget of 2'):
+        run_queries()
+
+    monkeypatch.setattr(query_stats, 'strict', False)
+    with caplog.at_level(logging.WARNING):
+        run_queries()
+    assert 'job ran 3 queries, over its budget of 2' in caplog.text
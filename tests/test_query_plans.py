@@ -0,0 +1,17 @@
+from query_plans import check_query_plans
+
+
+def test_hot_queries_use_their_indexes(db):
+    assert check_query_plans() == []
+
+
+def test_other_databases_are_skipped(db, monkeypatch):
+    monkeypatch.setattr(db.engine.dialect, 'name', 'mysql')
+    assert check_query_plans() is None
+
+
+def test_cli_reports_skipped_check(app, db, monkeypatch):
+    monkeypatch.setattr(db.engine.dialect, 'name', 'mysql')
+    result = app.test_cli_runner().invoke(args=['check-query-plans'])
+    assert result.exit_code == 0
+    assert "can't be checked on mysql, skipped" in result.output
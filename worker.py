@@ -0,0 +1,43 @@
+"""
+Background Worker
+Runs the email scheduler, timer auto-completion and retention services in a
+process of their own, so web workers boot without starting any threads.
+Start it with `python worker.py`; it also applies pending migrations on startup.
+"""
+import logging
+import os
+import signal
+import threading
+
+# Share metric samples with the gunicorn workers; must be set before
+# prometheus_client is imported (gunicorn.conf.py does the same)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'prometheus'))
+
+from app import create_app, init_db, start_background_services, stop_background_services  # noqa: E402
+from metrics import clear_dead_process_files, mark_process_dead  # noqa: E402
+from profiler import profiler  # noqa: E402
+
+
+def main():
+    clear_dead_process_files()
+    app = create_app()
+    init_db(app)
+    start_background_services(app)
+    logging.info("Background worker running")
+
+    # SIGURG toggles the sampling profiler in this process, which has no HTTP endpoint
+    profiler.install_signal_handler()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    stopping.wait()
+
+    logging.info("Background worker stopping")
+    stop_background_services()
+    mark_process_dead(os.getpid())
+
+
+if __name__ == '__main__':
+    main()